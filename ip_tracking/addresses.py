@@ -0,0 +1,95 @@
+"""
+Packed IP address helpers.
+
+Every address is normalized to one 128-bit integer with IPv4 mapped into
+::ffff:0:0/96, and stored as its 16-byte big-endian form. Byte order
+matches numeric order, so a single sorted index covers both IP versions
+and a network is one contiguous [first, last] range.
+"""
+import ipaddress
+import socket
+
+IPV4_MAPPED_PREFIX = 0xFFFF << 32
+IPV4_MAPPED_MASK = ((1 << 96) - 1) << 32
+
+
+def parse_ip(text):
+    """
+    Parse an address once; returns (normalized string, 128-bit value), or
+    None if text is not a valid IPv4 or IPv6 address
+    """
+    if not text:
+        return None
+    try:
+        if ':' in text:
+            packed = socket.inet_pton(socket.AF_INET6, text)
+            value = int.from_bytes(packed, 'big')
+            if value & IPV4_MAPPED_MASK == IPV4_MAPPED_PREFIX:
+                return socket.inet_ntop(socket.AF_INET, packed[12:]), value
+            return socket.inet_ntop(socket.AF_INET6, packed), value
+        packed = socket.inet_pton(socket.AF_INET, text)
+    except (OSError, ValueError):
+        return None
+    return socket.inet_ntop(socket.AF_INET, packed), IPV4_MAPPED_PREFIX | int.from_bytes(packed, 'big')
+
+
+def address_value(address):
+    """
+    Return the 128-bit value of an ipaddress object
+    """
+    if address.version == 4:
+        return IPV4_MAPPED_PREFIX | int(address)
+    return int(address)
+
+
+def pack_value(value):
+    return value.to_bytes(16, 'big')
+
+
+def pack_address(address):
+    """
+    Pack an ipaddress object into 16 bytes, mapping IPv4 into IPv6
+    """
+    return pack_value(address_value(address))
+
+
+def pack_ip(text):
+    """
+    Pack an address string into 16 bytes; None if it is not valid
+    """
+    parsed = parse_ip(text)
+    return pack_value(parsed[1]) if parsed else None
+
+
+def unpack_address(packed):
+    """
+    Return the normalized address string for 16 packed bytes
+    """
+    packed = bytes(packed)
+    if packed[:12] == b'\x00' * 10 + b'\xff\xff':
+        return socket.inet_ntop(socket.AF_INET, packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+def network_bounds(network):
+    """
+    Return the (first, last) 128-bit values covered by a network
+    """
+    network = ipaddress.ip_network(network, strict=False)
+    return address_value(network.network_address), address_value(network.broadcast_address)
+
+
+def shard_bounds(shard, shards):
+    """
+    Return the [low, high) value range of shard in 0..shards, which together
+    cover every address: shards equal slices of the IPv4 space, then one
+    shard for IPv6 above it (high is None). Addresses below ::ffff:0:0
+    fall in the first shard.
+    """
+    ipv4_end = IPV4_MAPPED_PREFIX + (1 << 32)
+    if shard == shards:
+        return ipv4_end, None
+    step = (1 << 32) // shards
+    low = IPV4_MAPPED_PREFIX + shard * step if shard else 0
+    high = IPV4_MAPPED_PREFIX + (shard + 1) * step if shard < shards - 1 else ipv4_end
+    return low, high
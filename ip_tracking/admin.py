@@ -1,12 +1,44 @@
 from django.contrib import admin
-from .models import RequestLog, BlockedIP
+from .changelist import EstimatedCountPaginator, IndexedDateQuerySet, KeysetChangeList, search_network
+from .models import RequestLog, RequestLogHourly, BlockedIP, BlockedNetwork
 
 @admin.register(RequestLog)
 class RequestLogAdmin(admin.ModelAdmin):
+    """
+    Sized for very large tables: estimated counts, keyset pages, an indexed
+    date hierarchy and IP-only search on the packed address index
+    """
     list_display = ('ip_address', 'path', 'timestamp')
-    list_filter = ('timestamp', 'path')
-    search_fields = ('ip_address', 'path')
+    date_hierarchy = 'timestamp'
+    search_fields = ('ip_address',)
+    search_help_text = 'IP address, CIDR network or dotted IPv4 prefix (e.g. 203.0.113.)'
     readonly_fields = ('ip_address', 'path', 'timestamp')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Sorting by another column would need a full sort of the table
+    sortable_by = ()
+    
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+    
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return IndexedDateQuerySet(queryset.model, query=queryset.query.chain(), using=queryset.db)
+    
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        network = search_network(search_term)
+        if network is None:
+            return queryset.none(), False
+        return queryset.in_network(network), False
+
+@admin.register(RequestLogHourly)
+class RequestLogHourlyAdmin(admin.ModelAdmin):
+    list_display = ('hour', 'ip_address', 'path', 'country', 'request_count')
+    date_hierarchy = 'hour'
+    search_fields = ('ip_address', 'path')
+    readonly_fields = ('hour', 'ip_address', 'path', 'country', 'request_count')
 
 @admin.register(BlockedIP)
 class BlockedIPAdmin(admin.ModelAdmin):
@@ -14,4 +46,10 @@ class BlockedIPAdmin(admin.ModelAdmin):
     list_filter = ('created_at',)
     search_fields = ('ip_address', 'reason')
     readonly_fields = ('created_at',)
-    
\ No newline at end of file
+
+@admin.register(BlockedNetwork)
+class BlockedNetworkAdmin(admin.ModelAdmin):
+    list_display = ('network', 'created_at', 'reason')
+    list_filter = ('created_at',)
+    search_fields = ('network', 'reason')
+    readonly_fields = ('created_at',)
@@ -0,0 +1,155 @@
+"""
+Cached traffic analytics for dashboards.
+
+Reports are built from the hourly rollups (see reports.py) over a window
+that ends at the start of the current time bucket. The window only moves
+once per bucket, so every poll within a bucket maps to the same cache key
+and is answered without touching the database. Each cached report keeps an
+ETag of its body so pollers can revalidate with If-None-Match.
+"""
+import hashlib
+import json
+import re
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from . import reports
+from .geolocation import SingleFlight
+from .ratelimit import PERIODS
+from .rollups import truncate_to_hour
+from .sketches import load_traffic_sketch
+
+WINDOW_PATTERN = re.compile(r'^(\d+)([mhd])$')
+CACHE_PREFIX = 'ip_tracking:analytics'
+
+
+def parse_window(value):
+    """
+    Parse a window such as '90m', '24h' or '7d' into seconds
+    """
+    match = WINDOW_PATTERN.match(value.strip())
+    if match is None:
+        raise ValueError(f"Invalid window: {value}")
+    seconds = int(match.group(1)) * PERIODS[match.group(2)]
+    max_window = getattr(settings, 'IP_TRACKING_ANALYTICS_MAX_WINDOW', 31 * 86400)
+    if not 0 < seconds <= max_window:
+        raise ValueError(f"Window must be between 1m and {max_window // 86400}d")
+    return seconds
+
+
+def top_ips(since, until, limit):
+    return [
+        {'ip_address': ip_address, 'requests': count}
+        for ip_address, count in reports.top('ip_address', since, until, limit)
+    ]
+
+
+def top_paths(since, until, limit):
+    return [
+        {'path': path, 'requests': count}
+        for path, count in reports.top('path', since, until, limit)
+    ]
+
+
+def countries(since, until, limit):
+    return [
+        {'country': country or None, 'requests': count}
+        for country, count in reports.top('country', since, until, limit)
+    ]
+
+
+def request_rate(since, until, limit):
+    hourly = reports.hourly_request_rate(since, until)
+    total = sum(count for _, count in hourly)
+    return {
+        'total': total,
+        'per_second': total / (until - since).total_seconds(),
+        'hourly': [{'hour': hour, 'requests': count} for hour, count in hourly],
+    }
+
+
+def live_top_ips(since, until, limit):
+    sketch = load_traffic_sketch(since, until)
+    return [
+        {'ip_address': ip_address, 'requests': upper, 'max_error': upper - lower}
+        for ip_address, upper, lower in sketch.top_ips_with_bounds(limit)
+    ]
+
+
+def live_top_paths(since, until, limit):
+    sketch = load_traffic_sketch(since, until)
+    return [
+        {'path': path, 'requests': count, 'max_error': error, 'distinct_ips': distinct_ips}
+        for path, count, error, distinct_ips in sketch.top_paths_with_distinct_ips(limit)
+    ]
+
+
+def live_summary(since, until, limit):
+    sketch = load_traffic_sketch(since, until)
+    return {
+        'requests': sketch.requests,
+        'distinct_ips': sketch.distinct_ips.count(),
+    }
+
+
+REPORTS = {
+    'top-ips': top_ips,
+    'top-paths': top_paths,
+    'countries': countries,
+    'request-rate': request_rate,
+    # Approximate, from the traffic sketches; windows up to IP_TRACKING_SKETCH_RETENTION
+    'live-top-ips': live_top_ips,
+    'live-top-paths': live_top_paths,
+    'live-summary': live_summary,
+}
+
+
+class AnalyticsCache:
+    """
+    Serve reports from the cache, building each one at most once per bucket
+    per process
+    """
+
+    def __init__(self, bucket_seconds=None):
+        if bucket_seconds is None:
+            bucket_seconds = getattr(settings, 'IP_TRACKING_ANALYTICS_BUCKET_SECONDS', 60)
+        self.bucket_seconds = bucket_seconds
+        self.single_flight = SingleFlight()
+
+    def get(self, name, window, limit, now=None):
+        """
+        Return (JSON body, ETag, seconds until the bucket ends) for a report
+        """
+        now = time.time() if now is None else now
+        bucket_start = int(now // self.bucket_seconds * self.bucket_seconds)
+        key = f"{CACHE_PREFIX}:{name}:{window}:{limit}:{bucket_start}"
+
+        cached = cache.get(key)
+        if cached is None:
+            # Concurrent misses in this process share one build
+            cached = self.single_flight.do(key, self._build, key, name, window, limit, bucket_start)
+        body, etag = cached
+        return body, etag, bucket_start + self.bucket_seconds - now
+
+    def _build(self, key, name, window, limit, bucket_start):
+        until = datetime.fromtimestamp(bucket_start, tz=dt_timezone.utc)
+        since = until - timedelta(seconds=window)
+        if not name.startswith('live-'):
+            # Rollups have hour granularity, so the window starts on the hour
+            since = truncate_to_hour(since)
+        body = json.dumps({
+            'report': name,
+            'since': since,
+            'until': until,
+            'results': REPORTS[name](since, until, limit),
+        }, cls=DjangoJSONEncoder).encode('utf-8')
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        # Kept a little past the bucket so slow pollers still revalidate
+        cache.set(key, (body, etag), self.bucket_seconds * 2)
+        return body, etag
+
+
+# Create a global instance
+analytics_cache = AnalyticsCache()
@@ -4,3 +4,7 @@ class IpTrackingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ip_tracking'
     verbose_name = 'IP Tracking'
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
@@ -0,0 +1,196 @@
+import bisect
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from .addresses import network_bounds, parse_ip
+from .models import BlockedIP, BlockedNetwork
+
+BLOCKLIST_VERSION_KEY = 'ip_tracking:blocklist:version'
+
+
+def bump_blocklist_version():
+    """
+    Publish a new blocklist version so every worker reloads its snapshot
+    """
+    cache.set(BLOCKLIST_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+class IntervalTable:
+    """
+    Sorted, non-overlapping address intervals.
+
+    Single addresses and networks are both compiled to [first, last] integer
+    ranges; overlapping and adjacent ranges are merged, so a lookup is one
+    bisect over the range starts no matter how many rules produced them.
+    """
+
+    def __init__(self, ranges=()):
+        self.starts = []
+        self.ends = []
+        for first, last in sorted(ranges):
+            if self.ends and first <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], last)
+            else:
+                self.starts.append(first)
+                self.ends.append(last)
+
+    def __contains__(self, value):
+        index = bisect.bisect_right(self.starts, value) - 1
+        return index >= 0 and value <= self.ends[index]
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class BlocklistSnapshot:
+    """
+    In-process, read-only copy of the BlockedIP and BlockedNetwork tables.
+
+    The snapshot holds one IntervalTable of 128-bit packed address values
+    (IPv4 mapped into IPv6). It is reloaded only when
+    the version stamp in the shared cache changes, and the stamp itself is
+    checked at most once per check interval. A reload is also forced once the
+    snapshot is older than max_age, which bounds staleness even when the
+    configured cache is not shared between processes.
+    """
+
+    def __init__(self, check_interval=None, max_age=None):
+        if check_interval is None:
+            check_interval = getattr(settings, 'IP_TRACKING_BLOCKLIST_CHECK_INTERVAL', 5)
+        if max_age is None:
+            max_age = getattr(settings, 'IP_TRACKING_BLOCKLIST_MAX_AGE', 60)
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._table = IntervalTable()
+        self._version = None
+        self._loaded_at = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def is_blocked(self, ip_address, value=None):
+        """
+        Check if the IP address is in the current snapshot. Pass the packed
+        value from parse_ip to skip parsing the address again.
+        """
+        self.refresh()
+        return self._contains(ip_address, value)
+
+    async def ais_blocked(self, ip_address, value=None):
+        """
+        Async variant of is_blocked for the ASGI request path
+        """
+        await self.arefresh()
+        return self._contains(ip_address, value)
+
+    def _contains(self, ip_address, value=None):
+        if value is None:
+            parsed = parse_ip(ip_address)
+            if parsed is None:
+                return False
+            value = parsed[1]
+        return value in self._table
+
+    def refresh(self, force=False):
+        """
+        Reload the snapshot if the published version has changed
+        """
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return
+
+            version = self._current_version()
+            expired = self._loaded_at is None or now - self._loaded_at >= self.max_age
+            if force or expired or version != self._version:
+                self._table = self._load()
+                self._version = version
+                self._loaded_at = now
+            self._checked_at = now
+
+    async def arefresh(self, force=False):
+        """
+        Async variant of refresh using async cache and ORM calls.
+        Only one coroutine reloads at a time; the others keep serving the
+        current snapshot instead of waiting.
+        """
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            version = await self._acurrent_version()
+            expired = self._loaded_at is None or now - self._loaded_at >= self.max_age
+            if force or expired or version != self._version:
+                ip_addresses = [
+                    ip_address async for ip_address in
+                    BlockedIP.objects.order_by().values_list('ip_address', flat=True)
+                ]
+                networks = [
+                    network async for network in
+                    BlockedNetwork.objects.order_by().values_list('network', flat=True)
+                ]
+                self._table = self._compile(ip_addresses, networks)
+                self._version = version
+                self._loaded_at = now
+            self._checked_at = now
+        finally:
+            self._lock.release()
+
+    def _current_version(self):
+        """
+        Read the published version, creating one if the cache has none yet
+        """
+        try:
+            version = cache.get(BLOCKLIST_VERSION_KEY)
+            if version is None:
+                cache.add(BLOCKLIST_VERSION_KEY, uuid.uuid4().hex, None)
+                version = cache.get(BLOCKLIST_VERSION_KEY)
+            return version
+        except Exception:
+            # Fall back to the max_age reload if the cache is unavailable
+            return self._version
+
+    async def _acurrent_version(self):
+        try:
+            version = await cache.aget(BLOCKLIST_VERSION_KEY)
+            if version is None:
+                await cache.aadd(BLOCKLIST_VERSION_KEY, uuid.uuid4().hex, None)
+                version = await cache.aget(BLOCKLIST_VERSION_KEY)
+            return version
+        except Exception:
+            return self._version
+
+    def _load(self):
+        """
+        Compile the BlockedIP and BlockedNetwork tables into interval tables
+        """
+        return self._compile(
+            BlockedIP.objects.order_by().values_list('ip_address', flat=True).iterator(),
+            BlockedNetwork.objects.order_by().values_list('network', flat=True).iterator()
+        )
+
+    def _compile(self, ip_addresses, networks):
+        ranges = []
+        for ip_address in ip_addresses:
+            parsed = parse_ip(ip_address)
+            if parsed is not None:
+                ranges.append((parsed[1], parsed[1]))
+
+        for network in networks:
+            try:
+                ranges.append(network_bounds(network))
+            except ValueError:
+                continue
+
+        return IntervalTable(ranges)
+
+
+# Create a global instance
+blocklist = BlocklistSnapshot()
@@ -0,0 +1,250 @@
+"""
+Admin changelist support for very large tables.
+
+- EstimatedCountPaginator replaces the changelist's COUNT(*) with the
+  database's row estimate, or a count capped at a fixed number of rows.
+- KeysetChangeList pages by a (timestamp, id) cursor instead of OFFSET.
+- IndexedDateQuerySet builds the date hierarchy from index range probes
+  instead of a DISTINCT over every row.
+"""
+import ipaddress
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from .models import IPQuerySet
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+
+
+def estimate_row_count(model, using='default'):
+    """
+    Return the database's estimate of the rows in model's table, or None
+    when no cheap estimate is available
+    """
+    connection = connections[using]
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Sums the partitions too when the table is partitioned
+                cursor.execute(
+                    "SELECT SUM(GREATEST(c.reltuples, 0))::bigint FROM pg_class c "
+                    "WHERE c.oid = %s::regclass "
+                    "OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = %s::regclass)",
+                    [table, table]
+                )
+            elif connection.vendor == 'mysql':
+                cursor.execute(
+                    "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                    [table]
+                )
+            else:
+                # Both ends of the primary key index; close enough when rows
+                # are only deleted from the old end by retention
+                pk = connection.ops.quote_name(model._meta.pk.column)
+                cursor.execute(
+                    f"SELECT MAX({pk}) - MIN({pk}) + 1 FROM {connection.ops.quote_name(table)}"
+                )
+            row = cursor.fetchone()
+    except Exception:
+        return None
+    if row is None or not row[0]:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts more than exact_count_limit rows. An
+    unfiltered list reports the table's estimated size instead; a filtered
+    list with more rows reports the limit with is_capped set.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.exact_count_limit = getattr(settings, 'IP_TRACKING_ADMIN_EXACT_COUNT_LIMIT', 10000)
+        self.is_estimate = False
+        self.is_capped = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.exact_count_limit:
+                self.is_estimate = True
+                return estimate
+        # COUNT over a LIMIT subquery stops reading at the cap
+        count = queryset.order_by()[:self.exact_count_limit + 1].count()
+        if count > self.exact_count_limit:
+            self.is_capped = True
+            return self.exact_count_limit
+        return count
+
+
+def _truncate(value, kind):
+    return datetime(
+        value.year,
+        value.month if kind != 'year' else 1,
+        value.day if kind == 'day' else 1,
+    )
+
+
+def _next_bucket(start, kind):
+    if kind == 'year':
+        return start.replace(year=start.year + 1)
+    if kind == 'month':
+        if start.month == 12:
+            return start.replace(year=start.year + 1, month=1)
+        return start.replace(month=start.month + 1)
+    return start + timedelta(days=1)
+
+
+class IndexedDateQuerySet(IPQuerySet):
+    """
+    QuerySet whose datetimes() probes each year, month or day between the
+    first and last value with an EXISTS range query. The admin date
+    hierarchy then costs a few index seeks instead of a DISTINCT over the
+    whole table.
+    """
+
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None, **kwargs):
+        if kind not in ('year', 'month', 'day'):
+            return super().datetimes(field_name, kind, order, tzinfo, **kwargs)
+
+        bounds = self.aggregate(first=Min(field_name), last=Max(field_name))
+        first, last = bounds['first'], bounds['last']
+        if first is None:
+            return []
+        if settings.USE_TZ:
+            tzinfo = tzinfo or timezone.get_current_timezone()
+            first = timezone.localtime(first, tzinfo)
+            last = timezone.localtime(last, tzinfo)
+
+        def aware(value):
+            return timezone.make_aware(value, tzinfo) if settings.USE_TZ else value
+
+        buckets = []
+        start = _truncate(first, kind)
+        while start <= last.replace(tzinfo=None):
+            end = _next_bucket(start, kind)
+            lookups = {f'{field_name}__gte': aware(start), f'{field_name}__lt': aware(end)}
+            if self.filter(**lookups).exists():
+                buckets.append(aware(start))
+            start = end
+        if order == 'DESC':
+            buckets.reverse()
+        return buckets
+
+
+def search_network(term):
+    """
+    Turn an admin search term into a network: an address, a CIDR network or
+    a dotted IPv4 prefix such as '203.0.113.'. Returns None otherwise.
+    """
+    term = term.strip()
+    try:
+        return ipaddress.ip_network(term, strict=False)
+    except ValueError:
+        pass
+    octets = term.rstrip('.').split('.')
+    if 0 < len(octets) < 4 and all(octet.isdigit() and int(octet) < 256 for octet in octets):
+        padded = octets + ['0'] * (4 - len(octets))
+        return ipaddress.ip_network(f"{'.'.join(padded)}/{8 * len(octets)}")
+    return None
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Changelist listed newest first and paged by a (timestamp, id) cursor.
+    The older/newer links carry the key of the last or first row shown, so
+    every page is one index range scan however deep it is.
+    """
+    keyset_field = 'timestamp'
+
+    def __init__(self, request, *args, **kwargs):
+        self.after = self._parse_cursor(request.GET.get(AFTER_VAR))
+        self.before = self._parse_cursor(request.GET.get(BEFORE_VAR))
+        super().__init__(request, *args, **kwargs)
+
+    def _parse_cursor(self, value):
+        if not value:
+            return None
+        timestamp, _, pk = value.rpartition('_')
+        try:
+            parsed = parse_datetime(timestamp)
+            pk = int(pk)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise IncorrectLookupParameters(f"Invalid cursor: {value}")
+        return parsed, pk
+
+    def _cursor(self, obj):
+        return f"{getattr(obj, self.keyset_field).isoformat()}_{obj.pk}"
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(AFTER_VAR, None)
+        lookup_params.pop(BEFORE_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Any other change to the list starts again from the newest rows
+        return super().get_query_string(new_params, list(remove or []) + [AFTER_VAR, BEFORE_VAR])
+
+    def get_ordering(self, request, queryset):
+        return [f'-{self.keyset_field}', '-pk']
+
+    def get_results(self, request):
+        paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        field = self.keyset_field
+
+        queryset = self.queryset
+        if self.before is not None:
+            timestamp, pk = self.before
+            queryset = queryset.filter(
+                Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'pk__gt': pk})
+            ).order_by(field, 'pk')
+        elif self.after is not None:
+            timestamp, pk = self.after
+            queryset = queryset.filter(
+                Q(**{f'{field}__lt': timestamp}) | Q(**{field: timestamp, 'pk__lt': pk})
+            )
+
+        rows = list(queryset[:self.list_per_page + 1])
+        has_more = len(rows) > self.list_per_page
+        rows = rows[:self.list_per_page]
+        if self.before is not None:
+            rows.reverse()
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = self.after is not None, has_more
+
+        self.older_url = None
+        self.newer_url = None
+        if rows and has_older:
+            self.older_url = self.get_query_string({AFTER_VAR: self._cursor(rows[-1])})
+        if rows and has_newer:
+            self.newer_url = self.get_query_string({BEFORE_VAR: self._cursor(rows[0])})
+        self.newest_url = self.get_query_string() if has_newer else None
+
+        self.result_count = paginator.count
+        self.count_is_estimate = paginator.is_estimate
+        self.count_is_capped = paginator.is_capped
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.result_list = rows
+        self.can_show_all = False
+        self.multi_page = has_newer or has_older
+        self.paginator = paginator
@@ -0,0 +1,215 @@
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import SuspiciousIP
+from .sinks import log_sink
+
+SENSITIVE_PATHS = frozenset(['/admin', '/login', '/admin/', '/login/'])
+SENSITIVE_ACCESS_REASON = "Accessed sensitive path (/admin or /login)"
+
+
+def excessive_requests_reason(request_count):
+    return f"Excessive requests: {request_count} requests in the last hour"
+
+
+def flag_suspicious_ips(reasons, batch_size=None):
+    """
+    Create or update SuspiciousIP records from a dict of IP -> reason.
+
+    Uses a chunked bulk upsert in one transaction, so the number of queries
+    depends on the number of chunks rather than the number of IPs. Existing
+    rows get the new reason and last_detected; first_detected is kept.
+    """
+    if not reasons:
+        return 0
+    if batch_size is None:
+        batch_size = getattr(settings, 'IP_TRACKING_SUSPICIOUS_UPSERT_BATCH_SIZE', 1000)
+
+    now = timezone.now()
+    records = [
+        SuspiciousIP(
+            ip_address=ip_address,
+            reason=reason,
+            first_detected=now,
+            last_detected=now
+        )
+        for ip_address, reason in reasons.items()
+    ]
+    with transaction.atomic():
+        SuspiciousIP.objects.bulk_create(
+            records,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['ip_address'],
+            update_fields=['reason', 'last_detected']
+        )
+    return len(records)
+
+
+class SlidingWindow:
+    """
+    Request count over the last window, kept as a ring of fixed-size buckets
+    """
+    __slots__ = ('counts', 'last_bucket', 'total', 'flagged_until')
+
+    def __init__(self, bucket_count):
+        self.counts = array('I', bytes(4 * bucket_count))
+        self.last_bucket = None
+        self.total = 0
+        self.flagged_until = 0
+
+    def add(self, bucket):
+        size = len(self.counts)
+        if self.last_bucket is None or bucket - self.last_bucket >= size:
+            # Everything in the ring has aged out
+            for slot in range(size):
+                self.counts[slot] = 0
+            self.total = 0
+        elif bucket > self.last_bucket:
+            # Expire the buckets skipped since the last request
+            for expired in range(self.last_bucket + 1, bucket + 1):
+                slot = expired % size
+                self.total -= self.counts[slot]
+                self.counts[slot] = 0
+        if self.last_bucket is None or bucket > self.last_bucket:
+            self.last_bucket = bucket
+        elif bucket <= self.last_bucket - size:
+            # Too old to fall inside the window
+            return self.total
+
+        self.counts[bucket % size] += 1
+        self.total += 1
+        return self.total
+
+
+class StreamingDetector:
+    """
+    Incremental per-IP anomaly detection fed by IPLoggingMiddleware.
+
+    Each tracked IP has a SlidingWindow of bucket_seconds buckets covering
+    window seconds. An IP is flagged as soon as its count crosses the
+    threshold, or when it requests a sensitive path, and flags are written to
+    SuspiciousIP by the log writer thread on its next flush. At most
+    max_tracked_ips windows are kept; the least recently seen IP is evicted
+    beyond that, so memory stays bounded.
+    """
+
+    def __init__(self, window=None, bucket_seconds=None, threshold=None, max_tracked_ips=None):
+        self.window = window or getattr(settings, 'IP_TRACKING_DETECTION_WINDOW', 3600)
+        self.bucket_seconds = bucket_seconds or getattr(settings, 'IP_TRACKING_DETECTION_BUCKET_SECONDS', 60)
+        self.threshold = threshold or getattr(settings, 'IP_TRACKING_REQUESTS_PER_HOUR_THRESHOLD', 100)
+        self.max_tracked_ips = max_tracked_ips or getattr(settings, 'IP_TRACKING_DETECTION_MAX_IPS', 100000)
+        self.bucket_count = max(1, self.window // self.bucket_seconds)
+        self.evictions = 0
+        self.flagged = 0
+        self._windows = OrderedDict()
+        self._sensitive_flagged = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def observe(self, ip_address, path, timestamp=None):
+        """
+        Count one request; returns the flag reason if this request flagged the IP
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        bucket = int(timestamp // self.bucket_seconds)
+
+        with self._lock:
+            window = self._windows.get(ip_address)
+            if window is None:
+                window = self._windows[ip_address] = SlidingWindow(self.bucket_count)
+                if len(self._windows) > self.max_tracked_ips:
+                    evicted, _ = self._windows.popitem(last=False)
+                    self._sensitive_flagged.pop(evicted, None)
+                    self.evictions += 1
+            else:
+                self._windows.move_to_end(ip_address)
+
+            count = window.add(bucket)
+
+            reason = None
+            if count > self.threshold and timestamp >= window.flagged_until:
+                # Flag once per window, not on every request above the threshold
+                window.flagged_until = timestamp + self.window
+                reason = excessive_requests_reason(count)
+            elif path in SENSITIVE_PATHS and timestamp >= self._sensitive_flagged.get(ip_address, 0):
+                self._sensitive_flagged[ip_address] = timestamp + self.window
+                reason = SENSITIVE_ACCESS_REASON
+
+            if reason is not None:
+                self._pending[ip_address] = reason
+                self.flagged += 1
+            return reason
+
+    def drain(self):
+        """
+        Return and clear the flags not yet written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def flush(self):
+        """
+        Write pending flags to SuspiciousIP
+        """
+        pending = self.drain()
+        if pending:
+            flag_suspicious_ips(pending)
+        return len(pending)
+
+    def get_state(self):
+        """
+        Return the window state as plain data, for consumers that persist it
+        between runs
+        """
+        with self._lock:
+            return {
+                'bucket_count': self.bucket_count,
+                'windows': [
+                    (ip_address, window.counts.tobytes(), window.last_bucket, window.total, window.flagged_until)
+                    for ip_address, window in self._windows.items()
+                ],
+                'sensitive_flagged': dict(self._sensitive_flagged),
+            }
+
+    def set_state(self, state):
+        """
+        Restore window state saved by get_state; windows saved with a
+        different bucket count are dropped
+        """
+        if state.get('bucket_count') != self.bucket_count:
+            return
+        windows = OrderedDict()
+        for ip_address, counts, last_bucket, total, flagged_until in state['windows'][-self.max_tracked_ips:]:
+            window = SlidingWindow(self.bucket_count)
+            window.counts = array('I', counts)
+            window.last_bucket = last_bucket
+            window.total = total
+            window.flagged_until = flagged_until
+            windows[ip_address] = window
+        with self._lock:
+            self._windows = windows
+            self._sensitive_flagged = {
+                ip_address: until for ip_address, until in state['sensitive_flagged'].items()
+                if ip_address in windows
+            }
+
+    def stats(self):
+        return {
+            'tracked_ips': len(self._windows),
+            'evictions': self.evictions,
+            'flagged': self.flagged,
+            'pending': len(self._pending),
+        }
+
+
+# Create a global instance; the active log sink writes its flags, after each
+# batch for the database sink or on a timer for the segment sink
+streaming_detector = StreamingDetector()
+log_sink.add_flush_hook(streaming_detector.flush)
@@ -0,0 +1,117 @@
+"""
+Streaming RequestLog export.
+
+Rows are read with values_list(...).iterator(chunk_size=...), which uses a
+server-side cursor on PostgreSQL, and encoded a chunk at a time. Only one
+chunk of rows and one encoded chunk are held in memory, whatever the size of
+the export. The same generators feed the export_request_logs command and the
+/api/export/ StreamingHttpResponse.
+"""
+import csv
+import io
+import json
+import zlib
+from datetime import timedelta
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .analytics import parse_window
+from .models import RequestLog
+
+FIELDS = ('timestamp', 'ip_address', 'path', 'country', 'city', 'region', 'geolocated')
+FORMATS = ('ndjson', 'csv')
+
+
+def parse_time_bound(value, now=None):
+    """
+    Parse an ISO 8601 datetime, or a window such as '24h' meaning that long
+    before now. Naive datetimes are taken in the current time zone.
+    """
+    now = now or timezone.now()
+    try:
+        return now - timedelta(seconds=parse_window(value))
+    except ValueError:
+        pass
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"Invalid time: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def export_queryset(since, until, network=None):
+    """
+    Return the rows in [since, until), oldest first, optionally limited to a
+    CIDR network
+    """
+    queryset = RequestLog.objects.filter(timestamp__gte=since, timestamp__lt=until)
+    if network:
+        queryset = queryset.in_network(network)
+    return queryset.order_by('timestamp').values_list(*FIELDS)
+
+
+def _chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = [row for _, row in zip(range(chunk_size), rows)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def ndjson_chunks(rows, chunk_size=5000):
+    """
+    Yield one JSON object per row, newline separated, a chunk at a time
+    """
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    for chunk in _chunks(rows, chunk_size):
+        yield ''.join(
+            encode(dict(zip(FIELDS, (row[0].isoformat(),) + row[1:]))) + '\n'
+            for row in chunk
+        )
+
+
+def csv_chunks(rows, chunk_size=5000):
+    """
+    Yield CSV with a header row, a chunk at a time
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for chunk in _chunks(rows, chunk_size):
+        writer.writerows((row[0].isoformat(),) + row[1:] for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+ENCODERS = {
+    'ndjson': ndjson_chunks,
+    'csv': csv_chunks,
+}
+
+
+def encode_chunks(chunks, compress=False):
+    """
+    Encode text chunks as UTF-8, optionally as one gzip stream
+    """
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(since, until, fmt='ndjson', network=None, compress=False, chunk_size=5000):
+    """
+    Yield the encoded export of [since, until) as bytes
+    """
+    rows = export_queryset(since, until, network).iterator(chunk_size=chunk_size)
+    return encode_chunks(ENCODERS[fmt](rows, chunk_size), compress)
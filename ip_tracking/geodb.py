@@ -0,0 +1,219 @@
+"""
+Offline IP geolocation backed by a memory-mapped range database.
+
+The compiled file layout (all integers big-endian) is:
+
+    header   magic (8 bytes), record count (u32), string count (u32),
+             records offset (u64), string index offset (u64),
+             string data offset (u64)
+    records  start (16 bytes), end (16 bytes), country id (u32),
+             region id (u32), city id (u32), sorted by start
+    index    string count + 1 offsets (u32) into the string data
+    strings  UTF-8 string data; string id 0 is the empty string
+
+Addresses are stored as 16-byte IPv6 values with IPv4 mapped into
+::ffff:0:0/96, so byte-wise comparison matches numeric order and one sorted
+array covers both IP versions. Lookups binary search the record starts
+directly in the mapping, so every worker shares the page cache copy.
+"""
+import csv
+import ipaddress
+import mmap
+import struct
+from .addresses import pack_address
+
+MAGIC = b'IPGEODB1'
+HEADER = struct.Struct('>8sIIQQQ')
+RECORD = struct.Struct('>16s16sIII')
+OFFSET = struct.Struct('>I')
+ADDRESS_SIZE = 16
+
+
+class GeoDatabaseError(Exception):
+    pass
+
+
+def _parse_row(row):
+    """
+    Return (first, last) addresses for a CSV row with either a network
+    column or start_ip/end_ip columns
+    """
+    if row.get('network'):
+        network = ipaddress.ip_network(row['network'].strip(), strict=False)
+        return network.network_address, network.broadcast_address
+    first = ipaddress.ip_address(row['start_ip'].strip())
+    last = ipaddress.ip_address(row['end_ip'].strip())
+    if first.version != last.version or first > last:
+        raise ValueError(f"Invalid range {first} - {last}")
+    return first, last
+
+
+def compile_csv(source, destination):
+    """
+    Compile a CSV of ranges into the binary range database format.
+
+    The CSV needs a header row with either a 'network' column or
+    'start_ip' and 'end_ip' columns, plus optional 'country', 'region'
+    and 'city' columns. Returns (records written, rows skipped).
+    """
+    strings = {'': 0}
+    records = []
+    skipped = 0
+
+    def intern(value):
+        value = (value or '').strip()
+        if value not in strings:
+            strings[value] = len(strings)
+        return strings[value]
+
+    with open(source, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            try:
+                first, last = _parse_row(row)
+            except (KeyError, ValueError, AttributeError):
+                skipped += 1
+                continue
+            records.append((
+                pack_address(first),
+                pack_address(last),
+                intern(row.get('country')),
+                intern(row.get('region')),
+                intern(row.get('city')),
+            ))
+
+    records.sort()
+
+    # Drop ranges that overlap an earlier one so the starts stay searchable
+    compiled = []
+    for record in records:
+        if compiled and record[0] <= compiled[-1][1]:
+            skipped += 1
+            continue
+        compiled.append(record)
+
+    encoded = [value.encode('utf-8') for value in sorted(strings, key=strings.get)]
+    string_index = []
+    position = 0
+    for value in encoded:
+        string_index.append(position)
+        position += len(value)
+    string_index.append(position)
+
+    records_offset = HEADER.size
+    index_offset = records_offset + RECORD.size * len(compiled)
+    data_offset = index_offset + OFFSET.size * len(string_index)
+
+    with open(destination, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(compiled), len(encoded), records_offset, index_offset, data_offset))
+        for record in compiled:
+            f.write(RECORD.pack(*record))
+        for offset in string_index:
+            f.write(OFFSET.pack(offset))
+        for value in encoded:
+            f.write(value)
+
+    return len(compiled), skipped
+
+
+class RangeDatabase:
+    """
+    Read-only, memory-mapped view of a compiled range database
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(self.path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, self.record_count, self.string_count, self._records_offset,
+             self._index_offset, self._data_offset) = HEADER.unpack_from(self._mm, 0)
+        except struct.error:
+            self._mm.close()
+            raise GeoDatabaseError(f"Truncated geolocation database: {self.path}")
+        if magic != MAGIC:
+            self._mm.close()
+            raise GeoDatabaseError(f"Not a compiled geolocation database: {self.path}")
+
+    def close(self):
+        self._mm.close()
+
+    def lookup(self, ip_address):
+        """
+        Return geolocation data for an IP address, or None if no range matches
+        """
+        try:
+            key = pack_address(ipaddress.ip_address(ip_address))
+        except ValueError:
+            return None
+
+        # Find the last record whose start is <= key
+        mm = self._mm
+        base = self._records_offset
+        size = RECORD.size
+        lo, hi = 0, self.record_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = base + mid * size
+            if mm[offset:offset + ADDRESS_SIZE] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+
+        _, end, country_id, region_id, city_id = RECORD.unpack_from(mm, base + (lo - 1) * size)
+        if key > end:
+            return None
+
+        return {
+            'ip': ip_address,
+            'country': self._string(country_id) or None,
+            'region': self._string(region_id) or None,
+            'city': self._string(city_id) or None,
+            'source': 'offline',
+        }
+
+    def _string(self, string_id):
+        start = OFFSET.unpack_from(self._mm, self._index_offset + string_id * OFFSET.size)[0]
+        end = OFFSET.unpack_from(self._mm, self._index_offset + (string_id + 1) * OFFSET.size)[0]
+        return self._mm[self._data_offset + start:self._data_offset + end].decode('utf-8')
+
+
+class MMDBDatabase:
+    """
+    Reader for MaxMind-format .mmdb files; requires the optional maxminddb package
+    """
+
+    def __init__(self, path):
+        import maxminddb
+        self.path = str(path)
+        self._reader = maxminddb.open_database(self.path, maxminddb.MODE_MMAP)
+
+    def close(self):
+        self._reader.close()
+
+    def lookup(self, ip_address):
+        try:
+            record = self._reader.get(ip_address)
+        except ValueError:
+            return None
+        if not record:
+            return None
+
+        subdivisions = record.get('subdivisions') or [{}]
+        return {
+            'ip': ip_address,
+            'country': record.get('country', {}).get('iso_code'),
+            'region': subdivisions[0].get('names', {}).get('en'),
+            'city': record.get('city', {}).get('names', {}).get('en'),
+            'source': 'offline',
+        }
+
+
+def open_database(path):
+    """
+    Open a compiled range database or, by extension, an .mmdb file
+    """
+    if str(path).endswith('.mmdb'):
+        return MMDBDatabase(path)
+    return RangeDatabase(path)
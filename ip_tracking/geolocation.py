@@ -1,53 +1,332 @@
+import ipaddress
+import os
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
+from . import metrics
+from .geodb import open_database
 from .models import IPGeolocationCache
+from .ttl_cache import TTLLRUCache
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key: the first caller runs the
+    function and every caller that arrives while it is in flight waits for,
+    and shares, its result
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+    
+    def do(self, key, function, *args, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'event': threading.Event(), 'result': None, 'error': None}
+            else:
+                self.coalesced += 1
+        
+        if not leader:
+            if not call['event'].wait(timeout):
+                return {'error': 'Timed out waiting for in-flight lookup'}
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        
+        try:
+            call['result'] = function(*args)
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['event'].set()
 
 class GeolocationService:
     def __init__(self):
         self.api_key = getattr(settings, 'IPINFO_API_KEY', None)
-        self.base_url = "https://ipinfo.io"
+        # Overridable so tests and local development can point at a stub server
+        self.base_url = getattr(settings, 'IPINFO_BASE_URL', "https://ipinfo.io")
+        self.batch_size = getattr(settings, 'IPINFO_BATCH_SIZE', 1000)
+        # In-process tier in front of the IPGeolocationCache table
+        self.local_cache = TTLLRUCache(
+            maxsize=getattr(settings, 'IP_TRACKING_GEO_LRU_SIZE', 10000),
+            ttl=getattr(settings, 'IP_TRACKING_GEO_LRU_TTL', 3600)
+        )
+        # Errors and non-routable addresses are cached for a shorter time
+        self.negative_ttl = getattr(settings, 'IP_TRACKING_GEO_NEGATIVE_TTL', 300)
+        # Optional local range database; the HTTP API is then only a fallback
+        self.database_path = getattr(settings, 'IP_GEOLOCATION_DATABASE', None)
+        self.http_fallback = getattr(settings, 'IP_GEOLOCATION_HTTP_FALLBACK', True)
+        self._database = None
+        self._database_lock = threading.Lock()
+        # Pooled keep-alive session, single-flight lookups and a cap on
+        # concurrent API calls per process
+        self.timeout = getattr(settings, 'IPINFO_TIMEOUT', 5)
+        self.pool_size = getattr(settings, 'IPINFO_POOL_SIZE', 10)
+        self.max_concurrent = getattr(settings, 'IPINFO_MAX_CONCURRENT', 10)
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+        self._api_slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._inflight = SingleFlight()
+        self.api_rejected = 0
+        self.db_hits = 0
+        self.db_misses = 0
+        self.offline_hits = 0
+        self.offline_misses = 0
+        self.api_calls = 0
     
     def get_geolocation(self, ip_address):
         """
         Get geolocation data for an IP address with caching
         """
+        started = time.perf_counter()
+        
+        # Resolve from the offline database when one is configured
+        offline_data = self._lookup_offline(ip_address)
+        if offline_data:
+            metrics.GEOLOCATION_OFFLINE_SECONDS.observe(time.perf_counter() - started)
+            return offline_data
+        
         # Check cache first
         cached_data = self._get_cached_geolocation(ip_address)
         if cached_data:
+            metrics.GEOLOCATION_CACHE_SECONDS.observe(time.perf_counter() - started)
             return cached_data
         
-        # If not cached, fetch from API
+        if not self._http_enabled():
+            metrics.GEOLOCATION_UNRESOLVED_SECONDS.observe(time.perf_counter() - started)
+            return self._unresolved(ip_address)
+        
+        # If not cached, fetch from API; concurrent misses for the same IP
+        # share a single call
+        try:
+            return self._inflight.do(
+                ip_address, self._fetch_and_store, ip_address,
+                timeout=self.timeout * 2
+            )
+        finally:
+            metrics.GEOLOCATION_API_SECONDS.observe(time.perf_counter() - started)
+    
+    def _fetch_and_store(self, ip_address):
         geolocation_data = self._fetch_from_api(ip_address)
         
-        # Cache the result
-        if geolocation_data and not geolocation_data.get('error'):
-            self._cache_geolocation(ip_address, geolocation_data)
+        # Cache the result (failures only in-process, for a shorter time)
+        self._store_result(ip_address, geolocation_data)
+        
+        return geolocation_data
+    
+    def get_geolocation_batch(self, ip_addresses):
+        """
+        Get geolocation data for many IP addresses, resolving each one once.
+        Returns a dict mapping each IP address to its geolocation data.
+        """
+        results = {}
+        missing = []
+        for ip_address in dict.fromkeys(ip_addresses):
+            cached_data = self._lookup_offline(ip_address) or self._get_cached_geolocation(ip_address)
+            if cached_data:
+                results[ip_address] = cached_data
+            else:
+                missing.append(ip_address)
+        
+        if not self._http_enabled():
+            for ip_address in missing:
+                results[ip_address] = self._unresolved(ip_address)
+            return results
+        
+        # The batch endpoint requires a token; without one fall back to single lookups
+        if self.api_key:
+            for start in range(0, len(missing), self.batch_size):
+                chunk = missing[start:start + self.batch_size]
+                results.update(self._fetch_batch_from_api(chunk))
+        else:
+            for ip_address in missing:
+                results[ip_address] = self._fetch_from_api(ip_address)
+        
+        for ip_address in missing:
+            self._store_result(ip_address, results.get(ip_address))
         
+        return results
+    
+    def cache_stats(self):
+        """
+        Return hit/miss counters for both cache tiers and the API
+        """
+        db_lookups = self.db_hits + self.db_misses
+        return {
+            'local': self.local_cache.stats(),
+            'db': {
+                'hits': self.db_hits,
+                'misses': self.db_misses,
+                'hit_rate': self.db_hits / db_lookups if db_lookups else 0.0,
+            },
+            'offline': {
+                'hits': self.offline_hits,
+                'misses': self.offline_misses,
+            },
+            'api_calls': self.api_calls,
+            'api_rejected': self.api_rejected,
+            'coalesced': self._inflight.coalesced,
+        }
+    
+    def _get_offline_database(self):
+        """
+        Open the offline database on first use; None if not configured or unreadable
+        """
+        if not self.database_path:
+            return None
+        if self._database is None:
+            with self._database_lock:
+                if self._database is None:
+                    try:
+                        self._database = open_database(self.database_path)
+                    except Exception as e:
+                        if settings.DEBUG:
+                            print(f"Error opening geolocation database: {e}")
+                        # Don't retry on every lookup
+                        self.database_path = None
+                        return None
+        return self._database
+    
+    def _lookup_offline(self, ip_address):
+        """
+        Look the IP address up in the offline database
+        """
+        database = self._get_offline_database()
+        if database is None:
+            return None
+        geolocation_data = database.lookup(ip_address)
+        if geolocation_data:
+            self.offline_hits += 1
+        else:
+            self.offline_misses += 1
         return geolocation_data
     
+    def _http_enabled(self):
+        """
+        The API is used unless an offline database is active without fallback
+        """
+        return self.http_fallback or self._get_offline_database() is None
+    
+    def _unresolved(self, ip_address):
+        """
+        Result for an address the offline database doesn't cover
+        """
+        result = {
+            'ip': ip_address,
+            'country': None,
+            'city': None,
+            'region': None,
+            'source': 'offline',
+        }
+        self.local_cache.set(ip_address, result, ttl=self.negative_ttl)
+        return result
+    
     def _get_cached_geolocation(self, ip_address):
         """
-        Get cached geolocation data if it exists and is not expired
+        Get cached geolocation data, checking the in-process cache first,
+        then non-routable ranges, then the IPGeolocationCache table
         """
+        cached_data = self._get_local_geolocation(ip_address)
+        if cached_data is not None:
+            return cached_data
+        
         try:
             cache_entry = IPGeolocationCache.objects.get(
                 ip_address=ip_address,
                 expires_at__gt=timezone.now()
             )
-            return {
-                'ip': ip_address,
-                'country': cache_entry.country,
-                'city': cache_entry.city,
-                'region': cache_entry.region,
-                'org': cache_entry.org,
-                'postal': cache_entry.postal,
-                'timezone': cache_entry.timezone,
-                'cached': True
-            }
         except IPGeolocationCache.DoesNotExist:
+            self.db_misses += 1
+            return None
+        
+        self.db_hits += 1
+        return self._cache_entry_data(ip_address, cache_entry)
+    
+    def _get_local_geolocation(self, ip_address):
+        """
+        Answer from the in-process cache or for non-routable addresses,
+        without touching the database
+        """
+        cached_data = self.local_cache.get(ip_address)
+        if cached_data is not None:
+            return cached_data
+        
+        non_routable = self._non_routable_result(ip_address)
+        if non_routable is not None:
+            self.local_cache.set(ip_address, non_routable, ttl=self.negative_ttl)
+            return non_routable
+        
+        return None
+    
+    def _cache_entry_data(self, ip_address, cache_entry):
+        """
+        Convert an IPGeolocationCache row and promote it to the in-process cache
+        """
+        cached_data = {
+            'ip': ip_address,
+            'country': cache_entry.country,
+            'city': cache_entry.city,
+            'region': cache_entry.region,
+            'org': cache_entry.org,
+            'postal': cache_entry.postal,
+            'timezone': cache_entry.timezone,
+            'cached': True
+        }
+        # Never keep an entry in process longer than the table would
+        remaining = (cache_entry.expires_at - timezone.now()).total_seconds()
+        self.local_cache.set(ip_address, cached_data, ttl=min(self.local_cache.ttl, remaining))
+        return cached_data
+    
+    def _non_routable_result(self, ip_address):
+        """
+        Build a result for invalid, private, loopback or otherwise
+        non-global addresses, which the API cannot locate
+        """
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return {'ip': ip_address, 'error': 'Invalid IP address'}
+        
+        if address.is_global:
             return None
+        return {
+            'ip': ip_address,
+            'bogon': True,
+            'country': None,
+            'city': None,
+            'region': None,
+        }
+    
+    def _store_result(self, ip_address, geolocation_data):
+        """
+        Cache a fetched result: successes in both tiers, failures in-process
+        with the negative TTL so they are retried later
+        """
+        if not geolocation_data or geolocation_data.get('error'):
+            self._store_negative(ip_address, geolocation_data)
+            return
+        
+        self.local_cache.set(ip_address, geolocation_data)
+        self._cache_geolocation(ip_address, geolocation_data)
+    
+    def _store_negative(self, ip_address, geolocation_data):
+        self.local_cache.set(
+            ip_address,
+            geolocation_data or {'ip': ip_address, 'error': 'No data returned'},
+            ttl=self.negative_ttl
+        )
     
     def _cache_geolocation(self, ip_address, geolocation_data):
         """
@@ -56,30 +335,37 @@ class GeolocationService:
         try:
             IPGeolocationCache.objects.update_or_create(
                 ip_address=ip_address,
-                defaults={
-                    'country': geolocation_data.get('country'),
-                    'city': geolocation_data.get('city'),
-                    'region': geolocation_data.get('region'),
-                    'org': geolocation_data.get('org'),
-                    'postal': geolocation_data.get('postal'),
-                    'timezone': geolocation_data.get('timezone'),
-                    'expires_at': timezone.now() + timedelta(hours=24)
-                }
+                defaults=self._cache_defaults(geolocation_data)
             )
         except Exception as e:
             # Log error but don't break the application
             pass
     
+    def _cache_defaults(self, geolocation_data):
+        return {
+            'country': geolocation_data.get('country'),
+            'city': geolocation_data.get('city'),
+            'region': geolocation_data.get('region'),
+            'org': geolocation_data.get('org'),
+            'postal': geolocation_data.get('postal'),
+            'timezone': geolocation_data.get('timezone'),
+            'expires_at': timezone.now() + timedelta(hours=24)
+        }
+    
     def _fetch_from_api(self, ip_address):
         """
         Fetch geolocation data from ipinfo.io API
         """
+        if not self._api_slots.acquire(timeout=self.timeout):
+            self.api_rejected += 1
+            return {'error': 'Too many concurrent geolocation lookups'}
+        self.api_calls += 1
         try:
             url = f"{self.base_url}/{ip_address}/json"
             if self.api_key:
                 url += f"?token={self.api_key}"
             
-            response = requests.get(url, timeout=5)
+            response = self._get_session().get(url, timeout=self.timeout)
             response.raise_for_status()
             
             return response.json()
@@ -87,6 +373,78 @@ class GeolocationService:
             return {'error': str(e)}
         except Exception as e:
             return {'error': 'Unknown error occurred'}
+        finally:
+            self._api_slots.release()
+    
+    def _get_session(self):
+        """
+        Return this process's keep-alive session, creating it after a fork
+        """
+        if self._session_pid != os.getpid():
+            with self._session_lock:
+                if self._session_pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=1,
+                        pool_maxsize=self.pool_size,
+                        pool_block=True
+                    )
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def _fetch_batch_from_api(self, ip_addresses):
+        """
+        Fetch geolocation data for several IPs with the ipinfo.io batch endpoint
+        """
+        if not self._api_slots.acquire(timeout=self.timeout):
+            self.api_rejected += 1
+            return {ip_address: {'error': 'Too many concurrent geolocation lookups'} for ip_address in ip_addresses}
+        self.api_calls += 1
+        try:
+            response = self._get_session().post(
+                f"{self.base_url}/batch",
+                params={'token': self.api_key},
+                json=list(ip_addresses),
+                timeout=self.timeout * 2
+            )
+            response.raise_for_status()
+            data = response.json()
+        except requests.RequestException as e:
+            return {ip_address: {'error': str(e)} for ip_address in ip_addresses}
+        except Exception as e:
+            return {ip_address: {'error': 'Unknown error occurred'} for ip_address in ip_addresses}
+        finally:
+            self._api_slots.release()
+        
+        results = {}
+        for ip_address in ip_addresses:
+            geolocation_data = data.get(ip_address)
+            if isinstance(geolocation_data, dict):
+                results[ip_address] = geolocation_data
+            else:
+                results[ip_address] = {'error': 'Missing from batch response'}
+        return results
 
 # Create a global instance
 geolocation_service = GeolocationService()
+
+metrics.registry.gauge(
+    'ip_tracking_geolocation_cache_hit_ratio',
+    'Geolocation cache hit ratio per cache tier',
+    lambda: geolocation_service.local_cache.stats()['hit_rate'],
+    labels={'tier': 'local'}
+)
+metrics.registry.gauge(
+    'ip_tracking_geolocation_cache_hit_ratio',
+    'Geolocation cache hit ratio per cache tier',
+    lambda: geolocation_service.cache_stats()['db']['hit_rate'],
+    labels={'tier': 'db'}
+)
+metrics.registry.gauge(
+    'ip_tracking_geolocation_api_calls',
+    'ipinfo API calls made by this process',
+    lambda: geolocation_service.api_calls
+)
@@ -0,0 +1,106 @@
+"""
+Parsing for historical request logs replayed by the replay_logs command.
+
+Two formats are understood:
+
+    nginx  the combined/common access log format
+    jsonl  one JSON object per line with an 'ip_address' (or 'ip'), 'path'
+           and 'timestamp' (ISO 8601 or unix seconds) key
+
+Parsing works on plain lists of lines and returns plain tuples, so chunks
+can be handed to worker processes without touching Django.
+"""
+import ipaddress
+import json
+import re
+from datetime import datetime, timezone
+
+NGINX_LINE = re.compile(
+    r'^(?P<ip>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] "(?:\S+) (?P<path>\S+)[^"]*"'
+)
+NGINX_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+
+
+def read_chunks(lines, chunk_size):
+    """
+    Yield lists of up to chunk_size lines
+    """
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def detect_format(line):
+    return 'jsonl' if line.lstrip().startswith('{') else 'nginx'
+
+
+def _normalize_path(path):
+    # The middleware logs request.path, which has no query string
+    return path.split('?', 1)[0].split('#', 1)[0][:255] or '/'
+
+
+def _parse_timestamp(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def parse_nginx_line(line):
+    match = NGINX_LINE.match(line)
+    if match is None:
+        return None
+    timestamp = datetime.strptime(match.group('time'), NGINX_TIME_FORMAT).timestamp()
+    return match.group('ip'), match.group('path'), timestamp
+
+
+def parse_json_line(line):
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        return None
+    ip_address = record.get('ip_address') or record.get('ip')
+    path = record.get('path')
+    timestamp = record.get('timestamp')
+    if not ip_address or path is None or timestamp is None:
+        return None
+    return ip_address, path, _parse_timestamp(timestamp)
+
+
+PARSERS = {
+    'nginx': parse_nginx_line,
+    'jsonl': parse_json_line,
+}
+
+
+def parse_chunk(lines, log_format):
+    """
+    Parse and validate a chunk of lines.
+    Returns ([(ip address, path, unix timestamp), ...], skipped line count).
+    """
+    parse_line = PARSERS[log_format]
+    records = []
+    skipped = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            parsed = parse_line(line)
+            if parsed is None:
+                skipped += 1
+                continue
+            ip_address, path, timestamp = parsed
+            # Normalize so '::ffff:1.2.3.4' and '1.2.3.4' are stored alike
+            address = ipaddress.ip_address(ip_address.strip())
+            address = getattr(address, 'ipv4_mapped', None) or address
+        except (ValueError, TypeError, OverflowError, AttributeError):
+            skipped += 1
+            continue
+        records.append((str(address), _normalize_path(str(path)), timestamp))
+    return records, skipped
@@ -0,0 +1,230 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+from . import metrics
+from .models import RequestLog
+
+
+class RequestLogWriter:
+    """
+    Buffered RequestLog writer that inserts rows from a background thread.
+
+    Records are queued by the request thread and written with bulk_create
+    once batch_size records are pending or flush_interval seconds have passed,
+    so the response path never waits on the database. When the queue is full
+    a record is dropped (after waiting up to block_timeout seconds) and
+    counted rather than slowing the request down.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, max_queue_size=None, block_timeout=None):
+        self.batch_size = batch_size or getattr(settings, 'IP_TRACKING_LOG_BATCH_SIZE', 500)
+        self.flush_interval = flush_interval or getattr(settings, 'IP_TRACKING_LOG_FLUSH_INTERVAL', 1.0)
+        self.max_queue_size = max_queue_size or getattr(settings, 'IP_TRACKING_LOG_QUEUE_SIZE', 10000)
+        if block_timeout is None:
+            block_timeout = getattr(settings, 'IP_TRACKING_LOG_BLOCK_TIMEOUT', 0)
+        self.block_timeout = block_timeout
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+
+        self._queue = queue.Queue(maxsize=self.max_queue_size)
+        self._flush_hooks = []
+        self._flush_lock = threading.Lock()
+        # Guards the counters request threads update
+        self._counts_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def write(self, block=True, **fields):
+        """
+        Queue a RequestLog record; returns False if it had to be dropped.
+        With block=False the record is dropped at once if the queue is full,
+        which is what callers on an event loop need.
+        """
+        self._ensure_started()
+        record = RequestLog(**fields)
+        try:
+            if block and self.block_timeout:
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            with self._counts_lock:
+                self.dropped += 1
+            return False
+        with self._counts_lock:
+            self.enqueued += 1
+        return True
+
+    def add_flush_hook(self, hook):
+        """
+        Register a callable run on the writer thread after each batch is written
+        """
+        self._flush_hooks.append(hook)
+
+    def flush(self, timeout=None):
+        """
+        Return once every record queued before the call has been written.
+        The background thread is asked to write its batch, including records
+        it has already taken off the queue; without a running thread the
+        queue is written from the calling thread. Returns False if the
+        thread didn't finish within timeout seconds.
+        """
+        if self._thread_alive():
+            # FIFO: the marker is reached only after every earlier record
+            done = threading.Event()
+            try:
+                self._queue.put(done, timeout=timeout)
+            except queue.Full:
+                return False
+            return done.wait(timeout)
+
+        batch = []
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(record, threading.Event):
+                # A flush marker left behind by a stopped thread
+                record.set()
+                continue
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self._write_batch(batch)
+                batch = []
+        if batch:
+            self._write_batch(batch)
+        return True
+
+    def close(self, timeout=5):
+        """
+        Stop the background thread and flush whatever is left in the queue
+        """
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        # With the thread stopped this writes the rest from this thread
+        self.flush()
+
+    def stats(self):
+        """
+        Return the writer counters
+        """
+        return {
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'flushes': self.flushes,
+            'pending': self._queue.qsize(),
+        }
+
+    def _thread_alive(self):
+        return (
+            self._pid == os.getpid()
+            and self._thread is not None
+            and self._thread.is_alive()
+            and not self._stop.is_set()
+        )
+
+    def _ensure_started(self):
+        """
+        Start the background thread lazily, and again after a fork
+        """
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='ip-tracking-log-writer', daemon=True
+            )
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        """
+        Collect records into batches and flush on size or time threshold,
+        or at once when flush() queues a marker
+        """
+        batch = []
+        waiting = []
+        deadline = time.monotonic() + self.flush_interval
+        try:
+            while not self._stop.is_set():
+                timeout = max(deadline - time.monotonic(), 0)
+                try:
+                    record = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    pass
+                else:
+                    if isinstance(record, threading.Event):
+                        waiting.append(record)
+                    else:
+                        batch.append(record)
+
+                if waiting or len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                    if batch:
+                        self._write_batch(batch)
+                        batch = []
+                    for done in waiting:
+                        done.set()
+                    waiting = []
+                    deadline = time.monotonic() + self.flush_interval
+        finally:
+            if batch:
+                self._write_batch(batch)
+            for done in waiting:
+                done.set()
+            close_old_connections()
+
+    def _write_batch(self, batch):
+        """
+        Insert one batch of records with a single bulk_create
+        """
+        with self._flush_lock:
+            started = time.perf_counter()
+            try:
+                close_old_connections()
+                RequestLog.objects.bulk_create(batch, batch_size=self.batch_size)
+                self.written += len(batch)
+                metrics.LOG_BATCH_WRITE_SECONDS.observe(time.perf_counter() - started)
+            except Exception as e:
+                self.failed += len(batch)
+                if settings.DEBUG:
+                    print(f"Error writing request logs: {e}")
+            finally:
+                self.flushes += 1
+            self._run_flush_hooks()
+
+    def _run_flush_hooks(self):
+        for hook in self._flush_hooks:
+            try:
+                hook()
+            except Exception as e:
+                if settings.DEBUG:
+                    print(f"Error in request log flush hook: {e}")
+
+
+# Create a global instance
+request_log_writer = RequestLogWriter()
+atexit.register(request_log_writer.close)
+
+for _name in ('pending', 'written', 'dropped', 'failed'):
+    metrics.registry.gauge(
+        'ip_tracking_log_writer_records',
+        'Buffered RequestLog writer record counts',
+        lambda name=_name: request_log_writer.stats()[name],
+        labels={'state': _name}
+    )
@@ -0,0 +1,398 @@
+import ipaddress
+import json
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections, router
+from django.http import HttpResponse
+from django.test import RequestFactory
+from ip_tracking.blocklist import BlocklistSnapshot
+from ip_tracking.detection import StreamingDetector
+from ip_tracking.geolocation import GeolocationService
+from ip_tracking.log_writer import RequestLogWriter
+from ip_tracking.middleware import IPLoggingMiddleware
+from ip_tracking.models import IPGeolocationCache, RequestLog, SuspiciousIP
+from ip_tracking.sinks import DatabaseSink, SegmentFileSink, log_sink
+from ip_tracking.sketches import SketchRecorder
+from ip_tracking.suspicious import SuspiciousIPSet
+
+# Benchmark traffic comes from the RFC 2544 benchmarking range so the rows
+# it leaves behind can be told apart from real traffic and removed
+CLIENT_NETWORK = ipaddress.ip_network('198.18.0.0/15')
+# Blocklist entries are spread over 10.0.0.0/8, two addresses apart so they
+# never merge into a single interval
+BLOCKLIST_BASE = int(ipaddress.IPv4Address('10.0.0.0'))
+# Geolocation lookups need routable addresses, otherwise they short-circuit
+GEO_BASE = int(ipaddress.IPv4Address('11.0.0.0'))
+
+
+class BenchmarkMiddleware(IPLoggingMiddleware):
+    """
+    IPLoggingMiddleware wired to the benchmark's own sink, detector,
+    sketches and suspicious set, and optionally a prebuilt blocklist
+    snapshot, so nothing it does reaches the process-wide instances
+    """
+
+    def __init__(self, get_response, instances, snapshot=None):
+        super().__init__(get_response)
+        self.log_sink = instances['log_sink']
+        self.detector = instances['detector']
+        self.sketches = instances['sketches']
+        self.suspicious_ips = instances['suspicious_ips']
+        self.snapshot = snapshot
+
+    def is_ip_blocked(self, ip_address, ip_value=None):
+        if self.snapshot is None:
+            return super().is_ip_blocked(ip_address, ip_value)
+        return self.snapshot.is_blocked(ip_address, ip_value)
+
+
+class PrivateSketchRecorder(SketchRecorder):
+    """
+    SketchRecorder that records at full cost but never publishes to the cache
+    """
+
+    def _ensure_started(self):
+        pass
+
+    def publish(self):
+        return 0
+
+
+class PinnedRouter:
+    """
+    Database router sending every query to one alias
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def db_for_read(self, model, **hints):
+        return self.alias
+
+    def db_for_write(self, model, **hints):
+        return self.alias
+
+
+@contextmanager
+def pinned_database(alias):
+    """
+    Route the ORM, including the log writer's thread, to alias
+    """
+    pinned = PinnedRouter(alias)
+    router.routers.insert(0, pinned)
+    try:
+        yield
+    finally:
+        router.routers.remove(pinned)
+
+
+class StubGeolocationService(GeolocationService):
+    """
+    GeolocationService whose API calls return canned data without the network
+    """
+
+    def _http_enabled(self):
+        return True
+
+    def _fetch_from_api(self, ip_address):
+        self.api_calls += 1
+        return {'ip': ip_address, 'country': 'US', 'region': 'Benchmark', 'city': 'Benchmark'}
+
+
+class Command(BaseCommand):
+    help = 'Time the IPLoggingMiddleware hot path and write the results as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--blocklist-sizes',
+            type=str,
+            default='10,1000,100000,1000000',
+            help='Comma-separated blocklist sizes to benchmark (default: 10,1000,100000,1000000)'
+        )
+        parser.add_argument(
+            '--hit-ratios',
+            type=str,
+            default='0,0.5,0.9,1',
+            help='Comma-separated geolocation cache hit ratios (default: 0,0.5,0.9,1)'
+        )
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=10000,
+            help='Calls per timed run (default: 10000)'
+        )
+        parser.add_argument(
+            '--geo-iterations',
+            type=int,
+            default=1000,
+            help='Calls per timed geolocation run; misses hit the database (default: 1000)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Timed runs per benchmark (default: 5)'
+        )
+        parser.add_argument(
+            '--databases',
+            type=str,
+            default='default',
+            help='Comma-separated database aliases to run the database-bound benchmarks against; '
+                 'each needs the ip_tracking tables migrated (default: default)'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default='-',
+            help="File to write the JSON results to ('-' for standard output)"
+        )
+        parser.add_argument(
+            '--keep-rows',
+            action='store_true',
+            help='Keep the request logs, flags and cache rows the benchmark creates'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            blocklist_sizes = [int(size) for size in options['blocklist_sizes'].split(',')]
+            hit_ratios = [float(ratio) for ratio in options['hit_ratios'].split(',')]
+        except ValueError as e:
+            raise CommandError(f'Invalid benchmark matrix: {e}')
+        if any(not 0 <= ratio <= 1 for ratio in hit_ratios):
+            raise CommandError('Hit ratios must be between 0 and 1')
+        databases = [alias.strip() for alias in options['databases'].split(',') if alias.strip()]
+        for alias in databases:
+            if alias not in connections:
+                raise CommandError(f'Unknown database alias: {alias}')
+            try:
+                RequestLog.objects.using(alias).exists()
+            except DatabaseError as e:
+                raise CommandError(f'Database {alias} is not ready (run migrate --database={alias}): {e}')
+
+        self.iterations = options['iterations']
+        self.repeat = options['repeat']
+        self.verbosity = options['verbosity']
+        self.random = random.Random(0)
+        self.factory = RequestFactory()
+        self.results = []
+        self.geo_addresses = []
+
+        # The blocklist benchmarks don't depend on the database, so they run
+        # once, against the first alias; the rest run against every alias
+        for index, alias in enumerate(databases):
+            self.geo_addresses = []
+            self.database = {'database': alias, 'vendor': connections[alias].vendor}
+            with pinned_database(alias):
+                instances = self._private_instances()
+                try:
+                    if index == 0:
+                        for size in blocklist_sizes:
+                            self._benchmark_blocklist(size, instances)
+                    self._benchmark_log_request(instances)
+                    for ratio in hit_ratios:
+                        self._benchmark_geolocation(ratio, options['geo_iterations'])
+                finally:
+                    self._close(instances)
+                    if not options['keep_rows']:
+                        self._clean_up()
+
+        report = {
+            'meta': {
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'platform': platform.platform(),
+                'databases': {alias: connections[alias].vendor for alias in databases},
+                'log_sink': type(log_sink).__name__,
+                'iterations': self.iterations,
+                'repeat': self.repeat,
+            },
+            'results': self.results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(
+                self.style.SUCCESS(f'Wrote {len(self.results)} results to {options["output"]}')
+            )
+
+    def _time(self, name, params, function, arguments):
+        """
+        Call function once per argument, repeat times, and record ns per call.
+        arguments may be a callable returning a fresh list for every run.
+        """
+        make_arguments = arguments if callable(arguments) else (lambda: arguments)
+
+        # One untimed pass warms caches and lazy initialization
+        for argument in make_arguments()[:100]:
+            function(argument)
+
+        runs = []
+        for _ in range(self.repeat):
+            run_arguments = make_arguments()
+            started = time.perf_counter_ns()
+            for argument in run_arguments:
+                function(argument)
+            runs.append((time.perf_counter_ns() - started) / len(run_arguments))
+
+        result = {
+            'benchmark': name,
+            'params': params,
+            'ns_per_op': {
+                'min': round(min(runs), 1),
+                'median': round(statistics.median(runs), 1),
+                'max': round(max(runs), 1),
+            },
+            'ops_per_sec': round(1e9 / statistics.median(runs)),
+        }
+        self.results.append(result)
+        if self.verbosity >= 2:
+            self.stderr.write(f"{name} {params}: {result['ns_per_op']['median']} ns/op")
+        return result
+
+    def _private_instances(self):
+        """
+        Build a sink of the configured type, a detector, sketches and a
+        suspicious set for the benchmark alone. Segment files go to a
+        temporary directory that is removed afterwards.
+        """
+        instances = {
+            'detector': StreamingDetector(),
+            'sketches': PrivateSketchRecorder(),
+            'suspicious_ips': SuspiciousIPSet(),
+            'segment_directory': None,
+        }
+        if isinstance(log_sink, SegmentFileSink):
+            instances['segment_directory'] = tempfile.mkdtemp(prefix='benchmark-segments-')
+            instances['log_sink'] = SegmentFileSink(directory=instances['segment_directory'])
+        elif isinstance(log_sink, DatabaseSink):
+            instances['log_sink'] = DatabaseSink(writer=RequestLogWriter())
+        else:
+            instances['log_sink'] = type(log_sink)()
+        return instances
+
+    def _close(self, instances):
+        """
+        Wait for the private sink to finish writing, then discard it
+        """
+        sink = instances['log_sink']
+        if isinstance(sink, DatabaseSink):
+            sink.writer.close()
+        elif isinstance(sink, SegmentFileSink):
+            sink.close()
+        if instances['segment_directory']:
+            shutil.rmtree(instances['segment_directory'], ignore_errors=True)
+
+    def _client_addresses(self, count):
+        first = int(CLIENT_NETWORK.network_address)
+        return [
+            str(ipaddress.IPv4Address(first + self.random.randrange(CLIENT_NETWORK.num_addresses)))
+            for _ in range(count)
+        ]
+
+    def _benchmark_blocklist(self, size, instances):
+        snapshot = BlocklistSnapshot(check_interval=float('inf'), max_age=float('inf'))
+        blocked = [str(ipaddress.IPv4Address(BLOCKLIST_BASE + 2 * i)) for i in range(size)]
+        started = time.perf_counter()
+        snapshot._table = snapshot._compile(blocked, [])
+        snapshot._loaded_at = snapshot._checked_at = time.monotonic()
+        self.results.append({
+            'benchmark': 'blocklist_compile',
+            'params': {'blocklist_size': size},
+            'seconds': round(time.perf_counter() - started, 4),
+        })
+
+        # Half of the probes are blocked addresses, half fall between them
+        probes = [
+            str(ipaddress.IPv4Address(BLOCKLIST_BASE + self.random.randrange(2 * size)))
+            for _ in range(self.iterations)
+        ]
+        params = {'blocklist_size': size}
+
+        response = HttpResponse('ok')
+        middleware = BenchmarkMiddleware(lambda request: response, instances, snapshot)
+        self._time('is_ip_blocked', params, middleware.is_ip_blocked, probes)
+
+        requests = [
+            self.factory.get('/benchmark/', REMOTE_ADDR=ip_address)
+            for ip_address in self._client_addresses(self.iterations)
+        ]
+        self._time('get_client_ip', params, middleware.get_client_ip, requests)
+
+        forwarded = [
+            self.factory.get(
+                '/benchmark/',
+                REMOTE_ADDR='127.0.0.1',
+                HTTP_X_FORWARDED_FOR=f'{request.META["REMOTE_ADDR"]}, 10.0.0.1'
+            )
+            for request in requests
+        ]
+        self._time('get_client_ip_forwarded', params, middleware.get_client_ip, forwarded)
+
+        self._time('middleware_call', params, middleware, requests)
+
+        blocked_requests = [
+            self.factory.get('/benchmark/', REMOTE_ADDR=blocked[self.random.randrange(size)])
+            for _ in range(self.iterations)
+        ]
+        self._time('middleware_call_blocked', params, middleware, blocked_requests)
+
+    def _benchmark_log_request(self, instances):
+        middleware = BenchmarkMiddleware(lambda request: HttpResponse('ok'), instances)
+        entries = [
+            (ip_address, '/benchmark/') for ip_address in self._client_addresses(self.iterations)
+        ]
+        self._time(
+            'log_request',
+            dict(self.database, log_sink=type(log_sink).__name__),
+            lambda entry: middleware.log_request(*entry),
+            entries
+        )
+
+    def _benchmark_geolocation(self, hit_ratio, iterations):
+        service = StubGeolocationService()
+        data = {'country': 'US', 'region': 'Benchmark', 'city': 'Benchmark'}
+
+        # Each run needs fresh misses, so allocate unique addresses per call
+        def next_address():
+            address = str(ipaddress.IPv4Address(GEO_BASE + len(self.geo_addresses)))
+            self.geo_addresses.append(address)
+            return address
+
+        warm = [next_address() for _ in range(100)]
+        for address in warm:
+            service.local_cache.set(address, dict(data, ip=address))
+
+        # Every run gets newly allocated misses so none is served from cache
+        def make_lookups():
+            return [
+                self.random.choice(warm) if self.random.random() < hit_ratio else next_address()
+                for _ in range(iterations)
+            ]
+
+        self._time(
+            'get_geolocation', dict(self.database, hit_ratio=hit_ratio), service.get_geolocation, make_lookups
+        )
+
+    def _clean_up(self):
+        """
+        Remove the rows the benchmark wrote to the pinned database
+        """
+        for prefix in ('198.18.', '198.19.'):
+            RequestLog.objects.filter(ip_address__startswith=prefix).delete()
+            SuspiciousIP.objects.filter(ip_address__startswith=prefix).delete()
+
+        for start in range(0, len(self.geo_addresses), 1000):
+            IPGeolocationCache.objects.filter(
+                ip_address__in=self.geo_addresses[start:start + 1000]
+            ).delete()
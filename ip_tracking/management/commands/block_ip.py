@@ -1,74 +1,279 @@
-from django.core.management.base import BaseCommand, CommandError
-from django.db import IntegrityError
-from ip_tracking.models import BlockedIP
 import ipaddress
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from ip_tracking.addresses import pack_ip, parse_ip
+from ip_tracking.models import BlockedIP, BlockedNetwork
+from ip_tracking.signals import bulk_blocklist_changes
 
 class Command(BaseCommand):
-    help = 'Add IP addresses to the blocklist'
-    
+    help = 'Add IP addresses or CIDR networks to the blocklist'
+
     def add_arguments(self, parser):
         parser.add_argument(
             'ip_addresses',
-            nargs='+',
+            nargs='*',
             type=str,
-            help='IP addresses to block (space separated)'
+            help='IP addresses or CIDR networks to block (space separated)'
         )
         parser.add_argument(
             '--reason',
             type=str,
-            help='Reason for blocking the IP address(es)'
+            help='Reason for blocking the IP address(es) or network(s)'
+        )
+        parser.add_argument(
+            '--from-file',
+            type=str,
+            help="Read entries from a file, one per line ('-' reads standard input); "
+                 "blank lines and text after '#' are ignored"
+        )
+        parser.add_argument(
+            '--unblock',
+            action='store_true',
+            help='Remove the given entries from the blocklist instead of adding them'
+        )
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            help='Make the blocklist exactly the given entries, adding and removing in one transaction'
+        )
+        parser.add_argument(
+            '--export',
+            type=str,
+            metavar='PATH',
+            help="Write every blocked entry to PATH ('-' for standard output) and exit"
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=10000,
+            help='Entries validated and written per transaction (default: 10000)'
         )
-    
+
     def handle(self, *args, **options):
-        ip_addresses = options['ip_addresses']
-        reason = options['reason']
-        
-        blocked_count = 0
-        skipped_count = 0
-        
-        for ip_str in ip_addresses:
+        if options['export']:
+            return self._export(options['export'])
+        if options['unblock'] and options['sync']:
+            raise CommandError('--unblock and --sync cannot be combined')
+        if not options['ip_addresses'] and not options['from_file']:
+            raise CommandError('Give IP addresses or networks, or --from-file')
+
+        self.reason = options['reason']
+        self.verbosity = options['verbosity']
+        # Per-entry messages for a handful of argv entries, totals for feeds
+        self.per_entry = not options['from_file']
+        self.changed = 0
+        self.skipped = 0
+        self.invalid = 0
+
+        started = time.monotonic()
+        chunks = self._read_chunks(options, options['chunk_size'])
+        with bulk_blocklist_changes():
+            if options['sync']:
+                removed = self._sync(chunks)
+            else:
+                for addresses, networks in chunks:
+                    if options['unblock']:
+                        self._unblock_chunk(addresses, networks)
+                    else:
+                        self._block_chunk(addresses, networks)
+        elapsed = time.monotonic() - started
+
+        processed = self.changed + self.skipped + self.invalid
+        if options['sync']:
+            # Removals are work done too; a pure removal sync would report 0/s
+            processed += removed
+        rate = processed / elapsed if elapsed else 0
+        if options['sync']:
+            summary = (
+                f'Sync complete: {self.changed} entries blocked, {removed} entries unblocked, '
+                f'{self.skipped} entries unchanged'
+            )
+        elif options['unblock']:
+            summary = f'Unblocking complete: {self.changed} entries unblocked, {self.skipped} entries not found'
+        else:
+            summary = f'Blocking complete: {self.changed} entries blocked, {self.skipped} entries skipped'
+
+        # Summary
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'\n{summary}, {self.invalid} invalid '
+                f'({processed} entries in {elapsed:.2f}s, {rate:.0f} entries/s)'
+            )
+        )
+
+    def _read_entries(self, options):
+        yield from options['ip_addresses']
+        path = options['from_file']
+        if not path:
+            return
+        if path == '-':
+            # Standard input belongs to the caller, so it is left open
+            yield from self._parse_lines(sys.stdin)
+            return
+        try:
+            source = open(path, encoding='utf-8', errors='replace')
+        except OSError as e:
+            raise CommandError(f'Error reading {path}: {e}')
+        with source:
+            yield from self._parse_lines(source)
+
+    def _parse_lines(self, lines):
+        for line in lines:
+            entry = line.split('#', 1)[0].strip()
+            if entry:
+                # Feeds often carry extra columns after the address
+                yield entry.split()[0].split(',')[0].split(';')[0]
+
+    def _read_chunks(self, options, chunk_size):
+        """
+        Yield (addresses, networks) lists of validated, normalized entries
+        """
+        addresses = {}
+        networks = {}
+        for entry in self._read_entries(options):
             try:
-                # Validate IP address format
-                ipaddress.ip_address(ip_str)
-                
-                # Create blocked IP entry
-                blocked_ip, created = BlockedIP.objects.get_or_create(
-                    ip_address=ip_str,
-                    defaults={'reason': reason}
-                )
-                
-                if created:
-                    self.stdout.write(
-                        self.style.SUCCESS(f'Successfully blocked IP: {ip_str}')
-                    )
-                    blocked_count += 1
+                if '/' in entry:
+                    # Validate and normalize the network (host bits are cleared)
+                    networks[str(ipaddress.ip_network(entry, strict=False))] = None
                 else:
+                    # Same normalization as the middleware, so IPv4-mapped
+                    # IPv6 addresses are stored in dotted form
+                    parsed = parse_ip(entry)
+                    if parsed is None:
+                        raise ValueError(entry)
+                    addresses[parsed[0]] = None
+            except ValueError:
+                self.invalid += 1
+                if self.per_entry or self.verbosity >= 2:
                     self.stdout.write(
-                        self.style.WARNING(f'IP already blocked: {ip_str}')
+                        self.style.ERROR(f'Invalid IP address or network format: {entry}')
                     )
-                    skipped_count += 1
-                    
-            except ValueError:
-                self.stdout.write(
-                    self.style.ERROR(f'Invalid IP address format: {ip_str}')
-                )
-                skipped_count += 1
-            except IntegrityError:
-                self.stdout.write(
-                    self.style.WARNING(f'IP already blocked: {ip_str}')
-                )
-                skipped_count += 1
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(f'Error blocking IP {ip_str}: {e}')
+                continue
+            if len(addresses) + len(networks) >= chunk_size:
+                yield list(addresses), list(networks)
+                addresses = {}
+                networks = {}
+        if addresses or networks:
+            yield list(addresses), list(networks)
+
+    def _report(self, entries, existing, changed_message, unchanged_message):
+        if not self.per_entry:
+            return
+        for entry in entries:
+            if entry in existing:
+                self.stdout.write(self.style.WARNING(f'{unchanged_message}: {entry}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{changed_message}: {entry}'))
+
+    def _block_chunk(self, addresses, networks):
+        with transaction.atomic():
+            existing_addresses = set(
+                BlockedIP.objects.filter(ip_address__in=addresses).values_list('ip_address', flat=True)
+            )
+            existing_networks = set(
+                BlockedNetwork.objects.filter(network__in=networks).values_list('network', flat=True)
+            )
+            BlockedIP.objects.bulk_create(
+                [
+                    BlockedIP(ip_address=address, ip_packed=pack_ip(address), reason=self.reason)
+                    for address in addresses if address not in existing_addresses
+                ],
+                batch_size=1000,
+                ignore_conflicts=True
+            )
+            BlockedNetwork.objects.bulk_create(
+                [
+                    BlockedNetwork(network=network, reason=self.reason)
+                    for network in networks if network not in existing_networks
+                ],
+                batch_size=1000,
+                ignore_conflicts=True
+            )
+
+        existing = existing_addresses | existing_networks
+        self._report(addresses + networks, existing, 'Successfully blocked', 'Already blocked')
+        self.skipped += len(existing)
+        self.changed += len(addresses) + len(networks) - len(existing)
+
+    def _unblock_chunk(self, addresses, networks):
+        with transaction.atomic():
+            existing_addresses = set(
+                BlockedIP.objects.filter(ip_address__in=addresses).values_list('ip_address', flat=True)
+            )
+            existing_networks = set(
+                BlockedNetwork.objects.filter(network__in=networks).values_list('network', flat=True)
+            )
+            BlockedIP.objects.filter(ip_address__in=existing_addresses).delete()
+            BlockedNetwork.objects.filter(network__in=existing_networks).delete()
+
+        existing = existing_addresses | existing_networks
+        missing = set(addresses + networks) - existing
+        self._report(addresses + networks, missing, 'Successfully unblocked', 'Not blocked')
+        self.changed += len(existing)
+        self.skipped += len(missing)
+
+    def _sync(self, chunks):
+        """
+        Replace both tables with the input; the diff is computed in memory
+        and applied in a single transaction. Returns the number removed.
+        """
+        wanted_addresses = set()
+        wanted_networks = set()
+        for addresses, networks in chunks:
+            wanted_addresses.update(addresses)
+            wanted_networks.update(networks)
+        if not wanted_addresses and not wanted_networks:
+            raise CommandError('--sync with no valid entries would unblock everything; use --unblock instead')
+
+        with transaction.atomic():
+            current_addresses = set(BlockedIP.objects.values_list('ip_address', flat=True).iterator())
+            current_networks = set(BlockedNetwork.objects.values_list('network', flat=True).iterator())
+
+            removed_addresses = list(current_addresses - wanted_addresses)
+            removed_networks = list(current_networks - wanted_networks)
+            for start in range(0, len(removed_addresses), 10000):
+                BlockedIP.objects.filter(ip_address__in=removed_addresses[start:start + 10000]).delete()
+            for start in range(0, len(removed_networks), 10000):
+                BlockedNetwork.objects.filter(network__in=removed_networks[start:start + 10000]).delete()
+
+            added_addresses = wanted_addresses - current_addresses
+            added_networks = wanted_networks - current_networks
+            BlockedIP.objects.bulk_create(
+                [
+                    BlockedIP(ip_address=address, ip_packed=pack_ip(address), reason=self.reason)
+                    for address in added_addresses
+                ],
+                batch_size=1000,
+                ignore_conflicts=True
+            )
+            BlockedNetwork.objects.bulk_create(
+                [BlockedNetwork(network=network, reason=self.reason) for network in added_networks],
+                batch_size=1000,
+                ignore_conflicts=True
+            )
+
+        self.changed = len(added_addresses) + len(added_networks)
+        self.skipped = len(wanted_addresses) + len(wanted_networks) - self.changed
+        return len(removed_addresses) + len(removed_networks)
+
+    def _export(self, path):
+        started = time.monotonic()
+        output = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8')
+        count = 0
+        try:
+            for model, field in ((BlockedIP, 'ip_address'), (BlockedNetwork, 'network')):
+                for entry in model.objects.order_by(field).values_list(field, flat=True).iterator(chunk_size=10000):
+                    output.write(f'{entry}\n')
+                    count += 1
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        if path != '-':
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Exported {count} entries to {path} in {time.monotonic() - started:.2f}s'
                 )
-                skipped_count += 1
-        
-        # Summary
-        self.stdout.write(
-            self.style.SUCCESS(
-                f'\nBlocking complete: {blocked_count} IPs blocked, '
-                f'{skipped_count} IPs skipped'
             )
-        )
-        
\ No newline at end of file
@@ -0,0 +1,41 @@
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from ip_tracking.geodb import compile_csv, RangeDatabase
+
+class Command(BaseCommand):
+    help = 'Compile a CSV of IP ranges into a memory-mappable geolocation database'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'source',
+            type=str,
+            help="CSV file with a 'network' or 'start_ip'/'end_ip' column plus country, region, city"
+        )
+        parser.add_argument(
+            'destination',
+            type=str,
+            help='Path of the compiled database (set IP_GEOLOCATION_DATABASE to it)'
+        )
+    
+    def handle(self, *args, **options):
+        source = options['source']
+        destination = options['destination']
+        
+        started = time.monotonic()
+        try:
+            # Write to a temporary file so running workers never map a partial file
+            temporary = f'{destination}.tmp'
+            written, skipped = compile_csv(source, temporary)
+            RangeDatabase(temporary).close()
+        except OSError as e:
+            raise CommandError(f'Error compiling geolocation database: {e}')
+        
+        os.replace(temporary, destination)
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Compiled {written} ranges into {destination} '
+                f'({skipped} rows skipped) in {time.monotonic() - started:.2f}s'
+            )
+        )
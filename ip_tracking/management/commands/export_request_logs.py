@@ -0,0 +1,94 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from ip_tracking.export import ENCODERS, FORMATS, encode_chunks, export_queryset, parse_time_bound
+
+class Command(BaseCommand):
+    help = 'Stream RequestLog rows in a time range to NDJSON or CSV with flat memory use'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            type=str,
+            required=True,
+            help="Start of the range: an ISO 8601 datetime or a window before now such as '24h'"
+        )
+        parser.add_argument(
+            '--until',
+            type=str,
+            help='End of the range, exclusive (default: now)'
+        )
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            default='ndjson',
+            help='Output format (default: ndjson)'
+        )
+        parser.add_argument(
+            '--network',
+            type=str,
+            help='Only export addresses in this CIDR network'
+        )
+        parser.add_argument(
+            '--gzip',
+            action='store_true',
+            help='Compress the output as a gzip stream'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default='-',
+            help="File to write ('-' for standard output, the default)"
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Rows fetched from the database cursor and encoded at a time (default: 5000)'
+        )
+    
+    def handle(self, *args, **options):
+        now = timezone.now()
+        try:
+            since = parse_time_bound(options['since'], now)
+            until = parse_time_bound(options['until'], now) if options['until'] else now
+            queryset = export_queryset(since, until, options['network'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        
+        chunk_size = options['chunk_size']
+        self.exported = 0
+        
+        def counted(rows):
+            for row in rows:
+                self.exported += 1
+                yield row
+        
+        rows = counted(queryset.iterator(chunk_size=chunk_size))
+        chunks = encode_chunks(ENCODERS[options['format']](rows, chunk_size), options['gzip'])
+        
+        path = options['output']
+        started = time.monotonic()
+        try:
+            output = sys.stdout.buffer if path == '-' else open(path, 'wb')
+        except OSError as e:
+            raise CommandError(f'Error writing {path}: {e}')
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if path == '-':
+                output.flush()
+            else:
+                output.close()
+        
+        elapsed = time.monotonic() - started
+        rate = self.exported / elapsed if elapsed else 0
+        # Keep standard output clean for the export itself
+        self.stderr.write(
+            self.style.SUCCESS(
+                f'Exported {self.exported} rows from {since:%Y-%m-%d %H:%M:%S} to {until:%Y-%m-%d %H:%M:%S} '
+                f'in {elapsed:.2f}s ({rate:.0f} rows/s)'
+            )
+        )
@@ -0,0 +1,94 @@
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from ip_tracking.addresses import pack_ip
+from ip_tracking.models import RequestLog
+from ip_tracking.rollups import retention_horizon, roll_up_hours, truncate_to_hour
+from ip_tracking.segments import Checkpoint, consume, prune_consumed
+from ip_tracking.sinks import get_segment_directory
+
+class Command(BaseCommand):
+    help = 'Load binary request log segments into RequestLog, resuming from the last checkpoint'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows per bulk insert and checkpoint (default: 5000)'
+        )
+        parser.add_argument(
+            '--delete-consumed',
+            action='store_true',
+            help='Delete segments every consumer has fully read once they are idle'
+        )
+    
+    def handle(self, *args, **options):
+        directory = get_segment_directory()
+        batch_size = options['batch_size']
+        checkpoint = Checkpoint(directory, 'loader')
+        
+        started = time.monotonic()
+        loaded = 0
+        oldest = newest = None
+        batch = []
+        offsets = {}
+        for segment, end, ip_address, timestamp, path in consume(directory, checkpoint):
+            oldest = timestamp if oldest is None else min(oldest, timestamp)
+            newest = timestamp if newest is None else max(newest, timestamp)
+            batch.append(RequestLog(
+                ip_address=ip_address,
+                ip_packed=pack_ip(ip_address),
+                path=path[:255],
+                timestamp=datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+            ))
+            offsets[segment] = end
+            if len(batch) >= batch_size:
+                loaded += self._load_batch(batch, offsets, checkpoint)
+                batch = []
+                offsets = {}
+        if batch:
+            loaded += self._load_batch(batch, offsets, checkpoint)
+        
+        elapsed = time.monotonic() - started
+        rate = loaded / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(f'Loaded {loaded} rows in {elapsed:.2f}s ({rate:.0f} rows/s)')
+        )
+        
+        if oldest is not None:
+            self._roll_up(
+                datetime.fromtimestamp(oldest, tz=dt_timezone.utc),
+                datetime.fromtimestamp(newest, tz=dt_timezone.utc)
+            )
+        
+        if options['delete_consumed']:
+            min_idle = getattr(settings, 'IP_TRACKING_SEGMENT_MAX_AGE', 300) * 2
+            deleted = prune_consumed(directory, min_idle)
+            self.stdout.write(self.style.SUCCESS(f'Deleted {len(deleted)} consumed segments'))
+    
+    def _roll_up(self, oldest, newest):
+        """
+        Recompute the hourly rollups for the loaded window. Hours past the
+        retention horizon and the current hour are left to the rollup task.
+        """
+        start = max(truncate_to_hour(oldest), retention_horizon())
+        end = min(truncate_to_hour(newest) + timedelta(hours=1), truncate_to_hour(timezone.now()))
+        if end > start:
+            created = roll_up_hours(start, end)
+            self.stdout.write(self.style.SUCCESS(f'Rolled up {created} hourly rows'))
+    
+    def _load_batch(self, batch, offsets, checkpoint):
+        """
+        Insert a batch, then advance the checkpoint past it.
+        A crash between the two can replay (duplicate) at most one batch.
+        """
+        with transaction.atomic():
+            RequestLog.objects.bulk_create(batch)
+        for segment, end in offsets.items():
+            checkpoint.set(segment, end)
+        checkpoint.save()
+        return len(batch)
@@ -0,0 +1,59 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from ip_tracking import partitioning
+
+class Command(BaseCommand):
+    help = 'Manage daily PostgreSQL partitions of the RequestLog table'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--setup',
+            action='store_true',
+            help='Convert RequestLog into a partitioned table (copies all rows; run during maintenance)'
+        )
+        parser.add_argument(
+            '--days-ahead',
+            type=int,
+            default=7,
+            help='Create partitions for today and this many days ahead (default: 7)'
+        )
+        parser.add_argument(
+            '--drop-older-than',
+            type=int,
+            metavar='DAYS',
+            help='Drop partitions holding only rows older than this many days'
+        )
+        parser.add_argument(
+            '--list',
+            action='store_true',
+            help='List existing daily partitions'
+        )
+    
+    def handle(self, *args, **options):
+        if not partitioning.is_supported():
+            raise CommandError('RequestLog partitioning is only supported on PostgreSQL')
+        
+        if options['setup']:
+            if partitioning.convert_to_partitioned(days_ahead=options['days_ahead']):
+                self.stdout.write(self.style.SUCCESS('Converted RequestLog to a partitioned table'))
+            else:
+                self.stdout.write(self.style.WARNING('RequestLog is already partitioned'))
+        elif not partitioning.is_partitioned():
+            raise CommandError('RequestLog is not partitioned yet; run with --setup first')
+        
+        partitioning.create_partitions(days_ahead=options['days_ahead'])
+        self.stdout.write(
+            self.style.SUCCESS(f"Partitions exist through {options['days_ahead']} days ahead")
+        )
+        
+        if options['drop_older_than'] is not None:
+            cutoff = timezone.localdate() - timedelta(days=options['drop_older_than'])
+            dropped = partitioning.drop_partitions_before(cutoff)
+            for name in dropped:
+                self.stdout.write(f'Dropped partition {name}')
+            self.stdout.write(self.style.SUCCESS(f'{len(dropped)} partitions dropped'))
+        
+        if options['list']:
+            for name, day in partitioning.list_partitions():
+                self.stdout.write(f'{name}\t{day.isoformat()}')
@@ -0,0 +1,205 @@
+import itertools
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from ip_tracking.addresses import pack_ip
+from ip_tracking.geolocation import geolocation_service
+from ip_tracking.ingest import PARSERS, detect_format, parse_chunk, read_chunks
+from ip_tracking.models import RequestLog
+from ip_tracking.rollups import retention_horizon, roll_up_hours, truncate_to_hour
+from ip_tracking.tasks import detect_excessive_requests, detect_sensitive_access
+
+class Command(BaseCommand):
+    help = 'Replay nginx access logs or JSONL request dumps into RequestLog'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files',
+            nargs='+',
+            type=str,
+            help="Log files to replay ('-' reads standard input)"
+        )
+        parser.add_argument(
+            '--format',
+            choices=['auto', *PARSERS],
+            default='auto',
+            help='Log format (default: detected from the first line of each file)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Parser processes; 0 parses in this process (default: CPU count)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=10000,
+            help='Lines handed to a parser process at a time (default: 10000)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows per bulk insert (default: 5000)'
+        )
+        parser.add_argument(
+            '--enrich',
+            action='store_true',
+            help='Geolocate each chunk before inserting instead of leaving it to the enrichment task'
+        )
+        parser.add_argument(
+            '--detect',
+            action='store_true',
+            help='Run the suspicious IP detectors over the replayed time window'
+        )
+    
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.enrich = options['enrich']
+        self.verbosity = options['verbosity']
+        workers = options['workers']
+        
+        started = time.monotonic()
+        self.loaded = 0
+        self.skipped = 0
+        self.oldest = None
+        self.newest = None
+        
+        pool = None
+        if workers > 0:
+            # Forked workers must not inherit open database connections
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=workers)
+        try:
+            for path in options['files']:
+                self._replay_file(path, options['format'], options['chunk_size'], pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        
+        elapsed = time.monotonic() - started
+        rate = self.loaded / elapsed if elapsed else 0
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Replayed {self.loaded} rows ({self.skipped} lines skipped) '
+                f'in {elapsed:.2f}s ({rate:.0f} rows/s)'
+            )
+        )
+        
+        if self.oldest is not None:
+            self._roll_up()
+        if options['detect'] and self.oldest is not None:
+            self._detect()
+    
+    def _replay_file(self, path, log_format, chunk_size, pool):
+        try:
+            source = sys.stdin if path == '-' else open(path, encoding='utf-8', errors='replace')
+        except OSError as e:
+            raise CommandError(f'Error reading {path}: {e}')
+        
+        with source:
+            lines = iter(source)
+            if log_format == 'auto':
+                first = next((line for line in lines if line.strip()), None)
+                if first is None:
+                    return
+                log_format = detect_format(first)
+                lines = itertools.chain([first], lines)
+            
+            chunks = read_chunks(lines, chunk_size)
+            for records, skipped in self._parse(chunks, log_format, pool):
+                self.skipped += skipped
+                if records:
+                    self._write(self._build_rows(records))
+                if self.verbosity >= 2:
+                    self.stdout.write(f'{path}: {self.loaded} rows loaded')
+    
+    def _parse(self, chunks, log_format, pool):
+        """
+        Yield parsed chunks in order, keeping a bounded number in flight so
+        the whole file is never read into memory ahead of the inserts
+        """
+        if pool is None:
+            for chunk in chunks:
+                yield parse_chunk(chunk, log_format)
+            return
+        
+        pending = deque()
+        max_pending = pool._max_workers * 2
+        for chunk in chunks:
+            pending.append(pool.submit(parse_chunk, chunk, log_format))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    
+    def _build_rows(self, records):
+        locations = {}
+        if self.enrich:
+            locations = geolocation_service.get_geolocation_batch(
+                [ip_address for ip_address, _, _ in records]
+            )
+        
+        rows = []
+        for ip_address, path, timestamp in records:
+            timestamp = datetime.fromtimestamp(timestamp, tz=dt_timezone.utc)
+            if self.oldest is None or timestamp < self.oldest:
+                self.oldest = timestamp
+            if self.newest is None or timestamp > self.newest:
+                self.newest = timestamp
+            
+            row = RequestLog(
+                ip_address=ip_address, ip_packed=pack_ip(ip_address), path=path, timestamp=timestamp
+            )
+            geolocation_data = locations.get(ip_address)
+            if geolocation_data and not geolocation_data.get('error'):
+                row.country = geolocation_data.get('country')
+                row.city = geolocation_data.get('city')
+                row.region = geolocation_data.get('region')
+                row.geolocated = True
+            rows.append(row)
+        return rows
+    
+    def _write(self, rows):
+        RequestLog.objects.bulk_create(rows, batch_size=self.batch_size)
+        self.loaded += len(rows)
+    
+    def _roll_up(self):
+        """
+        Recompute the hourly rollups for the replayed window. Hours past the
+        retention horizon and the current hour are left to the rollup task.
+        """
+        start = max(truncate_to_hour(self.oldest), retention_horizon())
+        end = min(truncate_to_hour(self.newest) + timedelta(hours=1), truncate_to_hour(timezone.now()))
+        if end <= start:
+            return
+        created = roll_up_hours(start, end)
+        if self.verbosity >= 2:
+            self.stdout.write(f'Rolled up {created} hourly rows from {start.isoformat()} to {end.isoformat()}')
+    
+    def _detect(self):
+        """
+        Run the detectors hour by hour across the replayed window
+        """
+        excessive = set()
+        end = self.newest + timedelta(microseconds=1)
+        hour = truncate_to_hour(self.oldest)
+        while hour < end:
+            excessive.update(detect_excessive_requests(hour, hour + timedelta(hours=1)))
+            hour += timedelta(hours=1)
+        sensitive = detect_sensitive_access(self.oldest, end)
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Flagged {len(excessive)} IPs for excessive requests and '
+                f'{len(sensitive)} for sensitive path access between '
+                f'{self.oldest.isoformat()} and {self.newest.isoformat()}'
+            )
+        )
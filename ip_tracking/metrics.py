@@ -0,0 +1,234 @@
+"""
+Low-overhead request metrics in the Prometheus text exposition format.
+
+Counters and fixed-bucket histograms keep one shard per thread. A thread
+only ever writes its own shard, so recording needs no lock; shards are
+summed when the metrics are rendered. Shards of finished threads are folded
+into a base shard, so totals never go backwards and the shard list stays as
+long as the number of live threads.
+"""
+import bisect
+import threading
+
+# Upper bounds in seconds, from 10µs (in-process checks) to 5s (API calls)
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+
+def _format_labels(labels, extra=None):
+    labels = dict(labels, **(extra or {}))
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Sharded:
+    def __init__(self, name, documentation, labels=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels or {}
+        self._local = threading.local()
+        # (thread, shard) for every thread that has recorded a value
+        self._shards = []
+        self._base = self._new_shard()
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = self._new_shard()
+            # Only taken once per thread
+            with self._lock:
+                self._fold_finished()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _fold_finished(self):
+        # A finished thread never writes again, so its shard can be summed
+        # into the base and dropped; called with the lock held
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                for index, value in enumerate(shard):
+                    self._base[index] += value
+        self._shards = live
+
+    def _all_shards(self):
+        with self._lock:
+            self._fold_finished()
+            return [list(self._base)] + [shard for _, shard in self._shards]
+
+
+class Counter(_Sharded):
+    type = 'counter'
+
+    def _new_shard(self):
+        return [0]
+
+    def inc(self, amount=1):
+        self._shard()[0] += amount
+
+    @property
+    def value(self):
+        return sum(shard[0] for shard in self._all_shards())
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Histogram(_Sharded):
+    """
+    Histogram with fixed bucket upper bounds, in seconds
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=None, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labels)
+
+    def _new_shard(self):
+        # One count per bucket plus +Inf, then the running sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, seconds):
+        shard = self._shard()
+        shard[bisect.bisect_left(self.buckets, seconds)] += 1
+        shard[-1] += seconds
+
+    def snapshot(self):
+        """
+        Return (per-bucket counts including +Inf, total count, sum)
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for shard in self._all_shards():
+            for index in range(len(counts)):
+                counts[index] += shard[index]
+            total += shard[-1]
+        return counts, sum(counts), total
+
+    def samples(self):
+        counts, count, total = self.snapshot()
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield f'{self.name}_bucket', dict(self.labels, le=le), cumulative
+        yield f'{self.name}_count', self.labels, count
+        yield f'{self.name}_sum', self.labels, total
+
+
+class Gauge:
+    """
+    Value read from a callback when the metrics are rendered
+    """
+    type = 'gauge'
+
+    def __init__(self, name, documentation, function, labels=None):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labels = labels or {}
+
+    def samples(self):
+        try:
+            value = self.function()
+        except Exception:
+            return
+        yield self.name, self.labels, value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=None):
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=None, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, function, labels=None):
+        return self.register(Gauge(name, documentation, function, labels))
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text format
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+
+        lines = []
+        described = set()
+        for metric in metrics:
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(f'# HELP {metric.name} {metric.documentation}')
+                lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+# Create a global instance
+registry = Registry()
+
+
+def _stage(stage):
+    return registry.histogram(
+        'ip_tracking_middleware_stage_seconds',
+        'Time spent in each IPLoggingMiddleware stage',
+        labels={'stage': stage}
+    )
+
+
+def _geolocation(source):
+    return registry.histogram(
+        'ip_tracking_geolocation_seconds',
+        'Geolocation lookup latency by the tier that answered',
+        labels={'source': source}
+    )
+
+
+CLIENT_IP_SECONDS = _stage('client_ip')
+BLOCK_CHECK_SECONDS = _stage('block_check')
+LOG_WRITE_SECONDS = _stage('log_write')
+# Middleware time excluding the wrapped view
+OVERHEAD_SECONDS = _stage('total')
+
+GEOLOCATION_OFFLINE_SECONDS = _geolocation('offline')
+GEOLOCATION_CACHE_SECONDS = _geolocation('cache')
+GEOLOCATION_API_SECONDS = _geolocation('api')
+GEOLOCATION_UNRESOLVED_SECONDS = _geolocation('unresolved')
+
+LOG_BATCH_WRITE_SECONDS = registry.histogram(
+    'ip_tracking_log_batch_write_seconds',
+    'Time to insert one batch of buffered RequestLog rows'
+)
+
+BLOCKED_RESPONSES = registry.counter(
+    'ip_tracking_responses_total',
+    'Responses short-circuited by ip_tracking',
+    labels={'status': '403'}
+)
+RATE_LIMITED_RESPONSES = registry.counter(
+    'ip_tracking_responses_total',
+    'Responses short-circuited by ip_tracking',
+    labels={'status': '429'}
+)
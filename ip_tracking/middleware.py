@@ -1,26 +1,111 @@
-import socket
+import asyncio
+import math
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.conf import settings
-from django.http import HttpResponseForbidden
-from .models import RequestLog, BlockedIP
-from .geolocation import geolocation_service
+from django.http import HttpResponse, HttpResponseForbidden
+from . import metrics
+from .addresses import IPV4_MAPPED_PREFIX, parse_ip
+from .blocklist import blocklist
+from .detection import streaming_detector
+from .ratelimit import rate_limiter
+from .sinks import log_sink
+from .sketches import traffic_sketches
+from .suspicious import suspicious_ips
 
 class IPLoggingMiddleware:
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
+        # Stricter global limit, and optional delay, for active suspicious IPs
+        self.suspicious_rate = getattr(settings, 'IP_TRACKING_SUSPICIOUS_RATE', '30/m')
+        self.tarpit_seconds = getattr(settings, 'IP_TRACKING_SUSPICIOUS_TARPIT_SECONDS', 0)
+        # Process-wide collaborators; attributes so a benchmark can swap in its own
+        self.log_sink = log_sink
+        self.detector = streaming_detector
+        self.sketches = traffic_sketches
+        self.suspicious_ips = suspicious_ips
+        # Run natively on the event loop when the handler chain is async
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
     
     def __call__(self, request):
-        # Get the client IP address
-        ip_address = self.get_client_ip(request)
+        if self.is_async:
+            return self.__acall__(request)
+        
+        started = time.perf_counter()
+        
+        # Get the client IP address, parsed once into its packed value
+        ip_address, ip_value = self.parse_client_ip(request)
+        parsed = time.perf_counter()
+        metrics.CLIENT_IP_SECONDS.observe(parsed - started)
         
         # Check if IP is blocked before processing the request
-        if self.is_ip_blocked(ip_address):
+        blocked = self.is_ip_blocked(ip_address, ip_value)
+        checked = time.perf_counter()
+        metrics.BLOCK_CHECK_SECONDS.observe(checked - parsed)
+        if blocked:
+            metrics.BLOCKED_RESPONSES.inc()
+            metrics.OVERHEAD_SECONDS.observe(checked - started)
             return HttpResponseForbidden("IP address blocked")
         
+        # Reject suspicious IPs over their limit before running the view
+        if self.suspicious_ips.contains(ip_address, ip_value):
+            throttled = self.throttle_suspicious(ip_address)
+            if throttled is not None:
+                if self.tarpit_seconds:
+                    time.sleep(self.tarpit_seconds)
+                metrics.OVERHEAD_SECONDS.observe(time.perf_counter() - started)
+                return throttled
+        
         # Process the request
         response = self.get_response(request)
         
-        # Log the request after processing (with geolocation)
-        self.log_request(ip_address, request.path)
+        # Log the request after processing
+        responded = time.perf_counter()
+        self.log_request(ip_address, request.path, ip_value=ip_value)
+        logged = time.perf_counter()
+        metrics.LOG_WRITE_SECONDS.observe(logged - responded)
+        metrics.OVERHEAD_SECONDS.observe((checked - started) + (logged - responded))
+        
+        return response
+    
+    async def __acall__(self, request):
+        """
+        Async request path: no thread hops and no blocking calls on the loop
+        """
+        started = time.perf_counter()
+        
+        ip_address, ip_value = self.parse_client_ip(request)
+        parsed = time.perf_counter()
+        metrics.CLIENT_IP_SECONDS.observe(parsed - started)
+        
+        blocked = await self.ais_ip_blocked(ip_address, ip_value)
+        checked = time.perf_counter()
+        metrics.BLOCK_CHECK_SECONDS.observe(checked - parsed)
+        if blocked:
+            metrics.BLOCKED_RESPONSES.inc()
+            metrics.OVERHEAD_SECONDS.observe(checked - started)
+            return HttpResponseForbidden("IP address blocked")
+        
+        if await self.suspicious_ips.acontains(ip_address, ip_value):
+            throttled = await self.athrottle_suspicious(ip_address)
+            if throttled is not None:
+                if self.tarpit_seconds:
+                    await asyncio.sleep(self.tarpit_seconds)
+                metrics.OVERHEAD_SECONDS.observe(time.perf_counter() - started)
+                return throttled
+        
+        response = await self.get_response(request)
+        
+        responded = time.perf_counter()
+        self.log_request(ip_address, request.path, block=False, ip_value=ip_value)
+        logged = time.perf_counter()
+        metrics.LOG_WRITE_SECONDS.observe(logged - responded)
+        metrics.OVERHEAD_SECONDS.observe((checked - started) + (logged - responded))
         
         return response
     
@@ -28,54 +113,92 @@ class IPLoggingMiddleware:
         """
         Get the client's real IP address, handling proxy headers
         """
+        return self.parse_client_ip(request)[0]
+    
+    def parse_client_ip(self, request):
+        """
+        Return the client's normalized IP address and its 128-bit packed
+        value (IPv4 mapped into IPv6), validating it in a single parse
+        """
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
         if x_forwarded_for:
             ip = x_forwarded_for.split(',')[0].strip()
         else:
             ip = request.META.get('REMOTE_ADDR')
         
-        # Validate IP format
+        parsed = parse_ip(ip)
+        if parsed is None and x_forwarded_for:
+            parsed = parse_ip(request.META.get('REMOTE_ADDR'))
+        if parsed is None:
+            parsed = ('0.0.0.0', IPV4_MAPPED_PREFIX)
+        return parsed
+    
+    def is_ip_blocked(self, ip_address, ip_value=None):
+        """
+        Check if the IP address is in the blocklist snapshot
+        """
+        return blocklist.is_blocked(ip_address, ip_value)
+    
+    async def ais_ip_blocked(self, ip_address, ip_value=None):
+        """
+        Async variant of is_ip_blocked; snapshot reloads use async cache/ORM calls
+        """
+        return await blocklist.ais_blocked(ip_address, ip_value)
+    
+    def throttle_suspicious(self, ip_address):
+        """
+        Apply the suspicious-IP rate limit; returns a 429 response when the
+        limit is exceeded, otherwise None
+        """
+        try:
+            result = rate_limiter.check(f"suspicious:{ip_address}", self.suspicious_rate)
+        except Exception as e:
+            # Fail open: a broken limiter backend must not take the site down
+            if settings.DEBUG:
+                print(f"Error checking suspicious IP rate limit: {e}")
+            return None
+        return self.throttled_response(result)
+    
+    async def athrottle_suspicious(self, ip_address):
+        """
+        Async variant of throttle_suspicious; the limiter backend's I/O runs
+        off the event loop
+        """
         try:
-            if ':' in ip:  # IPv6
-                socket.inet_pton(socket.AF_INET6, ip)
-            else:  # IPv4
-                socket.inet_pton(socket.AF_INET, ip)
-            return ip
-        except (socket.error, OSError):
-            return request.META.get('REMOTE_ADDR', '0.0.0.0')
+            result = await rate_limiter.acheck(f"suspicious:{ip_address}", self.suspicious_rate)
+        except Exception as e:
+            if settings.DEBUG:
+                print(f"Error checking suspicious IP rate limit: {e}")
+            return None
+        return self.throttled_response(result)
     
-    def is_ip_blocked(self, ip_address):
+    def throttled_response(self, result):
         """
-        Check if the IP address is in the blocklist
+        Return a 429 response for a denied rate limit result, otherwise None
         """
-        return BlockedIP.objects.filter(ip_address=ip_address).exists()
+        if result.allowed:
+            return None
+        
+        metrics.RATE_LIMITED_RESPONSES.inc()
+        response = HttpResponse("Too many requests", status=429)
+        response['Retry-After'] = str(math.ceil(result.retry_after))
+        return response
     
-    def log_request(self, ip_address, path):
+    def log_request(self, ip_address, path, block=True, ip_value=None):
         """
-        Log the request to the database with geolocation data
+        Hand the request log to the configured sink and feed the streaming
+        detector and traffic sketches. Location fields are filled in later by the geolocation
+        enrichment task.
+        With block=False no sink waits on the database or the disk (the
+        segment sink fsyncs from its own thread), so this is also safe to
+        call from the event loop.
         """
         try:
-            # Get geolocation data
-            geolocation_data = geolocation_service.get_geolocation(ip_address)
-            
-            # Extract location information
-            country = None
-            city = None
-            region = None
-            
-            if geolocation_data and not geolocation_data.get('error'):
-                country = geolocation_data.get('country')
-                city = geolocation_data.get('city')
-                region = geolocation_data.get('region')
-            
-            RequestLog.objects.create(
-                ip_address=ip_address,
-                path=path,
-                country=country,
-                city=city,
-                region=region
-            )
+            self.log_sink.write(ip_address, path, block=block, ip_value=ip_value)
+            self.sketches.observe(ip_address, path, ip_value)
+            if self.detector.observe(ip_address, path):
+                # Throttle newly flagged IPs without waiting for the next reload
+                self.suspicious_ips.add(ip_address, ip_value)
         except Exception as e:
             if settings.DEBUG:
                 print(f"Error logging request: {e}")
-                
\ No newline at end of file
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:13
+
+from django.db import migrations, models
+import django.utils.timezone
+import ip_tracking.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0003_ipgeolocationcache_requestlog_city_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockedNetwork',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('network', models.CharField(max_length=43, unique=True, validators=[ip_tracking.models.validate_ip_network])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('reason', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Blocked Network',
+                'verbose_name_plural': 'Blocked Networks',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SuspiciousIP',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ip_address', models.GenericIPAddressField(unique=True)),
+                ('reason', models.CharField(max_length=255)),
+                ('first_detected', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_detected', models.DateTimeField(default=django.utils.timezone.now)),
+                ('is_active', models.BooleanField(default=True)),
+            ],
+            options={
+                'verbose_name': 'Suspicious IP',
+                'verbose_name_plural': 'Suspicious IPs',
+                'ordering': ['-last_detected'],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:14
+
+from django.db import migrations, models
+
+
+def mark_existing_rows_geolocated(apps, schema_editor):
+    # Rows logged before enrichment was deferred already carry their location
+    RequestLog = apps.get_model('ip_tracking', 'RequestLog')
+    RequestLog.objects.filter(country__isnull=False).update(geolocated=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0005_alter_requestlog_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='requestlog',
+            name='geolocated',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_existing_rows_geolocated, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(condition=models.Q(('geolocated', False)), fields=['ip_address'], name='requestlog_pending_geo_idx'),
+        ),
+    ]
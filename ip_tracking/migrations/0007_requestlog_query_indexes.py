@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0006_requestlog_geolocated'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['timestamp', 'ip_address'], name='requestlog_ts_ip_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['path', 'timestamp'], name='requestlog_path_ts_idx'),
+        ),
+    ]
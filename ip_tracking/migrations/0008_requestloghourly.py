@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0007_requestlog_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestLogHourly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('ip_address', models.GenericIPAddressField()),
+                ('path', models.CharField(max_length=255)),
+                ('country', models.CharField(blank=True, default='', max_length=100)),
+                ('request_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Hourly Request Count',
+                'verbose_name_plural': 'Hourly Request Counts',
+                'ordering': ['-hour'],
+                'indexes': [models.Index(fields=['hour', 'path'], name='requestloghourly_hour_path_idx'), models.Index(fields=['hour', 'country'], name='requestloghourly_hour_cc_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='requestloghourly',
+            constraint=models.UniqueConstraint(fields=('hour', 'ip_address', 'path', 'country'), name='requestloghourly_unique_bucket'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-17 07:42
+
+import ipaddress
+from django.db import migrations, models
+
+
+def pack(ip_address):
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return None
+    if address.version == 4:
+        return b'\x00' * 10 + b'\xff\xff' + address.packed
+    return address.packed
+
+
+def backfill_packed_addresses(apps, schema_editor, batch_size=5000):
+    for model_name in ('RequestLog', 'BlockedIP', 'IPGeolocationCache'):
+        model = apps.get_model('ip_tracking', model_name)
+        last_id = 0
+        while True:
+            rows = list(
+                model.objects
+                .filter(id__gt=last_id, ip_packed__isnull=True)
+                .order_by('id')
+                .only('id', 'ip_address')[:batch_size]
+            )
+            if not rows:
+                break
+            for row in rows:
+                row.ip_packed = pack(row.ip_address)
+            model.objects.bulk_update(rows, ['ip_packed'])
+            last_id = rows[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ip_tracking', '0008_requestloghourly'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blockedip',
+            name='ip_packed',
+            field=models.BinaryField(db_index=True, max_length=16, null=True),
+        ),
+        migrations.AddField(
+            model_name='ipgeolocationcache',
+            name='ip_packed',
+            field=models.BinaryField(db_index=True, max_length=16, null=True),
+        ),
+        migrations.AddField(
+            model_name='requestlog',
+            name='ip_packed',
+            field=models.BinaryField(max_length=16, null=True),
+        ),
+        migrations.RunPython(backfill_packed_addresses, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='requestlog',
+            index=models.Index(fields=['ip_packed', 'timestamp'], name='requestlog_packed_ts_idx'),
+        ),
+    ]
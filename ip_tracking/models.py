@@ -1,28 +1,129 @@
+import ipaddress
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils import timezone
+from .addresses import network_bounds, pack_ip, pack_value, shard_bounds
+
+def validate_ip_network(value):
+    """
+    Validate an IPv4 or IPv6 network in CIDR notation
+    """
+    try:
+        ipaddress.ip_network(value, strict=False)
+    except ValueError:
+        raise ValidationError(f'Enter a valid IPv4 or IPv6 network in CIDR notation: {value}')
+
+class IPQuerySet(models.QuerySet):
+    def in_network(self, network):
+        """
+        Filter to addresses inside network (CIDR) with one range scan on ip_packed
+        """
+        first, last = network_bounds(network)
+        return self.filter(ip_packed__gte=pack_value(first), ip_packed__lte=pack_value(last))
+    
+    def in_shard(self, shard, shards):
+        """
+        Filter to one address range from shard_bounds; the IPv6 shard also
+        takes rows whose ip_packed is not set
+        """
+        low, high = shard_bounds(shard, shards)
+        if high is None:
+            return self.filter(models.Q(ip_packed__gte=pack_value(low)) | models.Q(ip_packed__isnull=True))
+        return self.filter(ip_packed__gte=pack_value(low), ip_packed__lt=pack_value(high))
 
 class RequestLog(models.Model):
     ip_address = models.GenericIPAddressField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # 16-byte big-endian address with IPv4 mapped into IPv6, for range
+    # scans and grouping on a compact key
+    ip_packed = models.BinaryField(max_length=16, null=True, editable=False)
+    # Set when the request is seen, not when the buffered row is inserted
+    timestamp = models.DateTimeField(default=timezone.now)
     path = models.CharField(max_length=255)
     country = models.CharField(max_length=100, blank=True, null=True)
     city = models.CharField(max_length=100, blank=True, null=True)
     region = models.CharField(max_length=100, blank=True, null=True)
+    # Location fields are filled in later by the enrichment task
+    geolocated = models.BooleanField(default=False)
+    
+    objects = IPQuerySet.as_manager()
     
     class Meta:
         ordering = ['-timestamp']
         verbose_name = 'Request Log'
         verbose_name_plural = 'Request Logs'
+        indexes = [
+            # Serves the default ordering and time-window scans grouped by IP
+            models.Index(fields=['timestamp', 'ip_address'], name='requestlog_ts_ip_idx'),
+            # Serves path__in filters restricted to a time window
+            models.Index(fields=['path', 'timestamp'], name='requestlog_path_ts_idx'),
+            models.Index(
+                fields=['ip_address'],
+                condition=models.Q(geolocated=False),
+                name='requestlog_pending_geo_idx',
+            ),
+            models.Index(fields=['ip_packed', 'timestamp'], name='requestlog_packed_ts_idx'),
+        ]
     
     def __str__(self):
         location = f"{self.city}, {self.country}" if self.city and self.country else "Unknown"
         return f"{self.ip_address} - {location} - {self.path}"
+    
+    def save(self, *args, **kwargs):
+        if self.ip_packed is None:
+            self.ip_packed = pack_ip(str(self.ip_address))
+        super().save(*args, **kwargs)
+
+class RequestLogHourly(models.Model):
+    """Request counts per (hour, ip, path, country), rolled up from RequestLog"""
+    hour = models.DateTimeField()
+    ip_address = models.GenericIPAddressField()
+    path = models.CharField(max_length=255)
+    # Empty string rather than NULL so the unique constraint covers unknown countries
+    country = models.CharField(max_length=100, blank=True, default='')
+    request_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-hour']
+        verbose_name = 'Hourly Request Count'
+        verbose_name_plural = 'Hourly Request Counts'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hour', 'ip_address', 'path', 'country'],
+                name='requestloghourly_unique_bucket',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['hour', 'path'], name='requestloghourly_hour_path_idx'),
+            models.Index(fields=['hour', 'country'], name='requestloghourly_hour_cc_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.hour:%Y-%m-%d %H:00} - {self.ip_address} - {self.path} - {self.request_count}"
+
+class RequestLogRollupState(models.Model):
+    """
+    Single row holding the highest RequestLog id the rollup has accounted
+    for. Rows above it arrived since the last run, wherever their timestamps
+    fall.
+    """
+    last_log_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Rollup State'
+        verbose_name_plural = 'Rollup State'
+    
+    def __str__(self):
+        return f"Rolled up through RequestLog id {self.last_log_id}"
 
 class BlockedIP(models.Model):
     ip_address = models.GenericIPAddressField(unique=True)
+    ip_packed = models.BinaryField(max_length=16, null=True, editable=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     reason = models.TextField(blank=True, null=True)
     
+    objects = IPQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Blocked IP'
         verbose_name_plural = 'Blocked IPs'
@@ -30,9 +131,33 @@ class BlockedIP(models.Model):
     
     def __str__(self):
         return f"{self.ip_address} - {self.created_at}"
+    
+    def save(self, *args, **kwargs):
+        """Keep the packed address in step with ip_address"""
+        self.ip_packed = pack_ip(str(self.ip_address))
+        super().save(*args, **kwargs)
+
+class BlockedNetwork(models.Model):
+    network = models.CharField(max_length=43, unique=True, validators=[validate_ip_network])
+    created_at = models.DateTimeField(auto_now_add=True)
+    reason = models.TextField(blank=True, null=True)
+    
+    class Meta:
+        verbose_name = 'Blocked Network'
+        verbose_name_plural = 'Blocked Networks'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.network} - {self.created_at}"
+    
+    def save(self, *args, **kwargs):
+        """Store the network in normalized CIDR form (host bits cleared)"""
+        self.network = str(ipaddress.ip_network(self.network, strict=False))
+        super().save(*args, **kwargs)
 
 class IPGeolocationCache(models.Model):
     ip_address = models.GenericIPAddressField(unique=True)
+    ip_packed = models.BinaryField(max_length=16, null=True, editable=False, db_index=True)
     country = models.CharField(max_length=100, blank=True, null=True)
     city = models.CharField(max_length=100, blank=True, null=True)
     region = models.CharField(max_length=100, blank=True, null=True)
@@ -42,6 +167,8 @@ class IPGeolocationCache(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
     
+    objects = IPQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'IP Geolocation Cache'
         verbose_name_plural = 'IP Geolocation Caches'
@@ -49,6 +176,11 @@ class IPGeolocationCache(models.Model):
     
     def __str__(self):
         return f"{self.ip_address} - {self.country}"
+    
+    def save(self, *args, **kwargs):
+        """Keep the packed address in step with ip_address"""
+        self.ip_packed = pack_ip(str(self.ip_address))
+        super().save(*args, **kwargs)
 
 class SuspiciousIP(models.Model):
     ip_address = models.GenericIPAddressField(unique=True)
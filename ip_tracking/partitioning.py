@@ -0,0 +1,184 @@
+"""
+Optional daily range partitioning of the RequestLog table on PostgreSQL.
+
+Once converted, RequestLog is a table partitioned by RANGE ("timestamp") with
+one partition per day plus a default partition. Queries on recent windows
+only touch the matching partitions, and old data is dropped a partition at a
+time instead of by row-by-row DELETEs. Other database backends keep the
+regular table and rely on the batched retention task.
+"""
+import re
+from datetime import datetime, time, timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import RequestLog
+
+PARTITION_SUFFIX = re.compile(r'_p(\d{8})$')
+
+
+class PartitioningNotSupported(Exception):
+    pass
+
+
+def is_supported():
+    return connection.vendor == 'postgresql'
+
+
+def is_enabled():
+    return getattr(settings, 'IP_TRACKING_PARTITIONED_LOGS', False) and is_supported()
+
+
+def _table():
+    return RequestLog._meta.db_table
+
+
+def _partition_name(day):
+    return f"{_table()}_p{day:%Y%m%d}"
+
+
+def _check_supported():
+    if not is_supported():
+        raise PartitioningNotSupported(
+            f"RequestLog partitioning requires PostgreSQL, not {connection.vendor}"
+        )
+
+
+def is_partitioned():
+    """
+    Check if the RequestLog table has already been converted
+    """
+    _check_supported()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table pt "
+            "JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = %s AND pg_table_is_visible(c.oid)",
+            [_table()]
+        )
+        return cursor.fetchone() is not None
+
+
+def _day_bounds(day):
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+    start = datetime.combine(day, time.min, tzinfo=tz)
+    return start, start + timedelta(days=1)
+
+
+def _create_partition(cursor, parent, day):
+    quote = connection.ops.quote_name
+    start, end = _day_bounds(day)
+    # Bounds are inlined: DDL statements can't take bind parameters
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {quote(_partition_name(day))} "
+        f"PARTITION OF {quote(parent)} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    )
+
+
+def convert_to_partitioned(days_ahead=7):
+    """
+    Rebuild RequestLog as a daily range-partitioned table.
+
+    Rows are copied into the new table inside one transaction, so this takes
+    a lock for the duration of the copy; run it in a maintenance window.
+    The primary key becomes (id, timestamp), as PostgreSQL requires the
+    partition key in every unique constraint, and id is fed from a plain
+    sequence continuing after the highest existing id.
+    """
+    _check_supported()
+    if is_partitioned():
+        return False
+
+    quote = connection.ops.quote_name
+    table = _table()
+    staging = f"{table}_partitioned"
+    sequence = f"{table}_partitioned_id_seq"
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"SELECT MIN({quote('timestamp')}) FROM {quote(table)}")
+        oldest = cursor.fetchone()[0]
+
+        cursor.execute(f"CREATE SEQUENCE {quote(sequence)}")
+        cursor.execute(
+            f"CREATE TABLE {quote(staging)} (LIKE {quote(table)} INCLUDING DEFAULTS) "
+            f"PARTITION BY RANGE ({quote('timestamp')})"
+        )
+        cursor.execute(
+            f"ALTER TABLE {quote(staging)} ALTER COLUMN {quote('id')} "
+            f"SET DEFAULT nextval('{sequence}')"
+        )
+        cursor.execute(f"ALTER TABLE {quote(staging)} ADD PRIMARY KEY ({quote('id')}, {quote('timestamp')})")
+        cursor.execute(f"CREATE TABLE {quote(table + '_default')} PARTITION OF {quote(staging)} DEFAULT")
+
+        today = timezone.localdate()
+        day = timezone.localtime(oldest).date() if oldest else today
+        while day <= today + timedelta(days=days_ahead):
+            _create_partition(cursor, staging, day)
+            day += timedelta(days=1)
+
+        cursor.execute(f"INSERT INTO {quote(staging)} SELECT * FROM {quote(table)}")
+        cursor.execute(
+            f"SELECT setval('{sequence}', COALESCE((SELECT MAX({quote('id')}) FROM {quote(staging)}), 0) + 1, false)"
+        )
+        cursor.execute(f"DROP TABLE {quote(table)}")
+        cursor.execute(f"ALTER TABLE {quote(staging)} RENAME TO {quote(table)}")
+        cursor.execute(f"ALTER SEQUENCE {quote(sequence)} OWNED BY {quote(table)}.{quote('id')}")
+
+        # Indexes on the parent are created on every partition
+        with connection.schema_editor(atomic=False) as schema_editor:
+            for index in RequestLog._meta.indexes:
+                schema_editor.add_index(RequestLog, index)
+
+    return True
+
+
+def list_partitions():
+    """
+    Return (name, day) for every daily partition, oldest first
+    """
+    _check_supported()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            [_table()]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+
+    partitions = []
+    for name in names:
+        match = PARTITION_SUFFIX.search(name)
+        if match:
+            partitions.append((name, datetime.strptime(match.group(1), '%Y%m%d').date()))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partitions(days_ahead=7):
+    """
+    Make sure partitions exist from today through days_ahead days from now
+    """
+    _check_supported()
+    today = timezone.localdate()
+    with transaction.atomic(), connection.cursor() as cursor:
+        for offset in range(days_ahead + 1):
+            _create_partition(cursor, _table(), today + timedelta(days=offset))
+
+
+def drop_partitions_before(cutoff):
+    """
+    Drop daily partitions that only hold rows older than the cutoff date
+    """
+    _check_supported()
+    if isinstance(cutoff, datetime):
+        cutoff = timezone.localtime(cutoff).date()
+    quote = connection.ops.quote_name
+    dropped = []
+    with transaction.atomic(), connection.cursor() as cursor:
+        for name, day in list_partitions():
+            if day + timedelta(days=1) <= cutoff:
+                cursor.execute(f"DROP TABLE {quote(name)}")
+                dropped.append(name)
+    return dropped
@@ -0,0 +1,301 @@
+"""
+Shared GCRA rate limiting.
+
+The generic cell rate algorithm keeps a single value per key, the
+theoretical arrival time (TAT) of the next request. A rate of N requests
+per period emits one request every period / N seconds and tolerates a
+burst of N. A request is allowed when it arrives no earlier than
+TAT - period. Each backend performs the whole check-and-update as one
+atomic operation, so the limit holds across every worker that shares the
+backend:
+
+    MemoryBackend  per process, for tests and single-process servers
+    SQLiteBackend  one SQLite file shared by every worker on a host
+    RedisBackend   any Redis-compatible server, for multi-host deployments
+"""
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+try:
+    import redis
+except ImportError:  # Optional: only needed for RedisBackend
+    redis = None
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+RATE_PATTERN = re.compile(r'^(\d+)/(\d*)([smhd])$')
+
+
+def parse_rate(rate):
+    """
+    Parse '5/m' or '100/10s' into (limit, period in seconds)
+    """
+    match = RATE_PATTERN.match(rate.strip())
+    if match is None:
+        raise ValueError(f"Invalid rate: {rate}")
+    limit = int(match.group(1))
+    period = int(match.group(2) or 1) * PERIODS[match.group(3)]
+    if limit <= 0:
+        raise ValueError(f"Invalid rate: {rate}")
+    return limit, period
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    # Seconds until the next request would be allowed (0 when allowed)
+    retry_after: float
+    # Seconds until the bucket is completely refilled
+    reset_after: float
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, result, timeframe):
+        super().__init__('Rate limit exceeded')
+        self.result = result
+        self.limit = result.limit
+        self.timeframe = timeframe
+        self.retry_after = math.ceil(result.retry_after)
+
+
+class MemoryBackend:
+    """
+    GCRA state in a dict guarded by a lock; limits are per process
+    """
+
+    def __init__(self, **options):
+        self._tats = {}
+        self._lock = threading.Lock()
+
+    def check(self, key, interval, period, now=None):
+        """
+        Apply one request to key; returns (allowed, tat after the check)
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            tat = max(self._tats.get(key, now), now)
+            new_tat = tat + interval
+            if new_tat - period > now:
+                return False, tat
+            self._tats[key] = new_tat
+            # Drop expired keys now and then so the dict can't grow unbounded
+            if len(self._tats) > 10000:
+                self._tats = {k: v for k, v in self._tats.items() if v > now}
+            return True, new_tat
+
+    async def acheck(self, key, interval, period, now=None):
+        # A dict update under a briefly held lock; cheap enough for the loop
+        return self.check(key, interval, period, now=now)
+
+
+class SQLiteBackend:
+    """
+    GCRA state in a SQLite file shared by the workers on one host. Each
+    check is a single UPSERT ... RETURNING statement, which SQLite runs
+    under its write lock.
+    """
+
+    UPSERT = (
+        "INSERT INTO gcra (key, tat, allowed) VALUES (:key, :now + :interval, 1) "
+        "ON CONFLICT (key) DO UPDATE SET "
+        "allowed = max(tat, :now) + :interval - :period <= :now, "
+        "tat = CASE WHEN max(tat, :now) + :interval - :period <= :now "
+        "THEN max(tat, :now) + :interval ELSE max(tat, :now) END "
+        "RETURNING allowed, tat"
+    )
+
+    def __init__(self, path=None, timeout=5.0, **options):
+        if sqlite3.sqlite_version_info < (3, 35, 0):
+            raise ImproperlyConfigured('SQLiteBackend requires SQLite 3.35 or later')
+        self.path = str(path or os.path.join(settings.BASE_DIR, 'ratelimit.sqlite3'))
+        self.timeout = timeout
+        self._local = threading.local()
+        self._checks = 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS gcra '
+                '(key TEXT PRIMARY KEY, tat REAL NOT NULL, allowed INTEGER NOT NULL) WITHOUT ROWID'
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def check(self, key, interval, period, now=None):
+        now = time.time() if now is None else now
+        connection = self._connection()
+        allowed, tat = connection.execute(
+            self.UPSERT,
+            {'key': key, 'now': now, 'interval': interval, 'period': period}
+        ).fetchone()
+
+        self._checks += 1
+        if self._checks % 1000 == 0:
+            connection.execute('DELETE FROM gcra WHERE tat < ?', [now])
+        return bool(allowed), tat
+
+    async def acheck(self, key, interval, period, now=None):
+        # The UPSERT can wait on SQLite's write lock, so run it off the loop
+        return await sync_to_async(self.check, thread_sensitive=False)(key, interval, period, now=now)
+
+
+class RedisBackend:
+    """
+    GCRA state in Redis, updated by a Lua script so each check is atomic.
+    The server clock is used so hosts with skewed clocks agree. Pass
+    client= to use an existing (or fake) Redis-compatible client.
+    """
+
+    SCRIPT = """
+        local now_parts = redis.call('TIME')
+        local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+        local interval = tonumber(ARGV[1])
+        local period = tonumber(ARGV[2])
+        local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+        if tat < now then tat = now end
+        local new_tat = tat + interval
+        if new_tat - period > now then
+            return {0, tostring(tat), tostring(now)}
+        end
+        redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+        return {1, tostring(new_tat), tostring(now)}
+    """
+
+    def __init__(self, url=None, client=None, prefix='ip_tracking:rl:', **options):
+        if client is None:
+            if redis is None:
+                raise ImproperlyConfigured('RedisBackend requires the redis package')
+            client = redis.Redis.from_url(url or 'redis://localhost:6379/0')
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(self.SCRIPT)
+
+    def check(self, key, interval, period, now=None):
+        allowed, tat, server_now = self._script(keys=[self.prefix + key], args=[interval, period])
+        # Report the TAT relative to this host's clock
+        return bool(int(allowed)), float(tat) - float(server_now) + time.time()
+
+    async def acheck(self, key, interval, period, now=None):
+        # The client is synchronous, so the round trip runs off the loop
+        return await sync_to_async(self.check, thread_sensitive=False)(key, interval, period, now=now)
+
+
+class RateLimiter:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def check(self, key, rate, now=None):
+        """
+        Count one request for key against rate ('5/m') and return a
+        RateLimitResult
+        """
+        limit, period = parse_rate(rate)
+        interval = period / limit
+        now = time.time() if now is None else now
+        allowed, tat = self.backend.check(f"{rate}:{key}", interval, period, now=now)
+        return self._result(allowed, tat, limit, period, interval, now)
+
+    async def acheck(self, key, rate, now=None):
+        """
+        Async variant of check; backends that do I/O run it off the event loop
+        """
+        limit, period = parse_rate(rate)
+        interval = period / limit
+        now = time.time() if now is None else now
+        allowed, tat = await self.backend.acheck(f"{rate}:{key}", interval, period, now=now)
+        return self._result(allowed, tat, limit, period, interval, now)
+
+    def _result(self, allowed, tat, limit, period, interval, now):
+        reset_after = max(tat - now, 0.0)
+        if allowed:
+            retry_after = 0.0
+        else:
+            retry_after = max(tat + interval - period - now, 0.0)
+        remaining = max(int((period - reset_after) // interval), 0)
+        return RateLimitResult(allowed, limit, remaining, retry_after, reset_after)
+
+
+def get_backend():
+    """
+    Instantiate the backend named by IP_TRACKING_RATELIMIT_BACKEND
+    """
+    backend_class = getattr(settings, 'IP_TRACKING_RATELIMIT_BACKEND', 'ip_tracking.ratelimit.SQLiteBackend')
+    options = getattr(settings, 'IP_TRACKING_RATELIMIT_OPTIONS', {})
+    return import_string(backend_class)(**options)
+
+
+class _LazyRateLimiter:
+    # The backend is opened on first use, not at import time
+    def __init__(self):
+        self._limiter = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._limiter is None:
+            with self._lock:
+                if self._limiter is None:
+                    self._limiter = RateLimiter(get_backend())
+        return getattr(self._limiter, name)
+
+
+# Create a global instance
+rate_limiter = _LazyRateLimiter()
+
+
+def _request_key(request, key):
+    if callable(key):
+        return str(key(request))
+    if key == 'ip':
+        return f"ip:{request.META.get('REMOTE_ADDR')}"
+    if key == 'user':
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return f"user:{user.pk}"
+        return f"ip:{request.META.get('REMOTE_ADDR')}"
+    raise ValueError(f"Unknown rate limit key: {key}")
+
+
+def rate_limit(key='ip', rate='5/m', methods=None):
+    """
+    Decorator limiting a view to rate requests per key ('ip', 'user' or a
+    callable taking the request). Limited requests get the
+    IP_TRACKING_RATELIMIT_VIEW response (429 by default).
+    """
+    timeframe = parse_rate(rate)[1]
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if not getattr(settings, 'IP_TRACKING_RATELIMIT_ENABLE', True):
+                return view(request, *args, **kwargs)
+            if methods is not None and request.method not in methods:
+                return view(request, *args, **kwargs)
+
+            result = rate_limiter.check(_request_key(request, key), rate)
+            request.rate_limit = result
+            if not result.allowed:
+                limited_view = import_string(getattr(
+                    settings, 'IP_TRACKING_RATELIMIT_VIEW', 'ip_tracking.views.rate_limit_exceeded'
+                ))
+                response = limited_view(request, RateLimitExceeded(result, timeframe))
+                response['Retry-After'] = str(math.ceil(result.retry_after))
+                return response
+            return view(request, *args, **kwargs)
+        return wrapped
+    return decorator
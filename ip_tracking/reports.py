@@ -0,0 +1,112 @@
+"""
+Traffic reports read from the hourly rollups.
+
+Whole hours that have been rolled up are answered from RequestLogHourly;
+only the part of the window after the last rolled-up hour (normally the
+current hour) is aggregated from raw RequestLog rows. Reports therefore have
+hour granularity at the start of the window.
+"""
+from collections import Counter
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Coalesce, TruncHour
+from django.utils import timezone
+from .models import RequestLog, RequestLogHourly
+from .rollups import rolled_up_until, truncate_to_hour
+
+# Rollup and raw-row expressions for each supported grouping
+DIMENSIONS = {
+    'ip_address': ('ip_address', F('ip_address')),
+    'path': ('path', F('path')),
+    'country': ('country', Coalesce('country', Value(''))),
+}
+
+
+def _split_window(since, until):
+    """
+    Split [since, until) into the part served by rollups and the raw tail
+    """
+    since = truncate_to_hour(since)
+    rolled_until = rolled_up_until()
+    if rolled_until is None:
+        return None, since
+    rollup_end = min(rolled_until, truncate_to_hour(until))
+    if rollup_end <= since:
+        return None, since
+    return (since, rollup_end), rollup_end
+
+
+def traffic_counts(dimension, since, until=None):
+    """
+    Return a Counter of request counts per value of dimension
+    ('ip_address', 'path' or 'country') for the window
+    """
+    until = until or timezone.now()
+    rollup_field, raw_expression = DIMENSIONS[dimension]
+    rollup_window, raw_since = _split_window(since, until)
+
+    counts = Counter()
+    if rollup_window is not None:
+        rows = (
+            RequestLogHourly.objects
+            .filter(hour__gte=rollup_window[0], hour__lt=rollup_window[1])
+            .values(rollup_field)
+            .annotate(total=Sum('request_count'))
+            .order_by()
+        )
+        for row in rows:
+            counts[row[rollup_field]] += row['total']
+
+    if raw_since < until:
+        rows = (
+            RequestLog.objects
+            .filter(timestamp__gte=raw_since, timestamp__lt=until)
+            .annotate(key=raw_expression)
+            .values('key')
+            .annotate(total=Count('id'))
+            .order_by()
+        )
+        for row in rows:
+            counts[row['key']] += row['total']
+
+    return counts
+
+
+def top(dimension, since, until=None, limit=10):
+    """
+    Return the limit busiest values of dimension as (value, count) pairs
+    """
+    return traffic_counts(dimension, since, until).most_common(limit)
+
+
+def hourly_request_rate(since, until=None):
+    """
+    Return (hour, request count) pairs for every hour with traffic
+    """
+    until = until or timezone.now()
+    rollup_window, raw_since = _split_window(since, until)
+
+    counts = Counter()
+    if rollup_window is not None:
+        rows = (
+            RequestLogHourly.objects
+            .filter(hour__gte=rollup_window[0], hour__lt=rollup_window[1])
+            .values('hour')
+            .annotate(total=Sum('request_count'))
+            .order_by()
+        )
+        for row in rows:
+            counts[row['hour']] += row['total']
+
+    if raw_since < until:
+        rows = (
+            RequestLog.objects
+            .filter(timestamp__gte=raw_since, timestamp__lt=until)
+            .annotate(hour=TruncHour('timestamp'))
+            .values('hour')
+            .annotate(total=Count('id'))
+            .order_by()
+        )
+        for row in rows:
+            counts[row['hour']] += row['total']
+
+    return sorted(counts.items())
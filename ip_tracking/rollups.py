@@ -0,0 +1,230 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Value
+from django.db.models.functions import Coalesce, TruncHour
+from django.utils import timezone
+from . import partitioning
+from .models import RequestLog, RequestLogHourly, RequestLogRollupState
+
+
+def truncate_to_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def rolled_up_until():
+    """
+    Return the end of the last hour that has been rolled up, or None
+    """
+    last_hour = RequestLogHourly.objects.aggregate(last_hour=Max('hour'))['last_hour']
+    if last_hour is None:
+        return None
+    return last_hour + timedelta(hours=1)
+
+
+def _buckets(queryset):
+    return (
+        queryset
+        .annotate(hour=TruncHour('timestamp'), country_code=Coalesce('country', Value('')))
+        .values('hour', 'ip_address', 'path', 'country_code')
+        .annotate(request_count=Count('id'))
+        .order_by()
+    )
+
+
+def retention_horizon(retention_days=None):
+    """
+    Return the start of the oldest hour whose raw rows are all still kept
+    """
+    if retention_days is None:
+        retention_days = getattr(settings, 'IP_TRACKING_RAW_LOG_RETENTION_DAYS', 30)
+    return truncate_to_hour(timezone.now() - timedelta(days=retention_days))
+
+
+def roll_up_hours(start, end, batch_size=1000):
+    """
+    Replace the rollup rows for every hour in [start, end) with fresh counts.
+    Recomputing whole hours makes the rollup idempotent and picks up rows
+    whose country was filled in after the previous run.
+
+    Writers that backfill RequestLog rows (replay_logs, load_log_segments)
+    call this for the hours they wrote. Only hours inside the retention
+    horizon should be recomputed; older ones have lost raw rows to purging.
+    """
+    buckets = _buckets(RequestLog.objects.filter(timestamp__gte=start, timestamp__lt=end))
+
+    created = 0
+    with transaction.atomic():
+        RequestLogHourly.objects.filter(hour__gte=start, hour__lt=end).delete()
+        batch = []
+        for bucket in buckets.iterator(chunk_size=batch_size):
+            batch.append(RequestLogHourly(
+                hour=bucket['hour'],
+                ip_address=bucket['ip_address'],
+                path=bucket['path'],
+                country=bucket['country_code'],
+                request_count=bucket['request_count']
+            ))
+            if len(batch) >= batch_size:
+                RequestLogHourly.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        if batch:
+            RequestLogHourly.objects.bulk_create(batch)
+            created += len(batch)
+    return created
+
+
+def add_to_rollup(queryset):
+    """
+    Add the rows in queryset to the existing rollup counts without
+    recomputing their hours. Used for late rows in hours whose raw rows have
+    already been purged.
+    """
+    added = 0
+    with transaction.atomic():
+        for bucket in _buckets(queryset):
+            updated = RequestLogHourly.objects.filter(
+                hour=bucket['hour'],
+                ip_address=bucket['ip_address'],
+                path=bucket['path'],
+                country=bucket['country_code']
+            ).update(request_count=F('request_count') + bucket['request_count'])
+            if not updated:
+                RequestLogHourly.objects.create(
+                    hour=bucket['hour'],
+                    ip_address=bucket['ip_address'],
+                    path=bucket['path'],
+                    country=bucket['country_code'],
+                    request_count=bucket['request_count']
+                )
+            added += bucket['request_count']
+    return added
+
+
+def roll_up_late_rows(last_log_id, high_log_id, before):
+    """
+    Fold RequestLog rows with ids in (last_log_id, high_log_id] and a
+    timestamp before `before` into hours that were already rolled up.
+    Returns the number of hours recomputed.
+    """
+    late_rows = RequestLog.objects.filter(
+        id__gt=last_log_id, id__lte=high_log_id, timestamp__lt=before
+    )
+    horizon = retention_horizon()
+
+    # Hours whose raw rows are all still kept are simply recomputed
+    late_hours = list(
+        late_rows.filter(timestamp__gte=horizon)
+        .annotate(hour=TruncHour('timestamp'))
+        .values_list('hour', flat=True)
+        .distinct()
+        .order_by()
+    )
+    for hour in late_hours:
+        roll_up_hours(hour, hour + timedelta(hours=1))
+
+    # Older hours may have lost raw rows to purging, so the late rows are
+    # added to their counts instead
+    older_rows = late_rows.filter(timestamp__lt=horizon)
+    if older_rows.exists():
+        add_to_rollup(older_rows)
+    return len(late_hours)
+
+
+def roll_up_request_logs(lag_hours=None, max_hours=None):
+    """
+    Roll up every completed hour since the last run.
+
+    The last lag_hours already rolled up are recomputed as well, so late
+    geolocation enrichment is reflected. Rows inserted since the last run
+    into hours older than that (backfills, replays, delayed segment loads)
+    are found by id and their hours re-rolled. At most max_hours new hours
+    are processed per call to keep each run bounded.
+    """
+    if lag_hours is None:
+        lag_hours = getattr(settings, 'IP_TRACKING_ROLLUP_LAG_HOURS', 2)
+    if max_hours is None:
+        max_hours = getattr(settings, 'IP_TRACKING_ROLLUP_MAX_HOURS', 24)
+
+    # Taken first, so rows inserted during this run are left for the next one
+    high_log_id = RequestLog.objects.aggregate(high=Max('id'))['high'] or 0
+    state = RequestLogRollupState.objects.filter(pk=1).first()
+    current_hour = truncate_to_hour(timezone.now())
+    watermark = rolled_up_until()
+    hours = 0
+    rows = 0
+    late_hours = 0
+
+    if state is not None and watermark is not None:
+        late_hours = roll_up_late_rows(
+            state.last_log_id, high_log_id, watermark - timedelta(hours=lag_hours)
+        )
+
+    # Recompute the most recent rolled-up hours to catch late enrichment
+    raw_rows = RequestLog.objects.all()
+    if watermark is not None:
+        rows += roll_up_hours(watermark - timedelta(hours=lag_hours), watermark)
+        hours += lag_hours
+        raw_rows = raw_rows.filter(timestamp__gte=watermark)
+
+    # Then move forward from the first hour with traffic after the watermark,
+    # so a quiet period can't stall the rollup
+    oldest = raw_rows.aggregate(oldest=Min('timestamp'))['oldest']
+    if oldest is not None:
+        start = truncate_to_hour(oldest)
+        end = min(current_hour, start + timedelta(hours=max_hours))
+        if end > start:
+            rows += roll_up_hours(start, end)
+            hours += int((end - start) / timedelta(hours=1))
+
+    RequestLogRollupState.objects.update_or_create(pk=1, defaults={'last_log_id': high_log_id})
+    return {'hours': hours, 'rows': rows, 'late_hours': late_hours}
+
+
+def purge_request_logs(retention_days=None, batch_size=None, max_batches=None):
+    """
+    Delete raw RequestLog rows older than the retention horizon in bounded
+    batches. Rows that have not been rolled up yet, or that the rollup may
+    still recompute, are never deleted; neither are rows inserted since the
+    last rollup run, whatever their timestamp.
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, 'IP_TRACKING_PURGE_BATCH_SIZE', 10000)
+    if max_batches is None:
+        max_batches = getattr(settings, 'IP_TRACKING_PURGE_MAX_BATCHES', 100)
+
+    rolled_until = rolled_up_until()
+    state = RequestLogRollupState.objects.filter(pk=1).first()
+    if rolled_until is None or state is None:
+        return {'deleted': 0, 'partitions_dropped': 0}
+    lag_hours = getattr(settings, 'IP_TRACKING_ROLLUP_LAG_HOURS', 2)
+    # Hour-aligned so no rolled-up hour is ever left partially deleted
+    cutoff = min(
+        retention_horizon(retention_days),
+        rolled_until - timedelta(hours=lag_hours)
+    )
+    expired = RequestLog.objects.filter(timestamp__lt=cutoff, id__lte=state.last_log_id)
+
+    # Whole days go a partition at a time when the table is partitioned,
+    # unless they hold late rows the rollup hasn't counted yet
+    partitions_dropped = 0
+    if partitioning.is_enabled() and partitioning.is_partitioned():
+        unseen = RequestLog.objects.filter(timestamp__lt=cutoff, id__gt=state.last_log_id)
+        if not unseen.exists():
+            partitions_dropped = len(partitioning.drop_partitions_before(cutoff))
+
+    deleted = 0
+    for _ in range(max_batches):
+        ids = list(
+            expired
+            .order_by()
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        deleted += RequestLog.objects.filter(id__in=ids).delete()[0]
+        if len(ids) < batch_size:
+            break
+
+    return {'deleted': deleted, 'partitions_dropped': partitions_dropped}
@@ -0,0 +1,310 @@
+"""
+Append-only binary request log segments.
+
+Each writer process appends to its own segment files in the segment
+directory. A segment is a pair of files:
+
+    <name>.log    fixed 28-byte records: packed IP (16 bytes, IPv4 mapped
+                  into IPv6), unix timestamp (float64), path id (u32)
+    <name>.paths  the segment's path dictionary: path id (u32), length
+                  (u16) and UTF-8 bytes, written before any record using it
+
+Segments rotate by size and age, so a segment is never rewritten once it
+is closed. Readers memory-map segments and resume from per-consumer
+checkpointed byte offsets.
+"""
+import json
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from .addresses import pack_ip, pack_value, unpack_address
+
+RECORD = struct.Struct('>16sdI')
+PATH_ENTRY = struct.Struct('>IH')
+MAX_PATH_BYTES = 0xFFFF
+
+
+class SegmentWriter:
+    """
+    Thread-safe appender for one process's segment files.
+
+    append() only hands each record to the OS; it never waits on the disk.
+    The owner calls sync() from a background thread to fsync according to
+    the policy: after every append ('always'), every fsync_interval seconds
+    ('interval') or only when the segment is closed ('never').
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, max_age=300, fsync='interval', fsync_interval=1.0):
+        if fsync not in ('always', 'interval', 'never'):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.records_written = 0
+        self.segments_opened = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._log = None
+        self._paths = None
+        self._path_ids = {}
+        self._size = 0
+        self._synced_size = 0
+        self._opened_at = 0
+        self._sequence = 0
+        # Rotated-out files still waiting for their final fsync
+        self._retired = []
+
+    def append(self, ip_address, path, timestamp=None, value=None):
+        """
+        Append one record; the path is interned in the current segment.
+        value is the address's packed value from parse_ip, if already known.
+        """
+        packed = pack_value(value) if value is not None else pack_ip(ip_address)
+        if packed is None:
+            raise ValueError(f"Invalid IP address: {ip_address}")
+        if timestamp is None:
+            timestamp = time.time()
+        encoded_path = path.encode('utf-8')[:MAX_PATH_BYTES]
+
+        with self._lock:
+            now = time.monotonic()
+            if self._pid != os.getpid() or self._log is None:
+                self._open_segment(now)
+            elif self._size >= self.max_bytes or now - self._opened_at >= self.max_age:
+                self._close_segment()
+                self._open_segment(now)
+
+            path_id = self._path_ids.get(encoded_path)
+            if path_id is None:
+                path_id = len(self._path_ids)
+                self._path_ids[encoded_path] = path_id
+                self._paths.write(PATH_ENTRY.pack(path_id, len(encoded_path)) + encoded_path)
+
+            self._log.write(RECORD.pack(packed, timestamp, path_id))
+            self._size += RECORD.size
+            self.records_written += 1
+
+    def sync(self):
+        """
+        fsync everything appended so far, outside the append lock. Returns
+        False when there was nothing to sync.
+        """
+        with self._lock:
+            retired, self._retired = self._retired, []
+            files = []
+            if self._log is not None and self._pid == os.getpid() and self._size != self._synced_size:
+                # Duplicated descriptors stay valid if the segment rotates meanwhile
+                files = [os.dup(self._paths.fileno()), os.dup(self._log.fileno())]
+                self._synced_size = self._size
+        if not files and not retired:
+            return False
+        try:
+            for fd in files:
+                os.fsync(fd)
+            for f in retired:
+                if self.fsync != 'never':
+                    os.fsync(f.fileno())
+        finally:
+            for fd in files:
+                os.close(fd)
+            for f in retired:
+                f.close()
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._log is not None and self._pid == os.getpid():
+                self._close_segment()
+        self.sync()
+
+    def _open_segment(self, now):
+        os.makedirs(self.directory, exist_ok=True)
+        self._pid = os.getpid()
+        self._sequence += 1
+        name = f"segment-{int(time.time() * 1000):015d}-{self._pid}-{self._sequence:06d}"
+        base = os.path.join(self.directory, name)
+        # Unbuffered: every record reaches the OS in one append, so readers
+        # never see a torn record from this process
+        self._paths = open(f"{base}.paths", 'ab', buffering=0)
+        self._log = open(f"{base}.log", 'ab', buffering=0)
+        self._path_ids = {}
+        self._size = 0
+        self._synced_size = 0
+        self._opened_at = now
+        self.segments_opened += 1
+
+    def _close_segment(self):
+        # The final fsync and close happen in the next sync()
+        self._retired.extend([self._paths, self._log])
+        self._log = None
+        self._paths = None
+
+
+class Checkpoint:
+    """
+    Per-consumer byte offsets into each segment, saved atomically as JSON
+    """
+
+    def __init__(self, directory, name):
+        self.path = os.path.join(str(directory), f"checkpoint-{name}.json")
+        try:
+            with open(self.path) as f:
+                self.offsets = json.load(f)
+        except (OSError, ValueError):
+            self.offsets = {}
+
+    def get(self, segment):
+        return self.offsets.get(segment, 0)
+
+    def set(self, segment, offset):
+        self.offsets[segment] = offset
+
+    def forget(self, segment):
+        self.offsets.pop(segment, None)
+
+    def save(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(self.offsets, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+
+class StateFile:
+    """
+    A consumer's in-memory state between runs, pickled atomically next to
+    its checkpoint
+    """
+
+    def __init__(self, directory, name):
+        self.path = os.path.join(str(directory), f"state-{name}.pickle")
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def save(self, state):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+
+def list_segments(directory):
+    """
+    Return segment names in the directory, oldest first
+    """
+    try:
+        names = os.listdir(str(directory))
+    except FileNotFoundError:
+        return []
+    return sorted(name[:-len('.log')] for name in names if name.endswith('.log'))
+
+
+def _read_paths(base):
+    paths = {}
+    try:
+        with open(f"{base}.paths", 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return paths
+    position = 0
+    while position + PATH_ENTRY.size <= len(data):
+        path_id, length = PATH_ENTRY.unpack_from(data, position)
+        start = position + PATH_ENTRY.size
+        if start + length > len(data):
+            break
+        paths[path_id] = data[start:start + length].decode('utf-8', 'replace')
+        position = start + length
+    return paths
+
+
+def read_segment(directory, segment, offset=0):
+    """
+    Yield (end offset, ip address, timestamp, path) for each complete record
+    after offset. Stops early at a record whose path entry isn't visible yet.
+    """
+    base = os.path.join(str(directory), segment)
+    with open(f"{base}.log", 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        size -= size % RECORD.size
+        if size <= offset:
+            return
+        mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    try:
+        paths = _read_paths(base)
+        for position in range(offset, size, RECORD.size):
+            packed, timestamp, path_id = RECORD.unpack_from(mm, position)
+            path = paths.get(path_id)
+            if path is None:
+                return
+            yield position + RECORD.size, unpack_address(packed), timestamp, path
+    finally:
+        mm.close()
+
+
+def consume(directory, checkpoint):
+    """
+    Yield (segment, end offset, ip address, timestamp, path) for every record
+    the checkpoint hasn't seen. The caller saves the checkpoint once the
+    records up to an offset have been processed.
+    """
+    for segment in list_segments(directory):
+        for end, ip_address, timestamp, path in read_segment(directory, segment, checkpoint.get(segment)):
+            yield segment, end, ip_address, timestamp, path
+
+
+def delete_segment(directory, segment):
+    base = os.path.join(str(directory), segment)
+    for suffix in ('.log', '.paths'):
+        try:
+            os.remove(base + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def prune_consumed(directory, min_idle):
+    """
+    Delete segments that every consumer has fully read and that have not
+    been written to for min_idle seconds. Returns the deleted segment names.
+    """
+    directory = str(directory)
+    checkpoints = [
+        Checkpoint(directory, name[len('checkpoint-'):-len('.json')])
+        for name in os.listdir(directory)
+        if name.startswith('checkpoint-') and name.endswith('.json')
+    ]
+    if not checkpoints:
+        return []
+
+    deleted = []
+    now = time.time()
+    for segment in list_segments(directory):
+        log_path = os.path.join(directory, f"{segment}.log")
+        try:
+            stat = os.stat(log_path)
+        except FileNotFoundError:
+            continue
+        complete = stat.st_size - stat.st_size % RECORD.size
+        if now - stat.st_mtime < min_idle:
+            continue
+        if all(checkpoint.get(segment) >= complete for checkpoint in checkpoints):
+            delete_segment(directory, segment)
+            deleted.append(segment)
+
+    for checkpoint in checkpoints:
+        for segment in deleted:
+            checkpoint.forget(segment)
+        checkpoint.save()
+    return deleted
@@ -0,0 +1,35 @@
+import threading
+from contextlib import contextmanager
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .blocklist import bump_blocklist_version
+from .models import BlockedIP, BlockedNetwork
+
+_bulk = threading.local()
+
+
+@contextmanager
+def bulk_blocklist_changes():
+    """
+    Skip the per-row version bumps inside the block and publish a single
+    new version when it exits
+    """
+    _bulk.active = True
+    try:
+        yield
+    finally:
+        _bulk.active = False
+        bump_blocklist_version()
+
+
+@receiver(post_save, sender=BlockedIP)
+@receiver(post_delete, sender=BlockedIP)
+@receiver(post_save, sender=BlockedNetwork)
+@receiver(post_delete, sender=BlockedNetwork)
+def blocklist_changed(sender, **kwargs):
+    """
+    Invalidate every worker's blocklist snapshot when a block entry changes
+    """
+    if getattr(_bulk, 'active', False):
+        return
+    bump_blocklist_version()
@@ -0,0 +1,157 @@
+import atexit
+import os
+import threading
+import time
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .addresses import pack_ip, pack_value
+from .log_writer import request_log_writer
+from .segments import SegmentWriter
+
+
+class DatabaseSink:
+    """
+    Send request logs to the buffered RequestLog writer
+    """
+
+    def __init__(self, writer=None):
+        self.writer = writer or request_log_writer
+
+    def write(self, ip_address, path, block=True, ip_value=None):
+        # Truncate to the column size so one long path can't fail a whole batch
+        return self.writer.write(
+            block=block,
+            ip_address=ip_address,
+            ip_packed=pack_value(ip_value) if ip_value is not None else pack_ip(ip_address),
+            path=path[:255],
+            timestamp=timezone.now()
+        )
+
+    def add_flush_hook(self, hook):
+        """
+        Run hook after each batch of request logs is written
+        """
+        self.writer.add_flush_hook(hook)
+
+    def stats(self):
+        return self.writer.stats()
+
+
+class SegmentFileSink:
+    """
+    Append request logs to rotating binary segment files, keeping the
+    database off the logging path entirely. Use the load_log_segments
+    command or the detect_from_log_segments task to consume them.
+
+    A background thread fsyncs the segments according to the fsync policy
+    and runs the flush hooks, so write() never waits on the disk.
+    """
+
+    def __init__(self, directory=None):
+        self.writer = SegmentWriter(
+            directory=directory or get_segment_directory(),
+            max_bytes=getattr(settings, 'IP_TRACKING_SEGMENT_MAX_BYTES', 64 * 1024 * 1024),
+            max_age=getattr(settings, 'IP_TRACKING_SEGMENT_MAX_AGE', 300),
+            fsync=getattr(settings, 'IP_TRACKING_SEGMENT_FSYNC', 'interval'),
+            fsync_interval=getattr(settings, 'IP_TRACKING_SEGMENT_FSYNC_INTERVAL', 1.0)
+        )
+        self.hook_interval = getattr(settings, 'IP_TRACKING_SEGMENT_HOOK_INTERVAL', 5.0)
+        self._flush_hooks = []
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        # Set after each append under the 'always' policy to sync at once
+        self._wake = threading.Event()
+        self._pid = None
+        atexit.register(self.close)
+
+    def write(self, ip_address, path, block=True, ip_value=None):
+        # Appends are a single write to the OS; fsyncs happen on the sink's thread
+        self.writer.append(ip_address, path, value=ip_value)
+        self._ensure_started()
+        if self.writer.fsync == 'always':
+            self._wake.set()
+        return True
+
+    def add_flush_hook(self, hook):
+        """
+        Run hook every hook_interval seconds from a background thread. There
+        are no database batches to follow here, so hooks run on a timer.
+        """
+        self._flush_hooks.append(hook)
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        self._run_flush_hooks()
+        self.writer.close()
+
+    def _ensure_started(self):
+        """
+        Start the sync and hook thread lazily, and again after a fork
+        """
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(
+                target=self._run, name='ip-tracking-segment-sink', daemon=True
+            ).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        writer = self.writer
+        sync_interval = writer.fsync_interval if writer.fsync == 'interval' else self.hook_interval
+        next_hooks = time.monotonic() + self.hook_interval
+        try:
+            while not self._stop.is_set():
+                self._wake.wait(min(sync_interval, max(next_hooks - time.monotonic(), 0)))
+                self._wake.clear()
+                try:
+                    # Under 'never' this only finishes rotated-out segments
+                    writer.sync()
+                except OSError as e:
+                    if settings.DEBUG:
+                        print(f"Error syncing log segments: {e}")
+                if time.monotonic() >= next_hooks:
+                    self._run_flush_hooks()
+                    next_hooks = time.monotonic() + self.hook_interval
+        finally:
+            close_old_connections()
+
+    def _run_flush_hooks(self):
+        for hook in self._flush_hooks:
+            try:
+                close_old_connections()
+                hook()
+            except Exception as e:
+                if settings.DEBUG:
+                    print(f"Error in segment sink flush hook: {e}")
+
+    def stats(self):
+        return {
+            'written': self.writer.records_written,
+            'segments': self.writer.segments_opened,
+        }
+
+
+def get_segment_directory():
+    return str(getattr(
+        settings,
+        'IP_TRACKING_SEGMENT_DIR',
+        os.path.join(settings.BASE_DIR, 'request_log_segments')
+    ))
+
+
+def get_log_sink():
+    """
+    Instantiate the sink class named by IP_TRACKING_LOG_SINK
+    """
+    sink_class = getattr(settings, 'IP_TRACKING_LOG_SINK', 'ip_tracking.sinks.DatabaseSink')
+    return import_string(sink_class)()
+
+
+# Create a global instance
+log_sink = get_log_sink()
@@ -0,0 +1,465 @@
+"""
+Mergeable streaming sketches of request traffic.
+
+IPLoggingMiddleware feeds every request into a TrafficSketch for the
+current interval:
+
+    CountMinSketch  approximate requests per IP, capping the top-K counts
+    SpaceSaving     the top-K IPs and paths, with per-entry error bounds
+    HyperLogLog     distinct IPs overall and for each top path
+
+Memory is fixed by the sketch sizes rather than by the number of distinct
+IPs, so a flood from spoofed sources cannot grow it. Each process publishes
+its sketch for every interval to the cache under its own key, and readers
+merge whichever intervals and processes they need. Count-Min and
+HyperLogLog merge exactly; merged Space-Saving summaries keep their error
+bounds.
+"""
+import atexit
+import hashlib
+import math
+import os
+import socket
+import threading
+import time
+import zlib
+from array import array
+from django.conf import settings
+from django.core.cache import cache
+from .addresses import parse_ip
+
+MASK64 = (1 << 64) - 1
+CACHE_PREFIX = 'ip_tracking:sketch'
+WORKERS_KEY = f'{CACHE_PREFIX}:workers'
+# Per-path distinct IP counts only need to be rough; 256 one-byte registers
+PATH_PRECISION = 8
+
+
+def hash_value(value):
+    """
+    64-bit hash of a packed 128-bit address (splitmix64 finalizer)
+    """
+    z = ((value >> 64) ^ value) & MASK64
+    z = (z + 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+
+def hash_text(text):
+    """
+    64-bit hash of a string, stable across processes
+    """
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class CountMinSketch:
+    """
+    depth rows of width counters; an estimate never undercounts and
+    overcounts by at most e / width of the total with probability
+    1 - exp(-depth)
+    """
+
+    def __init__(self, width=2048, depth=4, counts=None):
+        self.width = width
+        self.depth = depth
+        self.counts = counts if counts is not None else array('Q', bytes(8 * width * depth))
+
+    def _cells(self, h):
+        # Double hashing derives every row's index from one 64-bit hash
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, h, count=1):
+        counts = self.counts
+        for cell in self._cells(h):
+            counts[cell] += count
+
+    def estimate(self, h):
+        counts = self.counts
+        return min(counts[cell] for cell in self._cells(h))
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('Count-Min sketches with different dimensions cannot be merged')
+        counts = self.counts
+        for cell, count in enumerate(other.counts):
+            if count:
+                counts[cell] += count
+
+    def to_bytes(self):
+        return zlib.compress(self.counts.tobytes(), 1)
+
+    @classmethod
+    def from_bytes(cls, data, width, depth):
+        counts = array('Q')
+        counts.frombytes(zlib.decompress(data))
+        return cls(width, depth, counts)
+
+
+class SpaceSaving:
+    """
+    Top-K counter: every key seen more than total / capacity times is kept.
+    A key's count overestimates its frequency by at most its error.
+    """
+
+    def __init__(self, capacity=200, counters=None):
+        self.capacity = capacity
+        # key -> [count, error]
+        self.counters = counters if counters is not None else {}
+        self._min_count = 0
+        self._min_keys = []
+
+    def _pop_min(self):
+        # Counts only grow, so a key left at the cached minimum is still minimal
+        while self._min_keys:
+            key = self._min_keys.pop()
+            counter = self.counters.get(key)
+            if counter is not None and counter[0] == self._min_count:
+                return key
+        self._min_count = min(counter[0] for counter in self.counters.values())
+        self._min_keys = [key for key, counter in self.counters.items() if counter[0] == self._min_count]
+        return self._min_keys.pop()
+
+    def add(self, key, count=1):
+        """
+        Count key; returns the key evicted to make room for it, if any
+        """
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += count
+            return None
+        if len(self.counters) < self.capacity:
+            self.counters[key] = [count, 0]
+            return None
+        evicted = self._pop_min()
+        floor = self.counters.pop(evicted)[0]
+        self.counters[key] = [floor + count, floor]
+        return evicted
+
+    def floor(self):
+        """
+        Upper bound on the count of any key not in the summary
+        """
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(counter[0] for counter in self.counters.values())
+
+    def merge(self, other):
+        mine = self.floor()
+        theirs = other.floor()
+        merged = {}
+        for key in self.counters.keys() | other.counters.keys():
+            count, error = self.counters.get(key, (mine, mine))
+            other_count, other_error = other.counters.get(key, (theirs, theirs))
+            merged[key] = [count + other_count, error + other_error]
+        kept = sorted(merged.items(), key=lambda item: item[1][0], reverse=True)[:self.capacity]
+        self.counters = dict(kept)
+        self._min_keys = []
+
+    def top(self, n=None):
+        """
+        Return (key, count, error) for the n largest counts
+        """
+        ranked = sorted(self.counters.items(), key=lambda item: item[1][0], reverse=True)
+        return [(key, count, error) for key, (count, error) in ranked[:n]]
+
+
+class HyperLogLog:
+    """
+    Distinct count estimate with about 1.04 / sqrt(2 ** precision) relative error
+    """
+
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.registers = registers if registers is not None else bytearray(1 << precision)
+
+    def add(self, h):
+        p = self.precision
+        rest = (h << p) & MASK64
+        rank = 65 - p if rest == 0 else 65 - rest.bit_length()
+        index = h >> (64 - p)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('HyperLogLogs with different precisions cannot be merged')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+
+class TrafficSketch:
+    """
+    Per-IP frequencies, top IPs and paths, and distinct IP counts for one
+    stream of requests
+    """
+
+    def __init__(self, width=None, depth=None, top_k=None, precision=None):
+        self.width = width or getattr(settings, 'IP_TRACKING_SKETCH_CMS_WIDTH', 2048)
+        self.depth = depth or getattr(settings, 'IP_TRACKING_SKETCH_CMS_DEPTH', 4)
+        self.top_k = top_k or getattr(settings, 'IP_TRACKING_SKETCH_TOP_K', 200)
+        self.precision = precision or getattr(settings, 'IP_TRACKING_SKETCH_HLL_PRECISION', 12)
+        self.requests = 0
+        self.ip_counts = CountMinSketch(self.width, self.depth)
+        self.top_ips = SpaceSaving(self.top_k)
+        self.top_paths = SpaceSaving(self.top_k)
+        self.distinct_ips = HyperLogLog(self.precision)
+        # Only paths in top_paths keep a distinct IP count
+        self.path_ips = {}
+
+    @staticmethod
+    def ip_hash(ip_address, ip_value=None):
+        if ip_value is None:
+            parsed = parse_ip(ip_address)
+            if parsed is None:
+                return hash_text(ip_address)
+            ip_value = parsed[1]
+        return hash_value(ip_value)
+
+    def observe(self, ip_address, path, ip_value=None):
+        h = self.ip_hash(ip_address, ip_value)
+        path = path[:255]
+        self.requests += 1
+        self.ip_counts.add(h)
+        self.top_ips.add(ip_address)
+        self.distinct_ips.add(h)
+
+        evicted = self.top_paths.add(path)
+        if evicted is not None:
+            self.path_ips.pop(evicted, None)
+        path_ips = self.path_ips.get(path)
+        if path_ips is None:
+            path_ips = self.path_ips[path] = HyperLogLog(PATH_PRECISION)
+        path_ips.add(h)
+
+    def estimate(self, ip_address):
+        """
+        Estimated requests from ip_address; never an undercount
+        """
+        return self.ip_counts.estimate(self.ip_hash(ip_address))
+
+    def top_ips_with_bounds(self, n=None):
+        """
+        Return (IP, upper bound, lower bound) for the busiest IPs. Both the
+        Space-Saving count and the Count-Min estimate overcount, so the
+        smaller of the two is the upper bound.
+        """
+        return [
+            (ip_address, min(count, self.estimate(ip_address)), count - error)
+            for ip_address, count, error in self.top_ips.top(n)
+        ]
+
+    def heavy_hitters(self, threshold):
+        """
+        Return IP -> guaranteed minimum request count for IPs certain to be
+        over threshold
+        """
+        return {
+            ip_address: lower
+            for ip_address, upper, lower in self.top_ips_with_bounds()
+            if lower > threshold
+        }
+
+    def top_paths_with_distinct_ips(self, n=None):
+        """
+        Return (path, count, error, distinct IPs) for the busiest paths
+        """
+        return [
+            (path, count, error, self.path_ips[path].count() if path in self.path_ips else None)
+            for path, count, error in self.top_paths.top(n)
+        ]
+
+    def merge(self, other):
+        self.requests += other.requests
+        self.ip_counts.merge(other.ip_counts)
+        self.top_ips.merge(other.top_ips)
+        self.top_paths.merge(other.top_paths)
+        self.distinct_ips.merge(other.distinct_ips)
+        for path, path_ips in other.path_ips.items():
+            if path in self.path_ips:
+                self.path_ips[path].merge(path_ips)
+            else:
+                self.path_ips[path] = HyperLogLog(PATH_PRECISION, bytearray(path_ips.registers))
+        for path in self.path_ips.keys() - self.top_paths.counters.keys():
+            del self.path_ips[path]
+
+    def to_dict(self):
+        """
+        Plain data for the cache, independent of these classes
+        """
+        return {
+            'dimensions': [self.width, self.depth, self.top_k, self.precision],
+            'requests': self.requests,
+            'ip_counts': self.ip_counts.to_bytes(),
+            'top_ips': {key: list(counter) for key, counter in self.top_ips.counters.items()},
+            'top_paths': {key: list(counter) for key, counter in self.top_paths.counters.items()},
+            'distinct_ips': bytes(self.distinct_ips.registers),
+            'path_ips': {path: bytes(path_ips.registers) for path, path_ips in self.path_ips.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        width, depth, top_k, precision = data['dimensions']
+        sketch = cls(width, depth, top_k, precision)
+        sketch.requests = data['requests']
+        sketch.ip_counts = CountMinSketch.from_bytes(data['ip_counts'], width, depth)
+        sketch.top_ips = SpaceSaving(top_k, {key: list(counter) for key, counter in data['top_ips'].items()})
+        sketch.top_paths = SpaceSaving(top_k, {key: list(counter) for key, counter in data['top_paths'].items()})
+        sketch.distinct_ips = HyperLogLog(precision, bytearray(data['distinct_ips']))
+        sketch.path_ips = {
+            path: HyperLogLog(PATH_PRECISION, bytearray(registers))
+            for path, registers in data['path_ips'].items()
+        }
+        return sketch
+
+
+class SketchRecorder:
+    """
+    Keeps this process's TrafficSketch for the current interval and
+    publishes it to the cache from a background thread every
+    publish_interval seconds, so the request path never touches the cache.
+    """
+
+    def __init__(self, interval=None, publish_interval=None, retention=None):
+        self.interval = interval or getattr(settings, 'IP_TRACKING_SKETCH_INTERVAL', 60)
+        self.publish_interval = publish_interval or getattr(settings, 'IP_TRACKING_SKETCH_PUBLISH_INTERVAL', 5)
+        self.retention = retention or getattr(settings, 'IP_TRACKING_SKETCH_RETENTION', 7200)
+        # Unpublished intervals older than this would have expired anyway
+        self.max_sealed = max(self.retention // self.interval, 1)
+        self.enabled = getattr(settings, 'IP_TRACKING_SKETCHES_ENABLED', True)
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._interval = None
+        self._sketch = TrafficSketch()
+        self._sealed = {}
+        self._thread = None
+        self._pid = None
+
+    def observe(self, ip_address, path, ip_value=None, now=None):
+        if not self.enabled:
+            return
+        self._ensure_started()
+        interval = int((time.time() if now is None else now) // self.interval)
+        with self._lock:
+            if interval != self._interval:
+                if self._sketch.requests:
+                    self._sealed[self._interval] = self._sketch
+                    self._trim_sealed()
+                self._interval = interval
+                self._sketch = TrafficSketch()
+            self._sketch.observe(ip_address, path, ip_value)
+
+    def publish(self):
+        """
+        Write finished intervals and the current one to the cache
+        """
+        with self._lock:
+            sealed, self._sealed = self._sealed, {}
+            pending = {interval: sketch.to_dict() for interval, sketch in sealed.items()}
+            if self._sketch.requests:
+                pending[self._interval] = self._sketch.to_dict()
+        if not pending:
+            return 0
+
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        try:
+            cache.set_many(
+                {f"{CACHE_PREFIX}:{interval}:{worker}": data for interval, data in pending.items()},
+                self.retention
+            )
+            self._register(worker)
+        except Exception as e:
+            # Finished intervals are retried on the next publish
+            with self._lock:
+                for interval, sketch in sealed.items():
+                    self._sealed.setdefault(interval, sketch)
+                self._trim_sealed()
+            if settings.DEBUG:
+                print(f"Error publishing traffic sketches: {e}")
+            return 0
+        return len(pending)
+
+    def _trim_sealed(self):
+        # While the cache is down, keep only the newest unpublished intervals
+        for interval in sorted(self._sealed)[:-self.max_sealed]:
+            del self._sealed[interval]
+
+    def _register(self, worker):
+        # Racing registrations can drop a worker, but it re-adds itself on
+        # its next publish
+        now = time.time()
+        workers = cache.get(WORKERS_KEY) or {}
+        if now - workers.get(worker, 0) < self.interval:
+            return
+        workers = {name: seen for name, seen in workers.items() if now - seen < self.retention}
+        workers[worker] = now
+        cache.set(WORKERS_KEY, workers, None)
+
+    def close(self):
+        self._stop.set()
+        if self._pid == os.getpid():
+            self.publish()
+
+    def _ensure_started(self):
+        """
+        Start the publisher thread lazily, and again after a fork
+        """
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # A forked child must not publish the parent's counts as its own
+            with self._lock:
+                self._interval = None
+                self._sketch = TrafficSketch()
+                self._sealed = {}
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='ip-tracking-sketch-publisher', daemon=True
+            )
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while not self._stop.wait(self.publish_interval):
+            self.publish()
+
+
+def load_traffic_sketch(since, until, interval=None):
+    """
+    Merge every process's published sketches for the intervals overlapping
+    [since, until) (datetimes) into one TrafficSketch
+    """
+    interval = interval or getattr(settings, 'IP_TRACKING_SKETCH_INTERVAL', 60)
+    first = int(since.timestamp() // interval)
+    last = int(math.ceil(until.timestamp() / interval)) - 1
+    workers = cache.get(WORKERS_KEY) or {}
+    keys = [
+        f"{CACHE_PREFIX}:{index}:{worker}"
+        for index in range(first, last + 1)
+        for worker in workers
+    ]
+
+    merged = TrafficSketch()
+    for data in cache.get_many(keys).values():
+        merged.merge(TrafficSketch.from_dict(data))
+    return merged
+
+
+# Create a global instance
+traffic_sketches = SketchRecorder()
+atexit.register(traffic_sketches.close)
@@ -0,0 +1,108 @@
+import threading
+import time
+from django.conf import settings
+from .addresses import parse_ip
+from .models import SuspiciousIP
+
+
+def _value(ip_address, value=None):
+    if value is not None:
+        return value
+    parsed = parse_ip(ip_address)
+    return parsed[1] if parsed else None
+
+
+class SuspiciousIPSet:
+    """
+    In-process set of active SuspiciousIP addresses, held as packed
+    128-bit values.
+
+    The set is reloaded from the database at most once per refresh
+    interval. Only one thread reloads at a time; the others keep using the
+    current set rather than waiting, so the request path never blocks on
+    the query. IPs flagged by this process's streaming detector are added
+    immediately.
+    """
+
+    def __init__(self, refresh_interval=None):
+        if refresh_interval is None:
+            refresh_interval = getattr(settings, 'IP_TRACKING_SUSPICIOUS_REFRESH_INTERVAL', 30)
+        self.refresh_interval = refresh_interval
+        self._addresses = frozenset()
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, ip_address):
+        return self.contains(ip_address)
+
+    def contains(self, ip_address, value=None):
+        """
+        Check membership; pass the packed value from parse_ip to skip parsing
+        """
+        self.refresh()
+        return _value(ip_address, value) in self._addresses
+
+    async def acontains(self, ip_address, value=None):
+        """
+        Async variant of contains for the ASGI request path
+        """
+        await self.arefresh()
+        return _value(ip_address, value) in self._addresses
+
+    def __len__(self):
+        return len(self._addresses)
+
+    def add(self, ip_address, value=None):
+        # A reload racing with this may drop the address again, but by then
+        # the detector's flush has written it to SuspiciousIP
+        value = _value(ip_address, value)
+        if value is not None:
+            self._addresses = self._addresses | {value}
+
+    def _is_fresh(self, now):
+        return self._loaded_at is not None and now - self._loaded_at < self.refresh_interval
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._is_fresh(now):
+            return
+        if not self._lock.acquire(blocking=force):
+            return
+        try:
+            if not force and self._is_fresh(now):
+                return
+            try:
+                self._addresses = frozenset(
+                    _value(ip_address) for ip_address in
+                    SuspiciousIP.objects.filter(is_active=True).values_list('ip_address', flat=True).iterator()
+                ) - {None}
+            except Exception as e:
+                # Keep the current set; try again after the next interval
+                if settings.DEBUG:
+                    print(f"Error loading suspicious IPs: {e}")
+            self._loaded_at = now
+        finally:
+            self._lock.release()
+
+    async def arefresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._is_fresh(now):
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            try:
+                self._addresses = frozenset([
+                    _value(ip_address) async for ip_address in
+                    SuspiciousIP.objects.filter(is_active=True).values_list('ip_address', flat=True)
+                ]) - {None}
+            except Exception as e:
+                if settings.DEBUG:
+                    print(f"Error loading suspicious IPs: {e}")
+            self._loaded_at = now
+        finally:
+            self._lock.release()
+
+
+# Create a global instance
+suspicious_ips = SuspiciousIPSet()
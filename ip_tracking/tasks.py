@@ -1,16 +1,56 @@
-from celery import shared_task
+import os
+from celery import chord, shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from datetime import timedelta
 from django.db.models import Count
-from .models import RequestLog, SuspiciousIP
+from .detection import (
+    SENSITIVE_ACCESS_REASON,
+    SENSITIVE_PATHS,
+    StreamingDetector,
+    excessive_requests_reason,
+    flag_suspicious_ips,
+)
+from .geolocation import geolocation_service
+from . import partitioning, rollups
+from .models import RequestLog
+from .segments import Checkpoint, StateFile, consume
+from .sinks import get_segment_directory
+from .sketches import load_traffic_sketch
+
+SEGMENT_DETECT_LOCK_KEY = 'ip_tracking:segment_detect:lock'
+GEO_ENRICH_LOCK_KEY = 'ip_tracking:geo_enrich:lock'
+GEO_ENRICH_CURSOR_KEY = 'ip_tracking:geo_enrich:cursor'
 
 @shared_task
 def detect_suspicious_ips():
     """
     Celery task to detect suspicious IPs hourly.
     Flags IPs exceeding 100 requests/hour or accessing sensitive paths.
+    The middleware's streaming detector flags most offenders within seconds;
+    this pass reconciles anything it missed (evicted IPs, other workers,
+    restarts) from the RequestLog table. It reads raw rows rather than the
+    hourly rollups because the trailing-hour window needs per-request
+    timestamps; raw retention always covers it.
+    
+    With IP_TRACKING_DETECTION_SHARDS above 1 the window is split by
+    address range into a chord of detect_suspicious_ips_shard tasks whose
+    results are merged and written once by merge_suspicious_ip_shards.
     """
-    one_hour_ago = timezone.now() - timedelta(hours=1)
+    until = timezone.now()
+    one_hour_ago = until - timedelta(hours=1)
+    
+    shards = getattr(settings, 'IP_TRACKING_DETECTION_SHARDS', 1)
+    if shards > 1:
+        # One extra shard holds the IPv6 space above the IPv4-mapped range
+        chord(
+            detect_suspicious_ips_shard.s(one_hour_ago.isoformat(), until.isoformat(), shard, shards)
+            for shard in range(shards + 1)
+        )(merge_suspicious_ip_shards.s())
+        return {'shards': shards + 1}
     
     # Detect IPs with excessive requests (more than 100 requests/hour)
     excessive_requests_ips = detect_excessive_requests(one_hour_ago)
@@ -23,72 +63,263 @@ def detect_suspicious_ips():
         'sensitive_access_detected': len(sensitive_access_ips)
     }
 
-def detect_excessive_requests(one_hour_ago):
+@shared_task(autoretry_for=(DatabaseError,), retry_backoff=True, max_retries=3)
+def detect_suspicious_ips_shard(since, until, shard, shards):
     """
-    Detect IPs making more than 100 requests in the last hour
+    Run both detectors over one address range of a fixed window. Shards
+    only read, so a retried shard returns the same result; nothing is
+    written until every shard has finished.
+    """
+    rows = RequestLog.objects.filter(
+        timestamp__gte=parse_datetime(since),
+        timestamp__lt=parse_datetime(until)
+    ).in_shard(shard, shards)
+    return {
+        'excessive': excessive_request_reasons(rows),
+        'sensitive': sensitive_access_reasons(rows)
+    }
+
+@shared_task
+def merge_suspicious_ip_shards(results):
+    """
+    Chord callback: merge the shard results and write them in one upsert
+    """
+    excessive = {}
+    sensitive = {}
+    for result in results:
+        excessive.update(result['excessive'])
+        sensitive.update(result['sensitive'])
+    
+    # The sensitive-path reason wins, as when the detectors run one after the other
+    flag_suspicious_ips({**excessive, **sensitive})
+    
+    return {
+        'excessive_requests_detected': len(excessive),
+        'sensitive_access_detected': len(sensitive)
+    }
+
+def _window_rows(one_hour_ago, until=None):
+    rows = RequestLog.objects.filter(timestamp__gte=one_hour_ago)
+    if until is not None:
+        rows = rows.filter(timestamp__lt=until)
+    return rows
+
+def excessive_request_reasons(rows):
+    """
+    Return IP -> reason for IPs in rows with more requests than the threshold
     """
     # Get IPs with request counts exceeding threshold
     ip_counts = (
-        RequestLog.objects
-        .filter(timestamp__gte=one_hour_ago)
+        rows
         .values('ip_address')
         .annotate(request_count=Count('id'))
-        .filter(request_count__gt=100)
+        .filter(request_count__gt=getattr(settings, 'IP_TRACKING_REQUESTS_PER_HOUR_THRESHOLD', 100))
     )
     
-    detected_ips = []
-    for ip_data in ip_counts:
-        ip_address = ip_data['ip_address']
-        request_count = ip_data['request_count']
-        reason = f"Excessive requests: {request_count} requests in the last hour"
-        
-        # Create or update SuspiciousIP record
-        suspicious_ip, created = SuspiciousIP.objects.get_or_create(
-            ip_address=ip_address,
-            defaults={'reason': reason}
-        )
-        
-        if not created:
-            suspicious_ip.reason = reason
-            suspicious_ip.update_detection_time()
-        
-        detected_ips.append(ip_address)
-    
-    return detected_ips
-
-def detect_sensitive_access(one_hour_ago):
+    return {
+        ip_data['ip_address']: excessive_requests_reason(ip_data['request_count'])
+        for ip_data in ip_counts
+    }
+
+def sensitive_access_reasons(rows):
     """
-    Detect IPs accessing sensitive paths (/admin, /login) in the last hour
+    Return IP -> reason for IPs in rows that accessed a sensitive path
     """
-    sensitive_paths = ['/admin', '/login', '/admin/', '/login/']
-    
     # Get unique IPs that accessed sensitive paths
     sensitive_access_ips = (
-        RequestLog.objects
-        .filter(
-            timestamp__gte=one_hour_ago,
-            path__in=sensitive_paths
-        )
+        rows
+        .filter(path__in=SENSITIVE_PATHS)
         .values('ip_address')
         .distinct()
     )
     
-    detected_ips = []
-    for ip_data in sensitive_access_ips:
-        ip_address = ip_data['ip_address']
-        reason = "Accessed sensitive path (/admin or /login)"
-        
-        # Create or update SuspiciousIP record
-        suspicious_ip, created = SuspiciousIP.objects.get_or_create(
-            ip_address=ip_address,
-            defaults={'reason': reason}
-        )
-        
-        if not created:
-            suspicious_ip.reason = reason
-            suspicious_ip.update_detection_time()
-        
-        detected_ips.append(ip_address)
-    
-    return detected_ips
-    
\ No newline at end of file
+    return {
+        ip_data['ip_address']: SENSITIVE_ACCESS_REASON
+        for ip_data in sensitive_access_ips
+    }
+
+def detect_excessive_requests(one_hour_ago, until=None):
+    """
+    Detect IPs making more than 100 requests in the last hour
+    (or in the hour starting at one_hour_ago when until is given)
+    """
+    reasons = excessive_request_reasons(_window_rows(one_hour_ago, until))
+    
+    # Create or update SuspiciousIP records in one set-based upsert
+    flag_suspicious_ips(reasons)
+    
+    return list(reasons)
+
+def detect_sensitive_access(one_hour_ago, until=None):
+    """
+    Detect IPs accessing sensitive paths (/admin, /login) in the last hour
+    (or up to until when given)
+    """
+    reasons = sensitive_access_reasons(_window_rows(one_hour_ago, until))
+    
+    # Create or update SuspiciousIP records in one set-based upsert
+    flag_suspicious_ips(reasons)
+    
+    return list(reasons)
+
+@shared_task
+def detect_from_log_segments():
+    """
+    Celery task to run streaming detection over new binary log segment
+    records, resuming from the detector's checkpointed offsets.
+    
+    Runs may land on any worker process, so the sliding windows are saved
+    next to the checkpoint and reloaded by the next run rather than kept in
+    memory, and overlapping runs are skipped.
+    """
+    directory = get_segment_directory()
+    if not os.path.isdir(directory):
+        return {'records': 0, 'flagged': 0}
+    lock_timeout = getattr(settings, 'IP_TRACKING_SEGMENT_DETECT_LOCK_TIMEOUT', 300)
+    
+    if not cache.add(SEGMENT_DETECT_LOCK_KEY, True, lock_timeout):
+        return {'skipped': 'Segment detection already running'}
+    try:
+        return _detect_from_log_segments(directory)
+    finally:
+        cache.delete(SEGMENT_DETECT_LOCK_KEY)
+
+def _detect_from_log_segments(directory):
+    checkpoint = Checkpoint(directory, 'detector')
+    state_file = StateFile(directory, 'detector')
+    detector = StreamingDetector()
+    state = state_file.load()
+    if state is not None:
+        detector.set_state(state)
+    
+    records = 0
+    for segment, end, ip_address, timestamp, path in consume(directory, checkpoint):
+        detector.observe(ip_address, path, timestamp=timestamp)
+        checkpoint.set(segment, end)
+        records += 1
+    
+    flagged = detector.flush()
+    # State first: a crash in between replays records into saved windows,
+    # which can only over-count, rather than losing them
+    state_file.save(detector.get_state())
+    checkpoint.save()
+    
+    return {'records': records, 'flagged': flagged}
+
+@shared_task
+def detect_heavy_hitters():
+    """
+    Celery task to flag IPs over the hourly threshold from the merged
+    traffic sketches. Memory is fixed by the sketch sizes however many
+    IPs are seen, and only IPs whose guaranteed minimum count is over the
+    threshold are flagged, so there are no false positives; IPs too rare
+    to stay in the top-K are left to detect_suspicious_ips.
+    """
+    until = timezone.now()
+    window = getattr(settings, 'IP_TRACKING_DETECTION_WINDOW', 3600)
+    sketch = load_traffic_sketch(until - timedelta(seconds=window), until)
+    
+    heavy_hitters = sketch.heavy_hitters(
+        getattr(settings, 'IP_TRACKING_REQUESTS_PER_HOUR_THRESHOLD', 100)
+    )
+    flag_suspicious_ips({
+        ip_address: excessive_requests_reason(count)
+        for ip_address, count in heavy_hitters.items()
+    })
+    
+    return {'requests': sketch.requests, 'heavy_hitters_detected': len(heavy_hitters)}
+
+@shared_task
+def enrich_request_log_geolocation(max_ips=None):
+    """
+    Celery task to fill in country/city/region on RequestLog rows.
+    Each distinct unresolved IP is looked up once and all of its rows are
+    updated together. Runs walk the unresolved IPs in address order from a
+    cursor kept in the cache, so IPs whose lookup keeps failing are retried
+    once per pass instead of starving the rest. Overlapping runs are
+    skipped.
+    """
+    if max_ips is None:
+        max_ips = getattr(settings, 'IP_TRACKING_GEO_ENRICH_MAX_IPS', 1000)
+    lock_timeout = getattr(settings, 'IP_TRACKING_GEO_ENRICH_LOCK_TIMEOUT', 600)
+    
+    if not cache.add(GEO_ENRICH_LOCK_KEY, True, lock_timeout):
+        return {'skipped': 'Enrichment already running'}
+    try:
+        return _enrich_request_log_geolocation(max_ips)
+    finally:
+        cache.delete(GEO_ENRICH_LOCK_KEY)
+
+def _enrich_request_log_geolocation(max_ips):
+    unresolved = RequestLog.objects.filter(geolocated=False)
+    cursor = cache.get(GEO_ENRICH_CURSOR_KEY)
+    if cursor:
+        unresolved = unresolved.filter(ip_address__gt=cursor)
+    ip_addresses = list(
+        unresolved
+        .order_by('ip_address')
+        .values_list('ip_address', flat=True)
+        .distinct()[:max_ips]
+    )
+    # A short page means the end was reached; the next run starts over
+    next_cursor = ip_addresses[-1] if len(ip_addresses) == max_ips else None
+    cache.set(GEO_ENRICH_CURSOR_KEY, next_cursor, None)
+    if not ip_addresses:
+        return {'ips_resolved': 0, 'ips_failed': 0, 'rows_updated': 0}
+    
+    results = geolocation_service.get_geolocation_batch(ip_addresses)
+    
+    resolved = 0
+    failed = 0
+    rows_updated = 0
+    with transaction.atomic():
+        for ip_address in ip_addresses:
+            geolocation_data = results.get(ip_address)
+            if not geolocation_data or geolocation_data.get('error'):
+                failed += 1
+                continue
+            
+            rows_updated += RequestLog.objects.filter(
+                ip_address=ip_address,
+                geolocated=False
+            ).update(
+                country=geolocation_data.get('country'),
+                city=geolocation_data.get('city'),
+                region=geolocation_data.get('region'),
+                geolocated=True
+            )
+            resolved += 1
+    
+    return {
+        'ips_resolved': resolved,
+        'ips_failed': failed,
+        'rows_updated': rows_updated
+    }
+
+@shared_task
+def roll_up_request_logs():
+    """
+    Celery task to maintain the hourly RequestLog rollups incrementally
+    """
+    return rollups.roll_up_request_logs()
+
+@shared_task
+def purge_request_logs():
+    """
+    Celery task to delete raw RequestLog rows past the retention horizon
+    """
+    return rollups.purge_request_logs()
+
+@shared_task
+def maintain_request_log_partitions():
+    """
+    Celery task to keep daily RequestLog partitions ahead of time.
+    Only does anything once partitioning is enabled on PostgreSQL.
+    """
+    if not partitioning.is_enabled() or not partitioning.is_partitioned():
+        return {'partitioning': False}
+    
+    partitioning.create_partitions(
+        days_ahead=getattr(settings, 'IP_TRACKING_PARTITION_DAYS_AHEAD', 7)
+    )
+    return {'partitioning': True}
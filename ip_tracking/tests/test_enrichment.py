@@ -0,0 +1,151 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from django.core.cache import cache
+from django.test import TestCase
+from ip_tracking.addresses import pack_ip
+from ip_tracking.geolocation import geolocation_service
+from ip_tracking.models import IPGeolocationCache, RequestLog
+from ip_tracking.tasks import GEO_ENRICH_CURSOR_KEY, GEO_ENRICH_LOCK_KEY, enrich_request_log_geolocation
+
+LOCATIONS = {
+    '1.1.1.1': {'ip': '1.1.1.1', 'country': 'AU', 'city': 'Sydney', 'region': 'New South Wales'},
+    '8.8.8.8': {'ip': '8.8.8.8', 'country': 'US', 'city': 'Mountain View', 'region': 'California'},
+    '9.9.9.9': {'ip': '9.9.9.9', 'country': 'CH', 'city': 'Zurich', 'region': 'Zurich'},
+}
+
+
+class IPInfoStub(BaseHTTPRequestHandler):
+    """
+    Local stand-in for ipinfo.io: POST /batch and GET /<ip>/json. IPs in
+    failing are left out of batch responses and get a 500 from /<ip>/json.
+    """
+    failing = set()
+    requested = []
+
+    def do_POST(self):
+        ip_addresses = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        type(self).requested.extend(ip_addresses)
+        self._reply(200, {
+            ip_address: LOCATIONS[ip_address]
+            for ip_address in ip_addresses
+            if ip_address in LOCATIONS and ip_address not in self.failing
+        })
+
+    def do_GET(self):
+        ip_address = self.path.split('?')[0].strip('/').split('/')[0]
+        type(self).requested.append(ip_address)
+        if ip_address in self.failing or ip_address not in LOCATIONS:
+            self._reply(500, {'error': 'Lookup failed'})
+        else:
+            self._reply(200, LOCATIONS[ip_address])
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class EnrichRequestLogGeolocationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), IPInfoStub)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        IPInfoStub.failing = set()
+        IPInfoStub.requested = []
+        cache.clear()
+        geolocation_service.local_cache.clear()
+        for patcher in (
+            mock.patch.object(geolocation_service, 'base_url', self.base_url),
+            mock.patch.object(geolocation_service, 'api_key', 'test-token'),
+            mock.patch.object(geolocation_service, 'database_path', None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for ip_address in ('8.8.8.8', '1.1.1.1', '1.1.1.1', '9.9.9.9'):
+            RequestLog.objects.create(ip_address=ip_address, ip_packed=pack_ip(ip_address), path='/')
+
+    def test_batch_resolves_every_row_of_each_ip(self):
+        result = enrich_request_log_geolocation()
+
+        self.assertEqual(result, {'ips_resolved': 3, 'ips_failed': 0, 'rows_updated': 4})
+        self.assertEqual(sorted(IPInfoStub.requested), ['1.1.1.1', '8.8.8.8', '9.9.9.9'])
+        self.assertFalse(RequestLog.objects.filter(geolocated=False).exists())
+        self.assertEqual(
+            set(RequestLog.objects.filter(ip_address='1.1.1.1').values_list('country', 'city')),
+            {('AU', 'Sydney')}
+        )
+        self.assertEqual(IPGeolocationCache.objects.count(), 3)
+
+    def test_partial_batch_failure_leaves_failed_ips_for_a_later_run(self):
+        IPInfoStub.failing = {'1.1.1.1'}
+
+        result = enrich_request_log_geolocation()
+
+        self.assertEqual(result, {'ips_resolved': 2, 'ips_failed': 1, 'rows_updated': 2})
+        self.assertEqual(
+            sorted(RequestLog.objects.filter(geolocated=False).values_list('ip_address', flat=True)),
+            ['1.1.1.1', '1.1.1.1']
+        )
+        self.assertFalse(IPGeolocationCache.objects.filter(ip_address='1.1.1.1').exists())
+
+        # Once the negative cache entry expires the IP is looked up again
+        IPInfoStub.failing = set()
+        geolocation_service.local_cache.clear()
+        result = enrich_request_log_geolocation()
+
+        self.assertEqual(result, {'ips_resolved': 1, 'ips_failed': 0, 'rows_updated': 2})
+        self.assertFalse(RequestLog.objects.filter(geolocated=False).exists())
+
+    def test_single_lookups_without_a_token(self):
+        IPInfoStub.failing = {'9.9.9.9'}
+
+        with mock.patch.object(geolocation_service, 'api_key', None):
+            result = enrich_request_log_geolocation()
+
+        self.assertEqual(result, {'ips_resolved': 2, 'ips_failed': 1, 'rows_updated': 3})
+        self.assertEqual(sorted(IPInfoStub.requested), ['1.1.1.1', '8.8.8.8', '9.9.9.9'])
+        self.assertTrue(RequestLog.objects.filter(ip_address='9.9.9.9', geolocated=False).exists())
+
+    def test_cursor_pages_through_ips_and_wraps_at_the_end(self):
+        IPInfoStub.failing = set(LOCATIONS)
+
+        pages = []
+        for _ in range(3):
+            geolocation_service.local_cache.clear()
+            IPInfoStub.requested = []
+            result = enrich_request_log_geolocation(max_ips=2)
+            pages.append((sorted(IPInfoStub.requested), result['ips_failed'], cache.get(GEO_ENRICH_CURSOR_KEY)))
+
+        self.assertEqual(pages, [
+            (['1.1.1.1', '8.8.8.8'], 2, '8.8.8.8'),
+            # A short page ends the pass and resets the cursor
+            (['9.9.9.9'], 1, None),
+            (['1.1.1.1', '8.8.8.8'], 2, '8.8.8.8'),
+        ])
+
+    def test_overlapping_run_is_skipped(self):
+        cache.add(GEO_ENRICH_LOCK_KEY, True, 60)
+
+        result = enrich_request_log_geolocation()
+
+        self.assertIn('skipped', result)
+        self.assertEqual(IPInfoStub.requested, [])
+        self.assertEqual(RequestLog.objects.filter(geolocated=False).count(), 4)
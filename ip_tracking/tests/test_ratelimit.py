@@ -0,0 +1,98 @@
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from django.test import SimpleTestCase
+from ip_tracking.ratelimit import MemoryBackend, RateLimiter, RedisBackend, SQLiteBackend
+
+try:
+    import fakeredis
+except ImportError:  # Optional: pip install "fakeredis[lua]" to run the Redis script
+    fakeredis = None
+
+START = 1000000.0
+# Seconds after START: a burst past the limit, a partial refill, a quiet
+# period that refills completely, then another burst
+ARRIVALS = [0, 0, 0, 0, 0.5, 2, 3.9, 4, 4, 10, 30, 30, 30, 30, 30.1]
+
+
+class Clock:
+    """
+    Stand-in for time.time, so every backend (and the fake Redis server's
+    TIME command) sees the same arrivals
+    """
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class GCRABackendTests(SimpleTestCase):
+    rate = '3/6s'
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.sqlite_path = f"{directory}/ratelimit.sqlite3"
+
+    def run_sequence(self, backend):
+        """
+        Return (allowed, remaining, retry_after, reset_after) for each arrival
+        """
+        limiter = RateLimiter(backend)
+        clock = Clock(START)
+        results = []
+        with mock.patch('time.time', clock):
+            for offset in ARRIVALS:
+                clock.now = START + offset
+                result = limiter.check('client', self.rate)
+                results.append((
+                    result.allowed,
+                    result.remaining,
+                    round(result.retry_after, 3),
+                    round(result.reset_after, 3),
+                ))
+        return results
+
+    def test_memory_backend_sequence(self):
+        self.assertEqual(self.run_sequence(MemoryBackend()), [
+            (True, 2, 0.0, 2.0),
+            (True, 1, 0.0, 4.0),
+            (True, 0, 0.0, 6.0),
+            (False, 0, 2.0, 6.0),
+            (False, 0, 1.5, 5.5),
+            (True, 0, 0.0, 6.0),
+            (False, 0, 0.1, 4.1),
+            (True, 0, 0.0, 6.0),
+            (False, 0, 2.0, 6.0),
+            (True, 2, 0.0, 2.0),
+            (True, 2, 0.0, 2.0),
+            (True, 1, 0.0, 4.0),
+            (True, 0, 0.0, 6.0),
+            (False, 0, 2.0, 6.0),
+            (False, 0, 1.9, 5.9),
+        ])
+
+    def test_sqlite_backend_matches_memory_backend(self):
+        self.assertEqual(
+            self.run_sequence(SQLiteBackend(path=self.sqlite_path)),
+            self.run_sequence(MemoryBackend())
+        )
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis[lua] is not installed')
+    def test_redis_backend_matches_memory_backend(self):
+        backend = RedisBackend(client=fakeredis.FakeRedis())
+        self.assertEqual(self.run_sequence(backend), self.run_sequence(MemoryBackend()))
+
+    @unittest.skipIf(fakeredis is None, 'fakeredis[lua] is not installed')
+    def test_redis_keys_expire_once_the_bucket_refills(self):
+        client = fakeredis.FakeRedis()
+        limiter = RateLimiter(RedisBackend(client=client, prefix='rl:'))
+        clock = Clock(START)
+        with mock.patch('time.time', clock):
+            limiter.check('client', self.rate)
+            self.assertEqual(client.pttl('rl:3/6s:client'), 2000)
+            clock.now = START + 2.001
+            self.assertIsNone(client.get('rl:3/6s:client'))
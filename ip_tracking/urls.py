@@ -4,4 +4,7 @@ from . import views
 urlpatterns = [
     path('sensitive/', views.sensitive_view, name='sensitive-view'),
     path('auth-sensitive/', views.authenticated_sensitive_view, name='auth-sensitive-view'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('analytics/<slug:report>/', views.analytics_view, name='analytics'),
+    path('export/', views.export_view, name='export'),
 ]
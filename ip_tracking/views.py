@@ -1,11 +1,14 @@
+from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.views.decorators.http import require_http_methods
-from django_ratelimit.decorators import ratelimit
-from django_ratelimit.exceptions import Ratelimited
+from . import analytics, export, metrics
+from .ratelimit import RateLimitExceeded, rate_limit
 
 @require_http_methods(["GET", "POST"])
-@ratelimit(key='ip', rate='5/m', method=['GET', 'POST'], block=True)
+@rate_limit(key='ip', rate='5/m')
 def sensitive_view(request):
     """
     A sensitive view that should be rate limited
@@ -25,7 +28,7 @@ def sensitive_view(request):
     })
 
 @require_http_methods(["GET", "POST"])
-@ratelimit(key='user', rate='10/m', method=['GET', 'POST'], block=True)
+@rate_limit(key='user', rate='10/m')
 def authenticated_sensitive_view(request):
     """
     A sensitive view for authenticated users with higher rate limit
@@ -56,7 +59,8 @@ def rate_limit_exceeded(request, exception):
     """
     Custom view for when rate limit is exceeded
     """
-    if isinstance(exception, Ratelimited):
+    if isinstance(exception, RateLimitExceeded):
+        metrics.RATE_LIMITED_RESPONSES.inc()
         return JsonResponse({
             'status': 'error',
             'message': 'Rate limit exceeded. Please try again later.',
@@ -69,4 +73,83 @@ def rate_limit_exceeded(request, exception):
         'status': 'error',
         'message': 'An error occurred'
     }, status=500)
-    
\ No newline at end of file
+
+def client_allowed(request, setting):
+    """
+    Check REMOTE_ADDR against an allowed-IPs setting (None allows every client)
+    """
+    allowed_ips = getattr(settings, setting, ['127.0.0.1', '::1'])
+    return allowed_ips is None or request.META.get('REMOTE_ADDR') in allowed_ips
+
+@require_http_methods(["GET"])
+def metrics_view(request):
+    """
+    Expose middleware timings, cache hit rates and 403/429 counts in the
+    Prometheus text format, to clients listed in IP_TRACKING_METRICS_ALLOWED_IPS
+    """
+    if not client_allowed(request, 'IP_TRACKING_METRICS_ALLOWED_IPS'):
+        return HttpResponseForbidden("Metrics are not available to this address")
+    
+    return HttpResponse(
+        metrics.registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+@require_http_methods(["GET"])
+def analytics_view(request, report):
+    """
+    Serve a traffic report (top-ips, top-paths, countries, request-rate, or
+    the sketch-based live-top-ips, live-top-paths and live-summary) over
+    ?window= (default 24h) from the bucketed analytics cache, with an
+    ETag so pollers can revalidate with If-None-Match
+    """
+    if report not in analytics.REPORTS:
+        raise Http404("Unknown report")
+    if not client_allowed(request, 'IP_TRACKING_ANALYTICS_ALLOWED_IPS'):
+        return HttpResponseForbidden("Analytics are not available to this address")
+    
+    try:
+        window = analytics.parse_window(request.GET.get('window', '24h'))
+        limit = int(request.GET.get('limit', 10))
+        if not 1 <= limit <= 100:
+            raise ValueError("limit must be between 1 and 100")
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    
+    body, etag, max_age = analytics.analytics_cache.get(report, window, limit)
+    response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, max_age=max(int(max_age), 0))
+    return get_conditional_response(request, etag=etag, response=response)
+
+@require_http_methods(["GET"])
+def export_view(request):
+    """
+    Stream RequestLog rows between ?since= and ?until= (ISO datetimes or
+    windows such as 24h) as NDJSON or CSV (?format=), optionally limited to
+    a CIDR ?network= and gzip compressed with ?gzip=1
+    """
+    if not client_allowed(request, 'IP_TRACKING_EXPORT_ALLOWED_IPS'):
+        return HttpResponseForbidden("Exports are not available to this address")
+    
+    fmt = request.GET.get('format', 'ndjson')
+    compress = request.GET.get('gzip') in ('1', 'true')
+    now = timezone.now()
+    try:
+        if fmt not in export.FORMATS:
+            raise ValueError(f"format must be one of {', '.join(export.FORMATS)}")
+        since = export.parse_time_bound(request.GET.get('since', '1h'), now)
+        until = export.parse_time_bound(request.GET['until'], now) if request.GET.get('until') else now
+        stream = export.export_stream(since, until, fmt, request.GET.get('network'), compress)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    
+    filename = f"request_logs_{since:%Y%m%dT%H%M%S}_{until:%Y%m%dT%H%M%S}.{fmt}"
+    if compress:
+        filename += '.gz'
+        content_type = 'application/gzip'
+    else:
+        content_type = 'application/x-ndjson' if fmt == 'ndjson' else 'text/csv; charset=utf-8'
+    response = StreamingHttpResponse(stream, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -20,6 +20,30 @@ app.conf.beat_schedule = {
         'task': 'ip_tracking.tasks.detect_suspicious_ips',
         'schedule': 3600,  # Run every hour (3600 seconds)
     },
+    'enrich-request-log-geolocation': {
+        'task': 'ip_tracking.tasks.enrich_request_log_geolocation',
+        'schedule': 60,  # Run every minute
+    },
+    'detect-from-log-segments': {
+        'task': 'ip_tracking.tasks.detect_from_log_segments',
+        'schedule': 30,  # Run every 30 seconds; a no-op without segment files
+    },
+    'detect-heavy-hitters': {
+        'task': 'ip_tracking.tasks.detect_heavy_hitters',
+        'schedule': 60,  # Run every minute from the cached traffic sketches
+    },
+    'roll-up-request-logs': {
+        'task': 'ip_tracking.tasks.roll_up_request_logs',
+        'schedule': 900,  # Run every 15 minutes
+    },
+    'purge-request-logs-daily': {
+        'task': 'ip_tracking.tasks.purge_request_logs',
+        'schedule': 86400,  # Run every day
+    },
+    'maintain-request-log-partitions-daily': {
+        'task': 'ip_tracking.tasks.maintain_request_log_partitions',
+        'schedule': 86400,  # Run every day; a no-op unless partitioning is enabled
+    },
 }
 
 @app.task(bind=True)
@@ -136,13 +136,13 @@ CACHES = {
 IPINFO_API_KEY = 'your_ipinfo_io_api_key_here'  # Get from https://ipinfo.io/
 
 # Rate limiting settings
-RATELIMIT_VIEW = 'ip_tracking.views.rate_limit_exceeded'  # Custom view for rate limit exceeded
-RATELIMIT_USE_CACHE = 'default'
-RATELIMIT_CACHE_PREFIX = 'rl:'
-
-# Optional: Custom rate limit exceeded view settings
-RATELIMIT_ENABLE = True
-RATELIMIT_HTTP_STATUS_CODE = 429  # Too Many Requests
+# Limits are shared by every worker using the same backend:
+# 'ip_tracking.ratelimit.SQLiteBackend' (one host), 'ip_tracking.ratelimit.RedisBackend'
+# (e.g. OPTIONS = {'url': 'redis://localhost:6379/0'}) or 'ip_tracking.ratelimit.MemoryBackend'
+IP_TRACKING_RATELIMIT_BACKEND = 'ip_tracking.ratelimit.SQLiteBackend'
+IP_TRACKING_RATELIMIT_OPTIONS = {'path': BASE_DIR / 'ratelimit.sqlite3'}
+IP_TRACKING_RATELIMIT_VIEW = 'ip_tracking.views.rate_limit_exceeded'  # Custom view for rate limit exceeded
+IP_TRACKING_RATELIMIT_ENABLE = True
 
 # Celery Configuration - Use in-memory broker for development
 CELERY_BROKER_URL = 'memory://'
@@ -151,3 +151,109 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
+
+# Blocklist snapshot settings
+# Seconds between checks of the shared blocklist version stamp
+IP_TRACKING_BLOCKLIST_CHECK_INTERVAL = 5
+# Maximum age in seconds of a worker's snapshot, even if no version bump is seen
+# (LocMemCache is per-process, so this is the upper bound on staleness here)
+IP_TRACKING_BLOCKLIST_MAX_AGE = 60
+
+# Buffered request log writer settings
+IP_TRACKING_LOG_BATCH_SIZE = 500  # Rows per bulk_create
+IP_TRACKING_LOG_FLUSH_INTERVAL = 1.0  # Seconds between flushes of a partial batch
+IP_TRACKING_LOG_QUEUE_SIZE = 10000  # Pending rows before new ones are dropped
+IP_TRACKING_LOG_BLOCK_TIMEOUT = 0  # Seconds to wait for queue space (0 = drop immediately)
+
+# Geolocation enrichment settings
+IPINFO_BASE_URL = 'https://ipinfo.io'  # Point at a local stub server in tests
+IPINFO_BATCH_SIZE = 1000  # IPs per ipinfo.io batch request (API maximum)
+IP_TRACKING_GEO_ENRICH_MAX_IPS = 1000  # Distinct IPs resolved per enrichment run
+IP_TRACKING_GEO_ENRICH_LOCK_TIMEOUT = 600  # Seconds before a crashed run's lock expires
+
+# In-process geolocation cache settings
+IP_TRACKING_GEO_LRU_SIZE = 10000  # Entries kept per process
+IP_TRACKING_GEO_LRU_TTL = 3600  # Seconds a successful lookup is kept per process
+IP_TRACKING_GEO_NEGATIVE_TTL = 300  # Seconds failed and non-routable lookups are kept
+
+# Offline geolocation database (see the compile_geodb management command)
+# Set to a compiled range database or an .mmdb file to resolve IPs locally
+IP_GEOLOCATION_DATABASE = None
+IP_GEOLOCATION_HTTP_FALLBACK = True  # Query ipinfo.io for addresses the database doesn't cover
+
+# ipinfo.io HTTP client settings
+IPINFO_TIMEOUT = 5  # Seconds per request
+IPINFO_POOL_SIZE = 10  # Keep-alive connections per process
+IPINFO_MAX_CONCURRENT = 10  # Concurrent API calls per process
+
+# Anomaly detection settings
+IP_TRACKING_REQUESTS_PER_HOUR_THRESHOLD = 100  # Requests per window before an IP is flagged
+IP_TRACKING_DETECTION_WINDOW = 3600  # Streaming detector window in seconds
+IP_TRACKING_DETECTION_BUCKET_SECONDS = 60  # Streaming detector bucket size in seconds
+IP_TRACKING_DETECTION_MAX_IPS = 100000  # IPs tracked per process before LRU eviction
+IP_TRACKING_SUSPICIOUS_UPSERT_BATCH_SIZE = 1000  # Rows per SuspiciousIP upsert statement
+
+# Optional daily partitioning of RequestLog (PostgreSQL only)
+# Convert once with `manage.py partition_request_logs --setup`, then enable
+IP_TRACKING_PARTITIONED_LOGS = False
+IP_TRACKING_PARTITION_DAYS_AHEAD = 7  # Daily partitions created ahead of time
+
+# Hourly rollups and raw log retention
+IP_TRACKING_ROLLUP_LAG_HOURS = 2  # Rolled-up hours recomputed each run to catch late enrichment
+IP_TRACKING_ROLLUP_MAX_HOURS = 24  # Hours rolled up per run
+IP_TRACKING_RAW_LOG_RETENTION_DAYS = 30  # Raw RequestLog rows older than this are deleted
+IP_TRACKING_PURGE_BATCH_SIZE = 10000  # Rows deleted per statement
+IP_TRACKING_PURGE_MAX_BATCHES = 100  # Statements per purge run
+
+# Request log sink: 'ip_tracking.sinks.DatabaseSink' (buffered inserts) or
+# 'ip_tracking.sinks.SegmentFileSink' (binary segment files, loaded with
+# `manage.py load_log_segments`)
+IP_TRACKING_LOG_SINK = 'ip_tracking.sinks.DatabaseSink'
+IP_TRACKING_SEGMENT_DIR = BASE_DIR / 'request_log_segments'
+IP_TRACKING_SEGMENT_MAX_BYTES = 64 * 1024 * 1024  # Rotate segments at this size
+IP_TRACKING_SEGMENT_MAX_AGE = 300  # Rotate segments after this many seconds
+IP_TRACKING_SEGMENT_FSYNC = 'interval'  # 'always', 'interval' or 'never'; fsyncs run off the request path
+IP_TRACKING_SEGMENT_FSYNC_INTERVAL = 1.0  # Seconds between fsyncs with 'interval'
+IP_TRACKING_SEGMENT_HOOK_INTERVAL = 5.0  # Seconds between flush hooks (in-stream detection flags)
+IP_TRACKING_SEGMENT_DETECT_LOCK_TIMEOUT = 300  # Seconds before a crashed detect_from_log_segments run's lock expires
+
+# Clients allowed to read /api/metrics/ (None allows every client)
+IP_TRACKING_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Active SuspiciousIP addresses get a stricter global rate limit. The set is
+# reloaded every IP_TRACKING_SUSPICIOUS_REFRESH_INTERVAL seconds. A tarpit delay
+# holds a worker for its duration, so keep it short on sync servers.
+IP_TRACKING_SUSPICIOUS_RATE = '30/m'
+IP_TRACKING_SUSPICIOUS_REFRESH_INTERVAL = 30
+IP_TRACKING_SUSPICIOUS_TARPIT_SECONDS = 0
+
+# RequestLog admin: filtered lists count at most this many rows; unfiltered
+# lists show the database's row estimate
+IP_TRACKING_ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Dashboard analytics under /api/analytics/<report>/. Reports cover whole time
+# buckets and are cached per bucket, so polls within a bucket cost no queries.
+IP_TRACKING_ANALYTICS_BUCKET_SECONDS = 60
+IP_TRACKING_ANALYTICS_MAX_WINDOW = 31 * 86400  # Longest ?window= accepted, in seconds
+IP_TRACKING_ANALYTICS_ALLOWED_IPS = ['127.0.0.1', '::1']  # None allows every client
+
+# Clients allowed to stream RequestLog exports from /api/export/ (None allows every client)
+IP_TRACKING_EXPORT_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Hourly detection fan-out: above 1, the window is split into this many IPv4
+# address ranges plus one IPv6 range, run as a Celery chord and written in one
+# upsert. Chords need a result backend shared by the workers.
+IP_TRACKING_DETECTION_SHARDS = 1
+
+# Fixed-memory traffic sketches fed by the middleware (Count-Min per-IP counts,
+# Space-Saving top-K IPs/paths, HyperLogLog distinct IPs). Each process
+# publishes one sketch per interval to the cache, which must be shared for
+# the merged views in /api/analytics/live-*/ and detect_heavy_hitters.
+IP_TRACKING_SKETCHES_ENABLED = True
+IP_TRACKING_SKETCH_INTERVAL = 60  # Seconds covered by each published sketch
+IP_TRACKING_SKETCH_PUBLISH_INTERVAL = 5  # Seconds between publishes of the current sketch
+IP_TRACKING_SKETCH_RETENTION = 7200  # Seconds published sketches are kept
+IP_TRACKING_SKETCH_TOP_K = 200  # Entries in each Space-Saving summary
+IP_TRACKING_SKETCH_CMS_WIDTH = 2048  # Count-Min counters per row
+IP_TRACKING_SKETCH_CMS_DEPTH = 4  # Count-Min rows
+IP_TRACKING_SKETCH_HLL_PRECISION = 12  # 4096 registers, about 1.6% error